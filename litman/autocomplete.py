@@ -0,0 +1,331 @@
+"""In-memory completion of citation keys, keyword names and author names.
+
+Each kind of name is held in a sorted array of the positions where a word
+starts in a name, so a completion is a binary search followed by a short
+scan. Completions match the start of a name or of any word in it, and are
+ranked by how often the name is used: the number of links of a keyword or
+an author, and the number of collections an entry is in.
+
+The index is built once and then follows the transaction log: a
+background thread waits for commits and applies only the log rows written
+since the last refresh. Completions never touch the database.
+"""
+
+import bisect
+import collections
+import heapq
+import logging
+import re
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from litman.author import Author
+from litman.db_connector import DB
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a commit before checking the log anyway, which also
+# catches writes by other processes.
+_refresh_timeout = 30.0
+# Seconds to wait after a failed refresh, doubled up to the refresh timeout.
+_retry_delay = 1.0
+# The most index positions scanned per completion, to bound its latency.
+_scan_limit = 5000
+# Changed names of one kind above which its index is built anew instead of
+# edited, as every edit shifts the sorted positions.
+_rebuild_size = 500
+_word = re.compile(r"[^\W\d_]+|\d+")
+
+
+@dataclass
+class Completion:
+    id: uuid.UUID
+    name: str
+    usage: int
+    # The row the name was made from, as selected by the kind.
+    data: tuple
+
+
+@dataclass(frozen=True)
+class _Kind:
+    table: str
+    load_q: str
+    name: Callable[[tuple], str]
+    # The link table counting the usage, its column holding the id, and
+    # the side of its log rows (0 for id_left, 1 for id_right) holding it.
+    link_table: str
+    link_column: str
+    link_side: int
+
+    @property
+    def usage_q(self) -> str:
+        column = self.link_column
+        return (
+            f"SELECT {column}, count(*) FROM {self.link_table} {{}} GROUP BY {column}"
+        )
+
+
+KINDS = {
+    "key": _Kind(
+        "entry",
+        "SELECT id, key FROM entry",
+        lambda row: row[1],
+        "collection_link",
+        "entry_id",
+        0,
+    ),
+    "keyword": _Kind(
+        "keyword",
+        "SELECT id, name FROM keyword",
+        lambda row: row[1],
+        "keyword_link",
+        "keyword_id",
+        0,
+    ),
+    "author": _Kind(
+        "author",
+        "SELECT {} FROM author".format(", ".join(Author.names)),
+        lambda row: str(Author(*row)),
+        "author_link",
+        "author_id",
+        0,
+    ),
+}
+
+
+class _CompletionIndex:
+    """The names of one kind, by the positions where their words start."""
+
+    def __init__(self):
+        self.rows: dict[uuid.UUID, tuple] = {}
+        self.names: dict[uuid.UUID, str] = {}
+        self.usage: collections.Counter[uuid.UUID] = collections.Counter()
+        self._positions: list[tuple[str, uuid.UUID]] = []
+
+    @staticmethod
+    def _suffixes(name: str) -> set[str]:
+        folded = name.casefold()
+        return {folded} | {folded[m.start() :] for m in _word.finditer(folded)}
+
+    def add(self, id: uuid.UUID, name: str, row: tuple) -> None:
+        self.remove(id)
+        self.rows[id] = row
+        self.names[id] = name
+        for suffix in self._suffixes(name):
+            bisect.insort(self._positions, (suffix, id))
+
+    def remove(self, id: uuid.UUID) -> None:
+        name = self.names.pop(id, None)
+        self.rows.pop(id, None)
+        if name is None:
+            return
+        for suffix in self._suffixes(name):
+            i = bisect.bisect_left(self._positions, (suffix, id))
+            if i < len(self._positions) and self._positions[i] == (suffix, id):
+                del self._positions[i]
+
+    def build(self, entries: list[tuple[uuid.UUID, str, tuple]]) -> None:
+        self.rows = {id: row for id, _, row in entries}
+        self.names = {id: name for id, name, _ in entries}
+        self._positions = sorted(
+            (suffix, id) for id, name, _ in entries for suffix in self._suffixes(name)
+        )
+
+    def complete(self, text: str, k: int) -> list[Completion]:
+        text = text.casefold()
+        start = bisect.bisect_left(self._positions, (text,))
+        end = min(len(self._positions), start + _scan_limit)
+        found = set()
+        for i in range(start, end):
+            suffix, id = self._positions[i]
+            if not suffix.startswith(text):
+                break
+            found.add(id)
+        best = heapq.nsmallest(
+            k,
+            found,
+            key=lambda id: (
+                -self.usage[id],
+                not self.names[id].casefold().startswith(text),
+                self.names[id],
+            ),
+        )
+        return [
+            Completion(id, self.names[id], self.usage[id], self.rows[id]) for id in best
+        ]
+
+
+class Autocomplete:
+    """Completions for all kinds of names, following the database."""
+
+    def __init__(self, db: DB):
+        self.db = db
+        self._indexes = {kind: _CompletionIndex() for kind in KINDS}
+        self._position: tuple[int, int] | None = None
+        self._replaced = db.replaced
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def complete(self, kind: str, text: str, k: int = 10) -> list[Completion]:
+        """The ``k`` most used names of ``kind`` with a word starting with ``text``."""
+        if self._thread is None:
+            self.refresh()
+        self._ready.wait()
+        with self._lock:
+            return self._indexes[kind].complete(text, k)
+
+    def start(self) -> None:
+        """Keep the index up to date in a background thread, and refresh it
+        before the logs are pruned."""
+        self.db.before_compaction(self.refresh)
+        self._thread = threading.Thread(
+            target=self._follow, name="litman-autocomplete", daemon=True
+        )
+        self._thread.start()
+
+    def _follow(self) -> None:
+        """Refresh on every commit, retrying failed refreshes with a back off."""
+        delay = _retry_delay
+        while True:
+            try:
+                position = self.refresh()
+                delay = _retry_delay
+                self.db.wait_for_changes(position, _refresh_timeout)
+            except Exception as err:
+                logger.error(f"Autocomplete failed to refresh, retrying in {delay}s.")
+                logger.exception(err)
+                self.db.release()
+                time.sleep(delay)
+                delay = min(2 * delay, _refresh_timeout)
+
+    def refresh(self) -> tuple[int, int]:
+        """Apply the changes logged since the last refresh.
+
+        The index is rebuilt if the log can not tell what changed: before
+        the first refresh, after a bootstrap, or when compaction removed
+        rows that were not applied yet.
+        """
+        with self._refresh_lock:
+            position = self.db.log_position()
+            if (
+                self._position is None
+                or self._replaced != self.db.replaced
+                or any(h > p for h, p in zip(self.db.log_horizon(), self._position))
+                or any(now < then for now, then in zip(position, self._position))
+            ):
+                self._rebuild(position)
+            elif position != self._position:
+                self._apply_log(position)
+        self._ready.set()
+        return position
+
+    def _rebuild(self, position: tuple[int, int]) -> None:
+        replaced = self.db.replaced
+        indexes = {}
+        for kind, spec in KINDS.items():
+            index = _CompletionIndex()
+            rows = self.db.cursor.execute(spec.load_q).fetchall()
+            index.build([(row[0], spec.name(row), tuple(row)) for row in rows])
+            index.usage.update(
+                dict(self.db.cursor.execute(spec.usage_q.format("")).fetchall())
+            )
+            indexes[kind] = index
+        with self._lock:
+            self._indexes = indexes
+            self._position = position
+            self._replaced = replaced
+        logger.info("Built the autocomplete index.")
+
+    def _apply_log(self, position: tuple[int, int]) -> None:
+        """Reload the names changed in the log and recount the usage of the
+        names with changed links.
+
+        Usage is counted again rather than adjusted by the logged links, as
+        compaction may collapse the log rows of a link.
+        """
+        since = self._position
+        tables = {spec.table: kind for kind, spec in KINDS.items()}
+        links = {spec.link_table: kind for kind, spec in KINDS.items()}
+        changed = collections.defaultdict(set)
+        for id, source in self.db.cursor.execute(
+            "SELECT id, source FROM transaction_log "
+            "WHERE seq > ? AND seq <= ? AND source IN ({})".format(
+                ", ".join("?" for _ in tables)
+            ),
+            (since[0], position[0], *tables),
+        ).fetchall():
+            changed[tables[source]].add(id)
+        linked = collections.defaultdict(set)
+        for *ids, source in self.db.cursor.execute(
+            "SELECT id_left, id_right, source FROM transaction_log_link "
+            "WHERE seq > ? AND seq <= ? AND source IN ({})".format(
+                ", ".join("?" for _ in links)
+            ),
+            (since[1], position[1], *links),
+        ).fetchall():
+            kind = links[source]
+            linked[kind].add(ids[KINDS[kind].link_side])
+        reloaded = {}
+        for kind, ids in changed.items():
+            ids = list(ids)
+            rows = self._select(KINDS[kind].load_q + " {}", "id", ids)
+            reloaded[kind] = (ids, {row[0]: tuple(row) for row in rows})
+        # Large batches are built outside the lock and swapped in.
+        rebuilt = {
+            kind: self._rebuilt(kind, ids, rows)
+            for kind, (ids, rows) in reloaded.items()
+            if len(ids) > _rebuild_size
+        }
+        recounted = {}
+        for kind, ids in linked.items():
+            spec = KINDS[kind]
+            ids = list(ids)
+            recounted[kind] = (
+                ids,
+                dict(self._select(spec.usage_q, spec.link_column, ids)),
+            )
+        with self._lock:
+            self._indexes.update(rebuilt)
+            for kind, (ids, rows) in reloaded.items():
+                if kind in rebuilt:
+                    continue
+                index = self._indexes[kind]
+                for id in ids:
+                    if id in rows:
+                        index.add(id, KINDS[kind].name(rows[id]), rows[id])
+                    else:
+                        index.remove(id)
+            for kind, (ids, counts) in recounted.items():
+                usage = self._indexes[kind].usage
+                for id in ids:
+                    usage[id] = counts.get(id, 0)
+            self._position = position
+
+    def _rebuilt(
+        self, kind: str, ids: list[uuid.UUID], rows: dict[uuid.UUID, tuple]
+    ) -> _CompletionIndex:
+        """A new index of ``kind`` with the names of ``ids`` reloaded from
+        ``rows``, or removed if they are not in it."""
+        current = self._indexes[kind]
+        entries = {id: (current.names[id], row) for id, row in current.rows.items()}
+        for id in ids:
+            entries.pop(id, None)
+        for id, row in rows.items():
+            entries[id] = (KINDS[kind].name(row), row)
+        index = _CompletionIndex()
+        index.build([(id, name, row) for id, (name, row) in entries.items()])
+        index.usage = current.usage.copy()
+        return index
+
+    def _select(self, query: str, column: str, ids: list) -> list[tuple]:
+        """The rows of ``query`` with ``column`` in ``ids``."""
+        rows = []
+        for chunk in self.db.chunks(ids):
+            where = "WHERE {} IN ({})".format(column, ", ".join("?" for _ in chunk))
+            rows.extend(self.db.cursor.execute(query.format(where), chunk).fetchall())
+        return rows
@@ -1,8 +1,16 @@
+import contextlib
 import logging
-import subprocess
+import os
+import queue
 import pathlib
 import sqlite3
+import tempfile
+import threading
+import time
 import uuid
+from typing import Callable, Iterable, Iterator
+
+from litman.query_stats import InstrumentedCursor, QueryStats
 
 logger = logging.getLogger(__name__)
 _build_scripts = [
@@ -15,14 +23,86 @@ _build_scripts = [
     "author",
 ]
 
+# Number of rows per chunk of a transaction export.
+_export_chunk_rows = 1000
+# Number of values bound in one IN list, well below the host parameter
+# limit of SQLite.
+_in_chunk_size = 500
+# Number of pages copied per step of an online backup. Writers can commit
+# between two steps.
+_backup_step_pages = 1024
+# Never the origin of a log row, used when no origin is excluded.
+_no_origin = uuid.UUID(int=0)
+# Seconds between checks for changes written outside of ``transaction``.
+_change_poll_interval = 1.0
+
 sqlite3.register_adapter(uuid.UUID, lambda u: u.bytes)
 sqlite3.register_converter("uuid", lambda b: uuid.UUID(bytes=b))
 
 
+class Transaction:
+    """A unit of work on the connection of one thread, see ``DB.transaction``.
+
+    Writes whose order does not matter (e.g. inserting links) can be
+    deferred. They are grouped by statement and run with one ``executemany``
+    per statement when the outermost transaction commits, so reads inside the
+    transaction do not see them yet.
+    """
+
+    parent: "Transaction | None"
+    savepoint: str | None
+
+    def __init__(self, db: "DB", parent: "Transaction | None"):
+        self.db = db
+        self.parent = parent
+        self.savepoint = None
+        if parent is not None:
+            depth = 1
+            while parent.parent is not None:
+                parent, depth = parent.parent, depth + 1
+            self.savepoint = f"litman_sp_{depth}"
+        self._deferred: dict[str, list[tuple]] = {}
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.db.cursor.execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+        return self.db.cursor.executemany(sql, seq_of_parameters)
+
+    def defer(self, sql: str, parameters=()) -> None:
+        """Queue a write until the transaction is flushed."""
+        self._deferred.setdefault(sql, []).append(tuple(parameters))
+
+    def flush(self) -> None:
+        """Run all deferred writes."""
+        deferred, self._deferred = self._deferred, {}
+        for sql, parameters in deferred.items():
+            self.db.cursor.executemany(sql, parameters)
+
+    def _merge_into_parent(self) -> None:
+        for sql, parameters in self._deferred.items():
+            self.parent._deferred.setdefault(sql, []).extend(parameters)
+        self._deferred = {}
+
+
 class DB:
+    """Handle to the litman database.
+
+    Every thread works on its own connection, which is taken from a pool on
+    first use and handed back with ``release``. The database runs in WAL mode,
+    so readers do not block each other or the (single) writer.
+    """
+
     db_file: pathlib.Path
-    connection: sqlite3.Connection
-    cursor: sqlite3.Cursor
+    pool_size: int
+    busy_timeout: float
+    stats: QueryStats
+    # Counts the replacements of the content by ``bootstrap``.
+    replaced: int
+
+    _local: threading.local
+    _pool: queue.LifoQueue
+    _generation: int
 
     _tables = [
         "entry",
@@ -41,19 +121,181 @@ class DB:
         "keyword_link": ("keyword_id", "entry_id"),
     }
     _schema: dict
+    # The transaction types: insert, update and delete.
+    _actions = (1, 2, 3)
 
-    def __init__(self, db_file: pathlib.Path):
+    def __init__(
+        self,
+        db_file: pathlib.Path,
+        pool_size: int = 8,
+        busy_timeout: float = 30.0,
+        slow_query_ms: float | None = None,
+        slow_query_log: pathlib.Path | None = None,
+    ):
         self.db_file = db_file
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.stats = QueryStats(slow_query_ms, slow_query_log)
+        self._local = threading.local()
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._generation = 0
+        self.replaced = 0
+        # Notified after every commit of a transaction.
+        self._committed = threading.Condition()
+        # Run before the logs are pruned, see ``before_compaction``.
+        self._compaction_hooks: list[Callable[[], None]] = []
         build = not self.db_file.exists()
-        self.connection = sqlite3.connect(
+        if build:
+            self._build_database()
+        self.migrate()
+        self._load_schema()
+
+    ###
+    ### Connection Handling
+    ###
+
+    def _connect(self) -> sqlite3.Connection:
+        # The connections are handed between threads by the pool, but only
+        # ever used by one thread at a time.
+        connection = sqlite3.connect(
             self.db_file,
+            timeout=self.busy_timeout,
             check_same_thread=False,
             detect_types=sqlite3.PARSE_DECLTYPES,
         )
-        self.cursor = self.connection.cursor()
-        if build:
-            self._build_database()
-        self._load_schema()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def _acquire(self) -> tuple[sqlite3.Connection, int]:
+        try:
+            connection, generation = self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect(), self._generation
+        if generation != self._generation:
+            # The database was replaced since this connection was pooled.
+            connection.close()
+            return self._connect(), self._generation
+        return connection, generation
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection, generation = self._acquire()
+            self._local.connection = connection
+            self._local.generation = generation
+            self._local.cursor = self.new_cursor()
+        return connection
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        """The cursor of the current thread."""
+        self.connection  # Make sure that this thread holds a connection.
+        return self._local.cursor
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        """Run a statement on the cursor of the current thread."""
+        return self.cursor.execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+        return self.cursor.executemany(sql, seq_of_parameters)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[Transaction]:
+        """Run a block of writes as one transaction.
+
+        The outermost transaction takes the write lock right away and
+        commits once at the end, or rolls back if the block raises.
+        Nested transactions are savepoints, so a failing inner block only
+        undoes its own writes.
+        """
+        parent = getattr(self._local, "transaction", None)
+        transaction = Transaction(self, parent)
+        if parent is None:
+            if not self.connection.in_transaction:
+                self.cursor.execute("BEGIN IMMEDIATE")
+        else:
+            self.cursor.execute(f"SAVEPOINT {transaction.savepoint}")
+        self._local.transaction = transaction
+        try:
+            yield transaction
+            if parent is None:
+                transaction.flush()
+        except BaseException as err:
+            self._local.transaction = parent
+            if parent is None:
+                self.connection.rollback()
+            else:
+                self.cursor.execute(f"ROLLBACK TO {transaction.savepoint}")
+                self.cursor.execute(f"RELEASE {transaction.savepoint}")
+            raise err
+        self._local.transaction = parent
+        if parent is None:
+            self.connection.commit()
+            with self._committed:
+                self._committed.notify_all()
+        else:
+            transaction._merge_into_parent()
+            self.cursor.execute(f"RELEASE {transaction.savepoint}")
+
+    def new_cursor(self) -> sqlite3.Cursor:
+        """A separate cursor on the connection of the current thread.
+
+        This is needed to iterate over a result while using ``cursor``.
+        """
+        cursor = self.connection.cursor(factory=InstrumentedCursor)
+        cursor.stats = self.stats
+        return cursor
+
+    def flush_stats(self) -> None:
+        """Record the pending statement of the current thread."""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is not None:
+            cursor.flush()
+
+    def release(self) -> None:
+        """Hand the connection of the current thread back to the pool.
+
+        Changes that were not committed are rolled back, so a request
+        can never leak a half done transaction into the next one.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        generation = self._local.generation
+        self._local.cursor.flush()
+        self._local.transaction = None
+        del self._local.connection, self._local.cursor, self._local.generation
+        if connection.in_transaction:
+            logger.warning("Rolling back uncommitted changes on release.")
+            connection.rollback()
+        if generation != self._generation:
+            connection.close()
+            return
+        try:
+            self._pool.put_nowait((connection, generation))
+        except queue.Full:
+            connection.close()
+
+    def close(self) -> None:
+        """Close the connection of this thread and all pooled connections.
+
+        Connections that are checked out by other threads are closed when
+        they are released.
+        """
+        self._generation += 1
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            del self._local.connection, self._local.cursor, self._local.generation
+            connection.close()
+        while True:
+            try:
+                connection, _ = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
 
     def _load_schema(self):
         # Load the schemas from the list of tables
@@ -86,127 +328,766 @@ class DB:
         self.connection.commit()
         return
 
+    ###
+    ### Migrations
+    ###
+
+    @property
+    def schema_version(self) -> int:
+        """The number of the last migration applied to the database."""
+        return self.cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> None:
+        """Apply all migrations newer than the schema version.
+
+        Migrations are the numbered scripts in ``scripts/migrations``
+        (``0001_name.sql``, ...). Each one runs in its own transaction
+        together with the bump of the schema version, so a failing
+        migration leaves the database at the previous version.
+        """
+        version = self.schema_version
+        migrations_path = pathlib.Path("./scripts/migrations")
+        for script in sorted(migrations_path.glob("*.sql")):
+            number = int(script.name.split("_", 1)[0])
+            if number <= version:
+                continue
+            logger.info(f"Applying migration '{script.name}' to {self.db_file}")
+            try:
+                self.cursor.executescript(
+                    f"BEGIN;\n{script.read_text()}\n"
+                    f"PRAGMA user_version = {number};\nCOMMIT;"
+                )
+            except Exception as err:
+                self.connection.rollback()
+                logger.error(f"Migration '{script.name}' failed.")
+                raise err
+        return
+
+    ###
+    ### Transaction Logs
+    ###
+
+    # Within the window of unacknowledged rows, the history of an id is
+    # replaced by its last row, which keeps the highest sequence number. A
+    # reader at any position in the window thus still sees the id change
+    # and gets its current state: the last row becomes an insert if the
+    # history started with one, and a delete stays a delete, which is a
+    # no-op for readers that never saw the insert. Rows of different
+    # origins are never merged, as they are exported to different peers.
+    _compact_log_window = """
+        WITH recent AS (
+            SELECT
+                rowid AS rid,
+                type,
+                first_value(type) OVER w AS first_type,
+                row_number() OVER w AS n,
+                count(*) OVER w AS total
+            FROM {table} WHERE seq > ?
+            WINDOW w AS (
+                PARTITION BY {group} ORDER BY rowid
+                ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+            )
+        )"""
+    _compact_log_q = (
+        _compact_log_window.format(table="transaction_log", group="source, id, origin")
+        + """
+        UPDATE transaction_log SET type = 1 WHERE rowid IN (
+            SELECT rid FROM recent
+            WHERE n = total AND total > 1 AND first_type = 1 AND type = 2
+        )"""
+    )
+    _compact_log_delete_q = (
+        _compact_log_window.format(table="transaction_log", group="source, id, origin")
+        + """
+        DELETE FROM transaction_log WHERE rowid IN (
+            SELECT rid FROM recent WHERE n < total
+        )"""
+    )
+    # Links are only inserted and deleted, so the last row is their state.
+    _compact_log_link_q = (
+        _compact_log_window.format(
+            table="transaction_log_link", group="source, id_left, id_right, origin"
+        )
+        + """
+        DELETE FROM transaction_log_link WHERE rowid IN (
+            SELECT rid FROM recent WHERE n < total
+        )"""
+    )
+    # An update exports the current row, so only the latest one is needed.
+    _collapse_updates_q = """
+        DELETE FROM transaction_log WHERE type = 2 AND rowid NOT IN (
+            SELECT max(rowid) FROM transaction_log WHERE type = 2
+            GROUP BY source, id, origin
+        )"""
+
+    def compact_transaction_logs(
+        self,
+        oldest: tuple[int, int] | None = None,
+        newest: tuple[int, int] | None = None,
+    ) -> int:
+        """Shrink the transaction logs without changing what any export leads to.
+
+        ``oldest`` and ``newest`` are the lowest and highest ``log_position``
+        acknowledged by a peer. They default to the ``sync_cursor`` of all
+        peers: the single server on a client, all clients on a server.
+
+        * Rows up to ``oldest`` have been seen by every peer and are pruned.
+        * Rows after ``newest`` have not been seen by any peer, so the rows
+          of an id are collapsed to its last one.
+        * Repeated updates of an id are collapsed to the latest one.
+
+        Positions are used rather than dates, as rows logged while a sync
+        is running are dated before it but were not part of it.
+
+        Returns:
+            The number of log rows removed.
+        """
+        if oldest is None and newest is None:
+            cursors = self.cursor.execute(
+                "SELECT min(log_position), min(link_position), "
+                "max(log_position), max(link_position) FROM sync_cursor"
+            ).fetchone()
+            if cursors[0] is not None:
+                oldest, newest = tuple(cursors[:2]), tuple(cursors[2:])
+        if oldest is not None:
+            for hook in self._compaction_hooks:
+                try:
+                    hook()
+                except Exception as err:
+                    logger.error("A hook before compacting the logs failed.")
+                    logger.exception(err)
+        # The cursor reports no rowcount for statements starting with WITH.
+        changes = self.connection.total_changes
+        with self.transaction() as transaction:
+            if oldest is not None:
+                for table, seq in zip(
+                    ("transaction_log", "transaction_log_link"), oldest
+                ):
+                    transaction.execute(f"DELETE FROM {table} WHERE seq <= ?", (seq,))
+                self._move_horizon(transaction, oldest)
+            if newest is not None:
+                transaction.execute(self._compact_log_q, (newest[0],))
+                transaction.execute(self._compact_log_delete_q, (newest[0],))
+                transaction.execute(self._compact_log_link_q, (newest[1],))
+            transaction.execute(self._collapse_updates_q)
+            removed = self.connection.total_changes - changes
+        logger.info(f"Removed {removed} transaction log rows.")
+        return removed
+
     def _clear_transaction_logs(self):
         """This function clears the transaction log tables."""
-        self.cursor.execute("DELETE FROM transaction_log")
-        self.cursor.execute("DELETE FROM transaction_log_link")
-        self.connection.commit()
+        with self.transaction() as transaction:
+            transaction.execute("DELETE FROM transaction_log")
+            transaction.execute("DELETE FROM transaction_log_link")
+            self._move_horizon(transaction, self.log_position())
 
-    def export_transactions(self, last_sync: int = None):
-        if last_sync is None:
-            last_sync = self.cursor.execute("SELECT max(date) FROM sync_log").fetchone()
-            if last_sync is None:
-                raise ValueError("No last sync log found.")
-            last_sync = last_sync[0]
-        export = {}
-        for table in self._tables:
-            transactions = self.cursor.execute(
-                "SELECT * FROM transaction_log WHERE source == ? AND date >= ?",
-                (table, last_sync),
-            ).fetchall()
-            insert_ids = [e[0] for e in transactions if e[3] == 1]
-            if insert_ids:
-                inserts = self.cursor.execute(
-                    f"SELECT * FROM {table} WHERE id IN ({', '.join('?' for _ in insert_ids)})",
-                    insert_ids,
-                ).fetchall()
-            else:
-                inserts = []
-            update_ids = [e[0] for e in transactions if e[3] == 2]
-            if update_ids:
-                updates = self.cursor.execute(
-                    f"SELECT * FROM {table} WHERE id IN ({', '.join('?' for _ in update_ids)})",
-                    update_ids,
-                ).fetchall()
-            else:
-                updates = []
-            delete_ids = [e[0] for e in transactions if e[3] == 3]
-            export[table] = {
-                "transactions": transactions,
-                "insert_ids": insert_ids,
-                "update_ids": update_ids,
-                "delete_ids": delete_ids,
-                "inserts": inserts,
-                "updates": updates,
-            }
-        ln_q = (
-            "SELECT id_left, id_right, source FROM "
-            "transaction_log_link WHERE type = ? AND date >= ?"
+    def before_compaction(self, hook: Callable[[], None]) -> None:
+        """Run ``hook`` before the logs are pruned.
+
+        An index following the logs refreshes itself here. Otherwise the
+        horizon moves past its position, and it has to be rebuilt.
+        """
+        self._compaction_hooks.append(hook)
+
+    def _move_horizon(
+        self, transaction: Transaction, position: tuple[int, int]
+    ) -> None:
+        """Record that the logs up to ``position`` were removed."""
+        transaction.execute(
+            "UPDATE log_horizon SET log_position = max(log_position, ?), "
+            "link_position = max(link_position, ?)",
+            tuple(position),
         )
-        ln_inserts = self.cursor.execute(ln_q, (1, last_sync)).fetchall()
-        ln_deletes = self.cursor.execute(ln_q, (3, last_sync)).fetchall()
-        result = {
+
+    def log_horizon(self) -> tuple[int, int]:
+        """The oldest ``log_position`` the logs can be replayed from."""
+        return self.cursor.execute(
+            "SELECT log_position, link_position FROM log_horizon"
+        ).fetchone()
+
+    # The net action per id since the last sync, joined with the current
+    # row. Ids that were inserted and deleted again are skipped, as are
+    # inserts and updates of rows that no longer exist. Deletes and updates
+    # come before inserts, so a unique key is freed before it is reused.
+    _stream_q = """
+        SELECT log.action, {columns} FROM (
+            SELECT
+                id,
+                CASE
+                    WHEN last_type = 3 THEN 3
+                    WHEN first_type = 1 THEN 1
+                    ELSE 2
+                END AS action
+            FROM (
+                SELECT
+                    id,
+                    first_value(type) OVER w AS first_type,
+                    last_value(type) OVER w AS last_type,
+                    row_number() OVER w AS n
+                FROM transaction_log
+                WHERE source = ? AND rowid > ? AND rowid <= ? {date}
+                    AND origin IS NOT ?
+                WINDOW w AS (
+                    PARTITION BY id ORDER BY rowid
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                )
+            )
+            WHERE n = 1 AND NOT (first_type = 1 AND last_type = 3)
+        ) AS log
+        LEFT JOIN {table} AS t ON t.id = log.id
+        WHERE log.action = 3 OR t.id IS NOT NULL
+        ORDER BY log.action DESC, log.id"""
+    _stream_links_q = """
+        SELECT type, id_left, id_right FROM (
+            SELECT
+                id_left,
+                id_right,
+                type,
+                first_value(type) OVER w AS first_type,
+                row_number() OVER w AS n,
+                count(*) OVER w AS total
+            FROM transaction_log_link
+            WHERE source = ? AND rowid > ? AND rowid <= ? {date}
+                AND origin IS NOT ?
+            WINDOW w AS (
+                PARTITION BY id_left, id_right ORDER BY rowid
+                ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+            )
+        )
+        WHERE n = total AND first_type = type
+        ORDER BY type DESC"""
+
+    def last_sync(self) -> int:
+        """The date of the last sync of this database."""
+        last_sync = self.cursor.execute("SELECT max(date) FROM sync_log").fetchone()
+        if last_sync[0] is None:
+            raise ValueError("No last sync log found.")
+        return last_sync[0]
+
+    def sync_identity(self) -> uuid.UUID:
+        """The identity of this database towards its sync peers."""
+        return self.cursor.execute("SELECT id FROM sync_identity").fetchone()[0]
+
+    def sync_peer(self) -> uuid.UUID | None:
+        """The identity of the peer of the last sync, if one is known."""
+        peer = self.cursor.execute(
+            "SELECT origin FROM sync_log "
+            "WHERE origin IS NOT NULL ORDER BY rowid DESC LIMIT 1"
+        ).fetchone()
+        return None if peer is None else peer[0]
+
+    def sync_cursor(self, client_id: uuid.UUID) -> tuple[int, int] | None:
+        """The position in the local logs a peer acknowledged.
+
+        On the server there is one cursor per client, on a client the one
+        of its server.
+        """
+        cursor = self.cursor.execute(
+            "SELECT log_position, link_position FROM sync_cursor WHERE client_id = ?",
+            (client_id,),
+        ).fetchone()
+        return None if cursor is None else tuple(cursor)
+
+    def acknowledge(self, client_id: uuid.UUID, position: tuple[int, int]) -> None:
+        """Record that a peer has all local changes up to ``position``."""
+        with self.transaction() as transaction:
+            transaction.execute(
+                "INSERT INTO sync_cursor VALUES (?, ?, ?, unixepoch()) "
+                "ON CONFLICT(client_id) DO UPDATE SET "
+                "log_position = excluded.log_position, "
+                "link_position = excluded.link_position, date = excluded.date",
+                (client_id, *position),
+            )
+        return
+
+    def wait_for_changes(
+        self, position: tuple[int, int], timeout: float
+    ) -> tuple[int, int]:
+        """Wait up to ``timeout`` seconds for the logs to move past ``position``.
+
+        Commits through ``transaction`` wake the waiters right away. Other
+        writers, e.g. other processes, are noticed within a second.
+
+        Returns:
+            The current ``log_position``.
+        """
+        deadline = time.monotonic() + timeout
+        while (current := self.log_position()) == tuple(position):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._committed:
+                self._committed.wait(min(remaining, _change_poll_interval))
+        return current
+
+    def change_summary(
+        self,
+        since: tuple[int, int],
+        until: tuple[int, int],
+        exclude_origin: uuid.UUID | None = None,
+    ) -> dict[str, int]:
+        """The number of changed rows per table between two positions."""
+        if exclude_origin is None:
+            exclude_origin = _no_origin
+        rows = self.cursor.execute(
+            "SELECT source, count(DISTINCT id) FROM transaction_log "
+            "WHERE rowid > ? AND rowid <= ? AND origin IS NOT ? GROUP BY source "
+            "UNION ALL "
+            "SELECT source, count(*) FROM transaction_log_link "
+            "WHERE rowid > ? AND rowid <= ? AND origin IS NOT ? GROUP BY source",
+            (since[0], until[0], exclude_origin, since[1], until[1], exclude_origin),
+        ).fetchall()
+        return dict(rows)
+
+    def sync_position(self) -> tuple[int, int] | None:
+        """The server ``log_position`` of the last sync, if one is known."""
+        position = self.cursor.execute(
+            "SELECT log_position, link_position FROM sync_log "
+            "WHERE log_position IS NOT NULL ORDER BY rowid DESC LIMIT 1"
+        ).fetchone()
+        return None if position is None else tuple(position)
+
+    def log_position(self) -> tuple[int, int]:
+        """The last sequence number of the transaction log and the link log.
+
+        Sequence numbers are never reused, so a position stays valid after
+        the rows up to it have been deleted.
+        """
+        return tuple(
+            self.cursor.execute(
+                "SELECT coalesce((SELECT seq FROM sqlite_sequence WHERE name = ?), 0)",
+                (t,),
+            ).fetchone()[0]
+            for t in ("transaction_log", "transaction_log_link")
+        )
+
+    def stream_transactions(
+        self,
+        last_sync: int,
+        until: tuple[int, int] | None = None,
+        chunk_size: int = _export_chunk_rows,
+        since: tuple[int, int] = (0, 0),
+        exclude_origin: uuid.UUID | None = None,
+    ) -> Iterator[tuple[str, int, list[tuple]]]:
+        """Yield the changes since ``last_sync``.
+
+        The log of every table is read once and joined with the current rows
+        in SQL, so nothing but the current chunk is held in memory.
+        ``since`` and ``until`` limit the export to the log after and up to
+        a ``log_position``. Changes imported from ``exclude_origin`` are
+        skipped, so a peer never gets its own changes back.
+
+        Yields:
+            Chunks of ``(table, action, rows)``, where the action is the
+            transaction type (1: insert, 2: update, 3: delete). Inserts and
+            updates carry the full row, deletes only the id. Link rows are
+            the two ids of the link. All entity tables come before the
+            link tables.
+        """
+        if until is None:
+            until = (2**63 - 1, 2**63 - 1)
+        log_until, link_until = until
+        log_since, link_since = since
+        if exclude_origin is None:
+            exclude_origin = _no_origin
+        # The date is only a filter without a position, as it would keep
+        # SQLite from seeking the rowid range in transaction_log_source_seq.
+        date, date_args = ("AND date >= ?", (last_sync,)) if last_sync else ("", ())
+        cursor = self.new_cursor()
+        for table in self._tables:
+            columns = ", ".join(
+                "log.id" if c == "id" else f"t.{c}" for c in self._schema[table]
+            )
+            cursor.execute(
+                self._stream_q.format(table=table, columns=columns, date=date),
+                (table, log_since, log_until, *date_args, exclude_origin),
+            )
+            yield from self._chunk_actions(table, cursor, chunk_size, delete_width=1)
+        for table in self._link_tables:
+            cursor.execute(
+                self._stream_links_q.format(date=date),
+                (table, link_since, link_until, *date_args, exclude_origin),
+            )
+            yield from self._chunk_actions(table, cursor, chunk_size)
+        cursor.close()
+
+    @staticmethod
+    def _chunk_actions(table, cursor, chunk_size, delete_width=None):
+        chunk, action = [], None
+        while rows := cursor.fetchmany(chunk_size):
+            for row in rows:
+                if row[0] != action or len(chunk) >= chunk_size:
+                    if chunk:
+                        yield table, action, chunk
+                    chunk, action = [], row[0]
+                data = row[1:]
+                if action == 3 and delete_width is not None:
+                    data = data[:delete_width]
+                chunk.append(data)
+        if chunk:
+            yield table, action, chunk
+
+    def export_transactions(self, last_sync: int | None = None) -> dict:
+        if last_sync is None:
+            last_sync = self.last_sync()
+        return {
             "last_sync": last_sync,
-            "tables": export,
-            "links": {"inserts": ln_inserts, "deletes": ln_deletes},
+            "changes": list(self.stream_transactions(last_sync)),
         }
-        return result
+
+    def apply_transactions(
+        self, changes: Iterable[tuple[str, int, list[tuple]]]
+    ) -> None:
+        """Apply a stream of changes as produced by ``stream_transactions``.
+
+        Every chunk is written with one ``executemany`` and the whole stream
+        is a single transaction. Inserts and updates both carry the full row
+        and are applied as upserts, so replaying a change is harmless.
+        """
+        with self.transaction() as transaction:
+            for table, action, rows in changes:
+                self.check_change(table, action)
+                if table in self._link_tables:
+                    name_a, name_b = self._link_tables[table]
+                    if action == 1:
+                        q = f"INSERT OR IGNORE INTO {table} ({name_a}, {name_b}) VALUES (?, ?)"
+                    else:
+                        q = f"DELETE FROM {table} WHERE {name_a} = ? AND {name_b} = ?"
+                elif action == 3:
+                    q = f"DELETE FROM {table} WHERE id = ?"
+                else:
+                    q = self._upsert_q(table)
+                logger.debug(
+                    f"Applying {len(rows)} changes of type {action} to {table}"
+                )
+                transaction.executemany(q, rows)
+        return
+
+    @staticmethod
+    def chunks(items: list) -> Iterator[list]:
+        """Split ``items`` into chunks small enough for one IN list."""
+        for start in range(0, len(items), _in_chunk_size):
+            yield items[start : start + _in_chunk_size]
+
+    @classmethod
+    def check_change(cls, table: str, action: int) -> None:
+        """Make sure a change from a peer names a synced table and action.
+
+        Table names end up in SQL, so changes from the network have to
+        pass this before anything is built from them.
+
+        Raises:
+            ValueError: If the table or the action is unknown.
+        """
+        if table not in cls._tables and table not in cls._link_tables:
+            raise ValueError(f"Unknown table '{table}' in the changes.")
+        if action not in cls._actions:
+            raise ValueError(f"Unknown action '{action}' for table '{table}'.")
+        if table in cls._link_tables and action == 2:
+            raise ValueError(f"Links of '{table}' can not be updated.")
+
+    def _upsert_q(self, table: str) -> str:
+        # Unchanged rows are skipped, so replays do not log updates.
+        names = self._schema[table]
+        return (
+            f"INSERT INTO {table} ({', '.join(names)}) "
+            f"VALUES ({', '.join('?' for _ in names)}) "
+            f"ON CONFLICT(id) DO UPDATE SET "
+            f"{', '.join(f'{n} = excluded.{n}' for n in names[1:])} "
+            f"WHERE ({', '.join(names[1:])}) IS NOT "
+            f"({', '.join(f'excluded.{n}' for n in names[1:])})"
+        )
 
     def import_transactions(self, export: dict):
         """This function imports transactions without checks.
 
-        It is meant to run on clients and trusts that the server knows what
-        it is doing...
+        It trusts that the peer knows what it is doing... The changes are
+        logged with the ``origin`` of the export, the identity of the peer.
+        If the export carries the ``position`` of the peer it was taken at,
+        the position is recorded as a sync.
         """
-        try:
-            for table, data in export["tables"].items():
-                inserts = data["inserts"]
-                if len(inserts) > 0:
-                    logger.info(f"inserting into {table}: {len(inserts)}")
-                    insert_q = f"INSERT INTO {table}({', '.join(self._schema[table])}) VALUES ({', '.join('?' for _ in self._schema[table])})"
-                    self.cursor.executemany(insert_q, data["inserts"])
-                updates = data["updates"]
-                if len(updates) > 0:
-                    logger.info(f"updating into {table}: {len(updates)}")
-                    update_q = f"UPDATE {table} SET {', '.join(f'{n} = ?' for n in self._schema[table][1:])} WHERE id = ?"
-                    self.cursor.executemany(
-                        update_q, [x[1:] + (x[0],) for x in updates]
+        origin = export.get("origin")
+        with self.transaction() as transaction:
+            # Writers are serialized, so all log rows after this position
+            # are written by the import.
+            before = self.log_position()
+            self.apply_transactions(export["changes"])
+            if origin is not None:
+                for table, seq in zip(
+                    ("transaction_log", "transaction_log_link"), before
+                ):
+                    transaction.execute(
+                        f"UPDATE {table} SET origin = ? WHERE rowid > ?",
+                        (origin, seq),
                     )
-                deletes = data["delete_ids"]
-                if len(deletes) > 0:
-                    logger.info(f"Deleting into {table}: {len(updates)}")
-                    self.cursor.executemany(
-                        f"DELETE FROM {table} WHERE id = ?", deletes
-                    )
-            links = export["links"]
-            for id_a, id_b, table in links["inserts"]:
-                name_a, name_b = self._link_tables[table]
-                q = f"INSERT INTO {table} ({name_a}, {name_b}) VALUES (?, ?)"
-                self.cursor.execute(q, (id_a, id_b))
-            for id_a, id_b, table in links["deletes"]:
-                name_a, name_b = self._link_tables[table]
-                q = f"DELETE FROM {table} WHERE {name_a} == ? AND {name_b} == ?"
-                self.cursor.execute(q, (id_a, id_b))
-            self.connection.commit()
-        except Exception as err:
-            self.connection.rollback()
-            raise err
+            if "position" in export:
+                transaction.execute(
+                    "INSERT INTO sync_log (date, log_position, link_position, origin) "
+                    "VALUES (unixepoch(), ?, ?, ?)",
+                    (*export["position"], origin),
+                )
         return
 
-    def import_master(self, export: dict):
+    def import_master(self, export: dict) -> list[dict]:
         """This function imports transactions as the master database.
 
-        It SHOULD check for conflicts but this is not yet implemented."""
-        raise ValueError("Not Yet Implemented.")
+        The version of a row is the sequence number of its latest log row.
+        An incoming change conflicts if the local version is newer than the
+        ``since`` position of the client and was not written by the client
+        itself, the ``origin`` of the export. Without a position, local
+        changes since ``last_sync`` count. The local version wins and
+        reaches the client with the response, the incoming change is
+        dropped. Links to rows that no longer exist are dropped as well,
+        and entries with a key that is already taken are renamed.
+
+        The surviving changes are applied like ``import_transactions``.
+
+        Returns:
+            The conflicts, as ``{"table", "id", "resolution"}``.
+        """
+        conflicts = []
+        renamed = []
+        unlinked = []
+        changes = self._merge_changes(
+            export["changes"],
+            export.get("since") or (0, 0),
+            export.get("last_sync", 0),
+            export["origin"],
+            conflicts,
+            renamed,
+            unlinked,
+        )
+        with self.transaction() as transaction:
+            self.import_transactions({"changes": changes, "origin": export["origin"]})
+            # Log the corrections as local changes, so they are sent back.
+            transaction.executemany(
+                "INSERT INTO transaction_log (id, source, date, type) "
+                "VALUES (?, 'entry', unixepoch(), 2)",
+                [(id,) for id in renamed],
+            )
+            transaction.executemany(
+                "INSERT INTO transaction_log_link "
+                "(id_left, id_right, source, date, type) "
+                "VALUES (?, ?, ?, unixepoch(), 3)",
+                unlinked,
+            )
+        if conflicts:
+            logger.warning(f"Resolved {len(conflicts)} conflicts in the import.")
+        return conflicts
+
+    def _merge_changes(
+        self, changes, since, last_sync, origin, conflicts, renamed, unlinked
+    ):
+        """Filter a change stream for ``import_master``, chunk by chunk.
+
+        Chunks are split further, so the ids of one fit in an IN list.
+        """
+        log_since, link_since = since
+        changes = (
+            (table, action, chunk)
+            for table, action, rows in changes
+            for chunk in self.chunks(rows)
+        )
+        for table, action, rows in changes:
+            self.check_change(table, action)
+            if table in self._link_tables:
+                name_a, name_b = self._link_tables[table]
+                ids = list({row[0] for row in rows})
+                changed = self.cursor.execute(
+                    "SELECT id_left, id_right, type FROM transaction_log_link "
+                    "WHERE source = ? AND rowid > ? AND date >= ? "
+                    f"AND origin IS NOT ? AND id_left IN ({', '.join('?' for _ in ids)}) "
+                    "ORDER BY rowid",
+                    (table, link_since, last_sync, origin, *ids),
+                ).fetchall()
+                changed = {(a, b): type for a, b, type in changed}
+                if action == 1:
+                    existing = [
+                        self._existing_ids(
+                            name.removesuffix("_id"), [row[i] for row in rows]
+                        )
+                        for i, name in enumerate((name_a, name_b))
+                    ]
+                kept = []
+                for row in rows:
+                    if changed.get(tuple(row), action) != action:
+                        resolution = "changed locally"
+                    elif action == 1 and not (
+                        row[0] in existing[0] and row[1] in existing[1]
+                    ):
+                        resolution = "linked row deleted"
+                        unlinked.append((row[0], row[1], table))
+                    else:
+                        kept.append(row)
+                        continue
+                    conflicts.append(
+                        {
+                            "table": table,
+                            "id": f"{row[0]}/{row[1]}",
+                            "resolution": resolution,
+                        }
+                    )
+                rows = kept
+            else:
+                ids = [row[0] for row in rows]
+                changed = self.cursor.execute(
+                    "SELECT id, type FROM transaction_log "
+                    "WHERE source = ? AND rowid > ? AND date >= ? "
+                    f"AND origin IS NOT ? AND id IN ({', '.join('?' for _ in ids)}) "
+                    "ORDER BY rowid",
+                    (table, log_since, last_sync, origin, *ids),
+                ).fetchall()
+                # Only deleting a row on both sides is no conflict.
+                changed = {id: type for id, type in changed}
+                kept = []
+                for row in rows:
+                    if row[0] in changed and not (changed[row[0]] == action == 3):
+                        conflicts.append(
+                            {
+                                "table": table,
+                                "id": str(row[0]),
+                                "resolution": "changed locally",
+                            }
+                        )
+                    else:
+                        kept.append(row)
+                rows = kept
+                if table == "entry" and action != 3:
+                    rows = self._rename_taken_keys(rows, conflicts, renamed)
+            if rows:
+                yield table, action, rows
+
+    def _existing_ids(self, table: str, ids: list) -> set:
+        ids = list(set(ids))
+        rows = self.cursor.execute(
+            f"SELECT id FROM {table} WHERE id IN ({', '.join('?' for _ in ids)})",
+            ids,
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def _rename_taken_keys(self, rows, conflicts, renamed):
+        index = self._schema["entry"].index("key")
+        keys = [row[index] for row in rows]
+        taken = dict(
+            self.cursor.execute(
+                f"SELECT key, id FROM entry WHERE key IN ({', '.join('?' for _ in keys)})",
+                keys,
+            ).fetchall()
+        )
+        merged = []
+        for row in rows:
+            key = row[index]
+            if key in taken and taken[key] != row[0]:
+                row = list(row)
+                row[index] = f"{key}-{row[0].hex[:6]}"
+                row = tuple(row)
+                renamed.append(row[0])
+                conflicts.append(
+                    {
+                        "table": "entry",
+                        "id": str(row[0]),
+                        "resolution": f"key '{key}' renamed to '{row[index]}'",
+                    }
+                )
+            merged.append(row)
+        return merged
 
     def dump(self, out_file: pathlib.Path):
-        with open("/tmp/dump_script.sql", "w") as f:
-            f.write(f".output {out_file}\n")
-            f.write(".dump")
-        subprocess.call(["sqlite3", str(self.db_file), ".read /tmp/dump_script.sql"])
+        """Write a consistent copy of the database to ``out_file``.
+
+        This uses the sqlite online backup API and copies the pages in small
+        steps, so other connections can keep writing during the backup.
+        The copy is written next to ``out_file`` and renamed into place once
+        it is complete.
+        """
+        fd, tmp_name = tempfile.mkstemp(
+            dir=out_file.parent, prefix=f".{out_file.name}.", suffix=".tmp"
+        )
+        os.close(fd)
+        source = self._connect()
+        target = sqlite3.connect(tmp_name)
+        try:
+            source.backup(target, pages=_backup_step_pages)
+            # Ship a single file, without a write ahead log.
+            target.execute("PRAGMA journal_mode = DELETE")
+        except Exception as err:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise err
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_name, out_file)
         return
 
-    def bootstrap(self, in_file: pathlib.Path):
-        self.connection.close()
-        self.db_file.unlink(missing_ok=True)
-        subprocess.call(["sqlite3", str(self.db_file), f".read {in_file}"])
-        self.connection = sqlite3.connect(
-            self.db_file,
-            check_same_thread=False,
-            detect_types=sqlite3.PARSE_DECLTYPES,
+    def snapshot(self, out_file: pathlib.Path) -> tuple[int, int]:
+        """Write a compacted copy of the database without its logs.
+
+        A client bootstrapped from the snapshot replays the logs after the
+        returned position. The position is taken before the copy, so the
+        replay may repeat changes already in the snapshot, which is
+        harmless.
+        """
+        position = self.log_position()
+        fd, tmp_name = tempfile.mkstemp(
+            dir=out_file.parent, prefix=f".{out_file.name}.", suffix=".tmp"
+        )
+        os.close(fd)
+        pathlib.Path(tmp_name).unlink()
+        source = self._connect()
+        try:
+            source.execute("VACUUM INTO ?", (tmp_name,))
+        finally:
+            source.close()
+        target = sqlite3.connect(tmp_name)
+        try:
+            target.execute("DELETE FROM transaction_log")
+            target.execute("DELETE FROM transaction_log_link")
+            target.execute("UPDATE log_horizon SET log_position = 0, link_position = 0")
+            target.execute("DELETE FROM sync_cursor")
+            target.commit()
+            target.execute("VACUUM")
+        except Exception as err:
+            target.close()
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise err
+        target.close()
+        os.replace(tmp_name, out_file)
+        return position
+
+    def bootstrap(
+        self,
+        in_file: pathlib.Path,
+        position: tuple[int, int] | None = None,
+        origin: uuid.UUID | None = None,
+    ):
+        """Replace the content of the database with a copy from ``dump``.
+
+        The copy is checked first and then written over the live database
+        with the backup API in a single write transaction. Other connections
+        see either the old or the new database, never a mix. ``position`` is
+        the server position of the copy and is recorded as a sync with the
+        server identity ``origin``. The identity of this database is kept.
+        """
+        identity = self.sync_identity()
+        source = sqlite3.connect(f"file:{in_file}?mode=ro", uri=True)
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                raise ValueError(f"Bootstrap file '{in_file}' is corrupt: {check}")
+            source.backup(self.connection)
+        finally:
+            source.close()
+        self.migrate()
+        if position is None:
+            position = (None, None)
+        self.cursor.execute("DELETE FROM sync_cursor")
+        self.cursor.execute("UPDATE sync_identity SET id = ?", (identity,))
+        self.cursor.execute(
+            "INSERT INTO sync_log (date, log_position, link_position, origin) "
+            "VALUES (unixepoch(), ?, ?, ?)",
+            (*position, origin),
         )
-        self.cursor = self.connection.cursor()
-        self.cursor.execute("INSERT INTO sync_log(date) VALUES (unixepoch())")
         self.connection.commit()
+        self.replaced += 1
         self._load_schema()
         return
@@ -42,7 +42,7 @@ class Entry:
         return ", ".join(self._names)
 
     _fetch_id = "SELECT id, type, key, doi, title, year, url from entries WHERE id = ?"
-    _attach_file = "INSERT INTO file_cw (entry_id, file_id) VALUES (?, ?)"
+    _attach_file = "INSERT OR IGNORE INTO file_link (file_id, entry_id) VALUES (?, ?)"
     _load_file_key = (
         "SELECT id, type, key, doi, title, year, url FROM entries WHERE key = ?"
     )
@@ -63,7 +63,9 @@ class Entry:
     _attach_keyword = "INSERT INTO keywords_cw (keyword_id, entry_id) VALUES (?, ?)"
     _delete_keyword = "DELETE FROM keywords_cw WHERE entry_id = ? AND keyword_id = ?"
     _list_authors = "SELECT author_id FROM author_link WHERE entry_id = ?"
-    _attach_author = "INSERT INTO author_link (author_id, entry_id) VALUES (?, ?)"
+    _attach_author = (
+        "INSERT OR IGNORE INTO author_link (author_id, entry_id) VALUES (?, ?)"
+    )
     _detach_author = "DELETE FROM author_link WHERE author_id = ? AND entry_id = ?"
     _add_abstract_q = "INSERT INTO abstract (entry_id, abstract) VALUES (?, ?)"
 
@@ -217,8 +219,7 @@ class Entry:
         return authors
 
     def attach_author(self, db: DB, author: Author) -> None:
-        q = "INSERT INTO author_link (author_id, entry_id) VALUES (?, ?)"
-        db.cursor.execute(q, (author.id, self.id))
+        db.cursor.execute(self._attach_author, (author.id, self.id))
         return
 
     def detach_author(self, db: DB, author: Author) -> None:
@@ -272,8 +273,7 @@ class Entry:
         return File.load(db, file_id)
 
     def attach_file(self, db: DB, file: File) -> None:
-        q = "INSERT INTO file_link (file_id, entry_id) VALUES (?, ?)"
-        db.cursor.execute(q, (file.id, self.id))
+        db.cursor.execute(self._attach_file, (file.id, self.id))
         return None
 
     def add_abstract(self, db: DB, abstract: str):
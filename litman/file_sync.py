@@ -0,0 +1,275 @@
+"""Exchange of the stored files between a client and the server.
+
+Both sides describe their files with a manifest of ``(file id, size,
+sha256)``. The client compares the manifests and only transfers files that
+are missing or differ. Files the server is missing are uploaded. For the
+others, the hash both sides agreed on in the last sync tells which side
+changed a file: the client downloads files it did not change and uploads
+files the server did not change. A file changed on both sides is left
+alone on both. Transfers run concurrently over one connection pool, are
+retried, and interrupted downloads resume with a Range request.
+
+On the wire, a manifest is a sequence of 56 byte records: the raw 16 bytes
+of the file id, the size as big endian u64 and the 32 byte sha256 digest.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import pathlib
+import struct
+import uuid
+
+import urllib3
+from box import Box
+
+from litman.db_connector import DB
+
+logger = logging.getLogger(__name__)
+
+Manifest = dict[uuid.UUID, tuple[int, bytes]]
+
+_record = struct.Struct(">16sQ32s")
+# Number of attempts to complete a download, resuming after each failure.
+_download_attempts = 3
+
+
+def _sha256(path: pathlib.Path) -> bytes:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").digest()
+
+
+def file_manifest(config: Box, db: DB) -> Manifest:
+    """Describe all stored files of the library.
+
+    Hashes are cached in the ``file_hash`` table and only recomputed when
+    the size or modification time of a file changed. Files that are missing
+    on disk are left out.
+    """
+    storage = pathlib.Path(config.files.file_storage_path)
+    cached = {
+        file_id: (size, mtime_ns, sha256)
+        for file_id, size, mtime_ns, sha256 in db.cursor.execute(
+            "SELECT file_id, size, mtime_ns, sha256 FROM file_hash"
+        ).fetchall()
+    }
+    files = db.cursor.execute("SELECT id, path FROM file").fetchall()
+    # Hashing reads every changed file, so it runs outside of a transaction
+    # and only the new hashes are written in a short one at the end.
+    manifest = {}
+    hashed = []
+    for file_id, path in files:
+        file_path = storage / path
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            continue
+        entry = cached.get(file_id)
+        if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            sha256 = entry[2]
+        else:
+            sha256 = _sha256(file_path)
+            hashed.append((file_id, stat.st_size, stat.st_mtime_ns, sha256))
+        manifest[file_id] = (stat.st_size, sha256)
+    if hashed:
+        with db.transaction() as transaction:
+            for row in hashed:
+                transaction.defer(
+                    "INSERT OR REPLACE INTO file_hash VALUES (?, ?, ?, ?)", row
+                )
+    return manifest
+
+
+def encode_manifest(manifest: Manifest) -> bytes:
+    return b"".join(
+        _record.pack(file_id.bytes, size, sha256)
+        for file_id, (size, sha256) in manifest.items()
+    )
+
+
+def decode_manifest(data: bytes) -> Manifest:
+    if len(data) % _record.size != 0:
+        raise ValueError("Malformed file manifest.")
+    return {
+        uuid.UUID(bytes=file_id): (size, sha256)
+        for file_id, size, sha256 in _record.iter_unpack(data)
+    }
+
+
+def store_upload(
+    config: Box, db: DB, file_id: uuid.UUID, stream, sha256: bytes
+) -> None:
+    """Store an uploaded file after checking its hash (server side)."""
+    row = db.cursor.execute("SELECT path FROM file WHERE id = ?", (file_id,))
+    row = row.fetchone()
+    if row is None:
+        raise ValueError(f"No file with id '{file_id}'.")
+    target = pathlib.Path(config.files.file_storage_path) / row[0]
+    part = target.with_name(f".{target.name}.{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    try:
+        with part.open("wb") as f:
+            while chunk := stream.read(2**16):
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.digest() != sha256:
+            raise ValueError(f"Hash mismatch for upload of '{file_id}'.")
+        os.replace(part, target)
+    finally:
+        part.unlink(missing_ok=True)
+
+
+###
+### Client
+###
+
+
+def _download(
+    http: urllib3.PoolManager,
+    url: str,
+    headers: dict,
+    target: pathlib.Path,
+    size: int,
+    sha256: bytes,
+) -> None:
+    part = target.with_name(f"{target.name}.part")
+    for _ in range(_download_attempts):
+        offset = part.stat().st_size if part.exists() else 0
+        if offset > size:
+            part.unlink()
+            offset = 0
+        request_headers = dict(headers)
+        if offset > 0:
+            request_headers["Range"] = f"bytes={offset}-"
+        response = http.request(
+            "GET", url, headers=request_headers, preload_content=False
+        )
+        try:
+            if response.status == 416 and offset == size:
+                pass  # The previous attempt got everything.
+            elif response.status in (200, 206):
+                mode = "ab" if response.status == 206 else "wb"
+                with part.open(mode) as f:
+                    for chunk in response.stream(2**16):
+                        f.write(chunk)
+            else:
+                raise ValueError(f"Download of '{url}' failed: {response.status}.")
+        except (urllib3.exceptions.HTTPError, OSError) as err:
+            logger.warning(f"Download of '{url}' interrupted, resuming: {err}")
+            continue
+        finally:
+            response.release_conn()
+        break
+    else:
+        raise ValueError(f"Download of '{url}' did not complete.")
+    if _sha256(part) != sha256:
+        part.unlink()
+        raise ValueError(f"Hash mismatch for download of '{url}'.")
+    os.replace(part, target)
+
+
+def _upload(
+    http: urllib3.PoolManager,
+    url: str,
+    headers: dict,
+    source: pathlib.Path,
+    sha256: bytes,
+) -> None:
+    request_headers = dict(headers)
+    request_headers["X-Litman-Sha256"] = sha256.hex()
+    request_headers["Content-Length"] = str(source.stat().st_size)
+    with source.open("rb") as f:
+        response = http.request("PUT", url, body=f, headers=request_headers)
+    if response.status != 200:
+        raise ValueError(f"Upload to '{url}' failed: {response.status}.")
+
+
+def sync_files(config: Box, db: DB) -> None:
+    """Transfer the files that differ between the client and the server."""
+    main = config.client.main
+    workers = config.client.get("file_workers", 4)
+    headers = urllib3.make_headers(
+        basic_auth="{}:{}".format(config.client.user, config.client.password),
+    )
+    http = urllib3.PoolManager(
+        maxsize=workers,
+        retries=urllib3.Retry(
+            total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504)
+        ),
+    )
+    response = http.request("GET", f"{main}/admin/files/manifest", headers=headers)
+    if response.status != 200:
+        raise ValueError(f"Fetching the file manifest failed: {response.status}.")
+    remote = decode_manifest(response.data)
+    local = file_manifest(config, db)
+    paths = dict(db.cursor.execute("SELECT id, path FROM file").fetchall())
+    storage = pathlib.Path(config.files.file_storage_path)
+    synced = dict(
+        db.cursor.execute("SELECT file_id, sha256 FROM file_sync_state").fetchall()
+    )
+    downloads, uploads, agreed = [], [], []
+    for file_id in remote.keys() | local.keys():
+        if file_id not in paths:
+            continue
+        remote_hash = remote[file_id][1] if file_id in remote else None
+        local_hash = local[file_id][1] if file_id in local else None
+        if remote_hash == local_hash:
+            agreed.append((file_id, local_hash))
+        elif remote_hash is None:
+            # The server lost the file, or never got it.
+            uploads.append(file_id)
+        elif local_hash is None or local_hash == synced.get(file_id):
+            downloads.append(file_id)
+        elif remote_hash == synced.get(file_id):
+            uploads.append(file_id)
+        else:
+            logger.warning(
+                f"File '{file_id}' changed on the client and the server, "
+                f"keeping both as they are."
+            )
+    logger.info(f"Downloading {len(downloads)} and uploading {len(uploads)} files.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for file_id in downloads:
+            size, sha256 = remote[file_id]
+            future = pool.submit(
+                _download,
+                http,
+                f"{main}/admin/files/{file_id}",
+                headers,
+                storage / paths[file_id],
+                size,
+                sha256,
+            )
+            futures[future] = file_id
+        for file_id in uploads:
+            future = pool.submit(
+                _upload,
+                http,
+                f"{main}/admin/files/{file_id}",
+                headers,
+                storage / paths[file_id],
+                local[file_id][1],
+            )
+            futures[future] = file_id
+        failed = 0
+        for future in concurrent.futures.as_completed(futures):
+            file_id = futures[future]
+            try:
+                future.result()
+            except Exception as err:
+                failed += 1
+                logger.error(f"Transfer of file '{file_id}' failed.")
+                logger.exception(err)
+                continue
+            source = remote if file_id in downloads else local
+            agreed.append((file_id, source[file_id][1]))
+    with db.transaction() as transaction:
+        for row in agreed:
+            transaction.defer(
+                "INSERT OR REPLACE INTO file_sync_state VALUES (?, ?)", row
+            )
+    if failed:
+        raise ValueError(f"{failed} file transfers failed.")
+    return
@@ -0,0 +1,249 @@
+"""Typo tolerant lookup of entries by their keys, titles and author names.
+
+The words of these fields are indexed by their character trigrams. A
+misspelled word still shares most trigrams with the word it was meant to
+be, so the words sharing enough trigrams with a query word are the
+candidates, and their edit distance to it decides. Candidates are checked
+best first until a time budget is spent.
+
+The index is built on first use and then follows the transaction logs,
+reloading only the entries whose words changed.
+"""
+
+import collections
+import logging
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from litman.db_connector import DB
+
+logger = logging.getLogger(__name__)
+
+_word = re.compile(r"\w+")
+_letters = re.compile(r"[^\W\d_]+")
+# Words shorter than this are neither indexed nor searched.
+_min_length = 3
+
+
+def max_distance(word: str) -> int:
+    """The edit distance allowed for a query word of this length."""
+    return 1 if len(word) <= 5 else 2
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """The Levenshtein distance of two words, or ``limit + 1`` if above it."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def words(text: str) -> set[str]:
+    """The searchable words of a text."""
+    return {
+        w
+        for w in _word.findall(text.casefold())
+        if len(w) >= _min_length and not w.isdigit()
+    }
+
+
+@dataclass
+class FuzzyMatch:
+    id: uuid.UUID
+    key: str
+    title: str
+    # The summed edit distance of the query words, lower is better.
+    distance: int
+    # The indexed words the query words matched.
+    matched: set[str]
+
+
+class FuzzyIndex:
+    """A trigram index over the words of all entries."""
+
+    # Seconds a lookup may spend checking candidates.
+    budget: float = 0.05
+
+    _entries_q = """SELECT e.id, e.key, e.title, group_concat(a.last_name, ' ')
+        FROM entry e
+        LEFT JOIN author_link l ON l.entry_id = e.id
+        LEFT JOIN author a ON a.id = l.author_id
+        {}
+        GROUP BY e.id"""
+    # The entries whose words changed in a range of the logs: changed
+    # entries, entries with changed author links and entries of renamed
+    # authors.
+    _changed_q = """SELECT id FROM transaction_log
+            WHERE seq > ? AND seq <= ? AND source = 'entry'
+        UNION
+        SELECT id_right FROM transaction_log_link
+            WHERE seq > ? AND seq <= ? AND source = 'author_link'
+        UNION
+        SELECT l.entry_id FROM transaction_log t
+            JOIN author_link l ON l.author_id = t.id
+            WHERE t.seq > ? AND t.seq <= ? AND t.source = 'author'"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._db_file: str | None = None
+        self._replaced = 0
+        self._position: tuple[int, int] | None = None
+        self._entries: dict[uuid.UUID, tuple[str, str, set[str]]] = {}
+        self._postings: dict[str, set[uuid.UUID]] = collections.defaultdict(set)
+        self._grams: dict[str, set[str]] = collections.defaultdict(set)
+
+    def search(
+        self, db: DB, query: str, limit: int = 50, offset: int = 0
+    ) -> list[FuzzyMatch]:
+        """Entries with a word close to each word of ``query``, closest first."""
+        query_words = words(query)
+        if not query_words:
+            return []
+        with self._lock:
+            self.refresh(db)
+            deadline = time.perf_counter() + self.budget
+            distances = None
+            matched = collections.defaultdict(set)
+            for word in sorted(query_words, key=len, reverse=True):
+                found = {}
+                for term, distance in self._closest(word, deadline).items():
+                    for id in self._postings[term]:
+                        if id not in found or distance < found[id]:
+                            found[id] = distance
+                        matched[id].add(term)
+                if distances is None:
+                    distances = found
+                else:
+                    distances = {
+                        id: d + found[id] for id, d in distances.items() if id in found
+                    }
+            ranked = sorted(
+                distances, key=lambda id: (distances[id], self._entries[id][0])
+            )
+            return [
+                FuzzyMatch(id, *self._entries[id][:2], distances[id], matched[id])
+                for id in ranked[offset : offset + limit]
+            ]
+
+    def _closest(self, word: str, deadline: float) -> dict[str, int]:
+        limit = max_distance(word)
+        grams = trigrams(word)
+        # Each edit changes at most three trigrams.
+        needed = max(1, len(grams) - 3 * limit)
+        # A word sharing ``needed`` trigrams shares one of the rarest
+        # ``len(grams) - needed + 1`` of them, so only these are looked up.
+        rarest = sorted(grams, key=lambda g: len(self._grams.get(g, ())))
+        candidates = set().union(
+            *(self._grams.get(g, ()) for g in rarest[: len(grams) - needed + 1])
+        )
+        shared = collections.Counter(
+            {term: len(grams & trigrams(term)) for term in candidates}
+        )
+        closest = {}
+        for term, count in shared.most_common():
+            if count < needed or time.perf_counter() > deadline:
+                break
+            distance = edit_distance(word, term, limit)
+            if distance <= limit:
+                closest[term] = distance
+        return closest
+
+    def follow(self, db: DB) -> None:
+        """Refresh the index, once built, before the logs of ``db`` are pruned."""
+
+        def refresh():
+            with self._lock:
+                if self._position is not None and self._db_file == str(db.db_file):
+                    self.refresh(db)
+
+        db.before_compaction(refresh)
+
+    def refresh(self, db: DB) -> None:
+        """Apply the changes logged since the last refresh."""
+        position = db.log_position()
+        if (
+            self._position is None
+            or self._db_file != str(db.db_file)
+            or self._replaced != db.replaced
+            or any(h > p for h, p in zip(db.log_horizon(), self._position))
+            or any(now < then for now, then in zip(position, self._position))
+        ):
+            self._rebuild(db, position)
+        elif position != self._position:
+            since = self._position
+            ids = [
+                row[0]
+                for row in db.cursor.execute(
+                    self._changed_q,
+                    (
+                        since[0],
+                        position[0],
+                        since[1],
+                        position[1],
+                        since[0],
+                        position[0],
+                    ),
+                ).fetchall()
+            ]
+            self._reload(db, ids)
+            self._position = position
+
+    def _rebuild(self, db: DB, position: tuple[int, int]) -> None:
+        self._entries.clear()
+        self._postings.clear()
+        self._grams.clear()
+        for row in db.cursor.execute(self._entries_q.format("")).fetchall():
+            self._add(*row)
+        self._db_file = str(db.db_file)
+        self._replaced = db.replaced
+        self._position = position
+        logger.info(f"Built the fuzzy search index over {len(self._entries)} entries.")
+
+    def _reload(self, db: DB, ids: list[uuid.UUID]) -> None:
+        for id in ids:
+            self._remove(id)
+        for chunk in db.chunks(ids):
+            where = "WHERE e.id IN ({})".format(", ".join("?" for _ in chunk))
+            for row in db.cursor.execute(self._entries_q.format(where), chunk):
+                self._add(*row)
+
+    def _add(self, id: uuid.UUID, key: str, title: str, authors: str | None):
+        terms = words(f"{title} {authors or ''}") | {key.casefold()}
+        terms |= {w for w in _letters.findall(key.casefold()) if len(w) >= _min_length}
+        self._entries[id] = (key, title, terms)
+        for term in terms:
+            if not self._postings[term]:
+                for gram in trigrams(term):
+                    self._grams[gram].add(term)
+            self._postings[term].add(id)
+
+    def _remove(self, id: uuid.UUID) -> None:
+        entry = self._entries.pop(id, None)
+        if entry is None:
+            return
+        for term in entry[2]:
+            self._postings[term].discard(id)
+            if not self._postings[term]:
+                del self._postings[term]
+                for gram in trigrams(term):
+                    self._grams[gram].discard(term)
+
+
+index = FuzzyIndex()
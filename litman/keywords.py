@@ -37,14 +37,12 @@ class Keyword:
     def from_name(cls, db: DB, name: str):
         """Return a keyword with a given name.
 
-        If this does not exist, create it.
+        If this does not exist, create it. Committing the new keyword is
+        left to the caller.
         """
         res = db.cursor.execute(cls._fetch_name, (name,)).fetchone()
-        # Does not exist, save and commit.
         if res is None:
-            keyword = cls.create(db, name)
-            db.connection.commit()
-            return keyword
+            return cls.create(db, name)
         return cls(*res)
 
     @classmethod
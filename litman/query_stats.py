@@ -0,0 +1,225 @@
+"""Statistics on the SQL statements run against the database.
+
+Every cursor handed out by ``DB`` is an ``InstrumentedCursor``. It times each
+statement, including the time spent fetching its rows, and reports it to the
+``QueryStats`` of the database. Statements are grouped by their normalized
+SQL, so the same query with different parameters counts as one statement.
+
+Statements slower than the configured threshold are written to the
+``litman.slow_query`` logger together with their query plan.
+"""
+
+import collections
+import logging
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("litman.slow_query")
+
+# Number of durations kept per statement to estimate the p95 latency.
+_latency_samples = 512
+# A statement run more often than this within one request is logged as a
+# likely N+1 pattern.
+_repeat_warning = 25
+
+_whitespace = re.compile(r"\s+")
+_placeholder_list = re.compile(r"\?(\s*,\s*\?)+")
+
+
+def normalize(sql: str) -> str:
+    """Collapse whitespace and ``IN (?, ?, ...)`` lists of a statement."""
+    sql = _whitespace.sub(" ", sql).strip()
+    return _placeholder_list.sub("?, ...", sql)
+
+
+@dataclass
+class StatementStats:
+    statement: str
+    count: int = 0
+    total: float = 0.0
+    rows: int = 0
+    samples: collections.deque = field(
+        default_factory=lambda: collections.deque(maxlen=_latency_samples)
+    )
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def p95(self) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+@dataclass
+class RequestStats:
+    """The statements run by one request."""
+
+    count: int = 0
+    total: float = 0.0
+    statements: collections.Counter = field(default_factory=collections.Counter)
+
+
+class QueryStats:
+    """Collects the statement statistics of one database.
+
+    The statistics are shared by all threads. The counters of the current
+    request are kept per thread between ``start_request`` and
+    ``finish_request``.
+    """
+
+    slow_query_ms: float | None
+
+    def __init__(
+        self,
+        slow_query_ms: float | None = None,
+        slow_query_log: pathlib.Path | None = None,
+    ):
+        self.slow_query_ms = slow_query_ms
+        if slow_query_log is not None:
+            handler = logging.FileHandler(slow_query_log)
+            handler.setFormatter(
+                logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+            )
+            slow_logger.addHandler(handler)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._statements: dict[str, StatementStats] = {}
+
+    def record(self, statement: str, duration: float, rows: int) -> None:
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                stats = StatementStats(statement)
+                self._statements[statement] = stats
+            stats.count += 1
+            stats.total += duration
+            stats.rows += rows
+            stats.samples.append(duration)
+        request = getattr(self._local, "request", None)
+        if request is not None:
+            request.count += 1
+            request.total += duration
+            request.statements[statement] += 1
+
+    def is_slow(self, duration: float) -> bool:
+        return self.slow_query_ms is not None and duration * 1000 >= self.slow_query_ms
+
+    def statements(self) -> list[StatementStats]:
+        """All statements, the most expensive first."""
+        with self._lock:
+            stats = list(self._statements.values())
+        return sorted(stats, key=lambda s: s.total, reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements = {}
+
+    def start_request(self) -> None:
+        self._local.request = RequestStats()
+
+    def finish_request(self) -> RequestStats | None:
+        """Stop counting for the current request and return its counters."""
+        request = getattr(self._local, "request", None)
+        self._local.request = None
+        if request is None:
+            return None
+        for statement, count in request.statements.items():
+            if count > _repeat_warning:
+                logger.warning(
+                    f"Statement ran {count} times in one request: {statement}"
+                )
+        return request
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that reports its statements to ``QueryStats``.
+
+    A statement is recorded once its rows were fetched, or at the latest
+    when the cursor runs the next statement or is flushed.
+    """
+
+    stats: QueryStats
+    _pending: list | None = None
+
+    def execute(self, sql, parameters=(), /):
+        self.flush()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._pending = [sql, parameters, time.perf_counter() - start, 0]
+        return self
+
+    def executemany(self, sql, seq_of_parameters, /):
+        self.flush()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._pending = [sql, None, time.perf_counter() - start, self.rowcount]
+        self.flush()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        self.flush()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        self.flush()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            self.flush()
+            raise
+        self._fetched(start, 1)
+        return row
+
+    def _fetched(self, start: float, rows: int) -> None:
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - start
+            self._pending[3] += rows
+
+    def flush(self) -> None:
+        """Record the last statement of this cursor."""
+        if self._pending is None:
+            return
+        sql, parameters, duration, rows = self._pending
+        self._pending = None
+        statement = normalize(sql)
+        self.stats.record(statement, duration, max(rows, self.rowcount))
+        if self.stats.is_slow(duration):
+            self._log_slow(statement, sql, parameters, duration)
+
+    def _log_slow(self, statement, sql, parameters, duration) -> None:
+        plan = ""
+        if parameters is not None:
+            try:
+                rows = self.connection.execute(
+                    f"EXPLAIN QUERY PLAN {sql}", parameters
+                ).fetchall()
+                plan = "".join(f"\n    {detail}" for _, _, _, detail in rows)
+            except sqlite3.Error as err:
+                plan = f"\n    (no query plan: {err})"
+        slow_logger.warning(f"{duration * 1000:.1f} ms: {statement}{plan}")
@@ -0,0 +1,392 @@
+"""Related entries by the TF-IDF similarity of their texts.
+
+Each entry is a row of term counts over the words of its title, abstracts
+and keywords. Rows are weighted by TF-IDF, so a query is a sparse product
+with the weights of all entries followed by a top-k selection, for any
+number of entries at once.
+
+The counts are saved as the arrays of a CSR matrix and memory mapped on
+startup, together with the log position they were counted at. Entries
+changed since then, and while running, are recounted into rows held in
+memory that shadow the saved ones. Once there are many of them, the rows
+are merged and saved again.
+
+The weights of the saved rows are kept until the next merge, and a change
+only weighs the changed rows. So between merges, the saved rows keep the
+document frequencies they were weighted with.
+
+A change of an abstract is logged as an update of its entry, so it is
+recounted like any other change.
+
+Requires NumPy and SciPy.
+"""
+
+import collections
+import json
+import logging
+import os
+import pathlib
+import re
+import threading
+import uuid
+from collections.abc import Iterable
+
+from litman.db_connector import DB
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:
+    np = None
+    sp = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+_word = re.compile(r"[^\W\d_]{3,}")
+_stop_words = frozenset(
+    {
+        "and",
+        "are",
+        "but",
+        "can",
+        "for",
+        "from",
+        "has",
+        "have",
+        "how",
+        "its",
+        "not",
+        "our",
+        "that",
+        "the",
+        "their",
+        "them",
+        "these",
+        "this",
+        "those",
+        "using",
+        "was",
+        "were",
+        "what",
+        "when",
+        "which",
+        "while",
+        "with",
+    }
+)
+
+
+def available() -> bool:
+    return np is not None
+
+
+def tokenize(text: str) -> list[str]:
+    return [w for w in _word.findall(text.casefold()) if w not in _stop_words]
+
+
+class RelatedEntries:
+    """Find the entries most similar to others."""
+
+    db: DB
+    path: pathlib.Path
+    # The number of changed entries held in memory before saving.
+    merge_size: int = 1000
+
+    _texts_q = """SELECT e.id, e.title, a.abstract,
+            (SELECT group_concat(k.name, ' ') FROM keyword_link l
+                JOIN keyword k ON k.id = l.keyword_id WHERE l.entry_id = e.id)
+        FROM entry e LEFT JOIN entry_abstracts a ON a.entry_id = e.id
+        {}"""
+    # The entries whose text changed in a range of the logs: changed
+    # entries, entries with changed keyword links and entries of renamed
+    # keywords.
+    _changed_q = """SELECT id FROM transaction_log
+            WHERE seq > ? AND seq <= ? AND source = 'entry'
+        UNION
+        SELECT id_right FROM transaction_log_link
+            WHERE seq > ? AND seq <= ? AND source = 'keyword_link'
+        UNION
+        SELECT l.entry_id FROM transaction_log t
+            JOIN keyword_link l ON l.keyword_id = t.id
+            WHERE t.seq > ? AND t.seq <= ? AND t.source = 'keyword'"""
+
+    def __init__(self, db: DB, path: pathlib.Path):
+        if not available():
+            raise RuntimeError("Related entries require 'numpy' and 'scipy'.")
+        self.db = db
+        self.path = path
+        self._lock = threading.Lock()
+        self._position: tuple[int, int] | None = None
+        self._replaced = db.replaced
+        self._vocabulary: dict[str, int] = {}
+        # The saved counts and the entry of each of their rows.
+        self._base = sp.csr_matrix((0, 0))
+        self._base_ids: list[uuid.UUID] = []
+        # Counts of entries changed since saving, None if deleted.
+        self._changed: dict[uuid.UUID, dict[int, int] | None] = {}
+        # The TF-IDF weights of the saved rows, their document frequencies
+        # and the row of each entry, until the next merge.
+        self._base_weights = None
+        self._df = None
+        self._base_rows: dict[uuid.UUID, int] = {}
+        # The weights of the changed rows and their entries, and the saved
+        # rows shadowed by changed ones, until the next change. Changed rows
+        # are numbered after the saved ones.
+        self._changed_weights = None
+        self._changed_ids: list[uuid.UUID] = []
+        self._changed_rows: dict[uuid.UUID, int] = {}
+        self._shadowed = None
+        self._load()
+
+    def related(
+        self, ids: Iterable[uuid.UUID], k: int = 10
+    ) -> dict[uuid.UUID, list[tuple[uuid.UUID, float]]]:
+        """The ``k`` entries most similar to each of ``ids``, best first."""
+        with self._lock:
+            self.refresh()
+            base, changed = self._assemble()
+            saved = base.shape[0]
+            rows = {id: row for id in ids if (row := self._row(id)) is not None}
+            # Queries from the saved rows first, then from the changed ones.
+            ids = sorted(rows, key=lambda id: rows[id] >= saved)
+            entries = saved - len(self._shadowed) + changed.shape[0]
+            result = {}
+            if not ids or entries < 2:
+                return {id: [] for id in ids}
+            k = min(k, entries - 1)
+            query = sp.vstack(
+                [
+                    base[[rows[id] for id in ids if rows[id] < saved]],
+                    changed[[rows[id] - saved for id in ids if rows[id] >= saved]],
+                ],
+                format="csr",
+            )
+            # Multiplied by the transposed query, so only the query is
+            # converted to the column format.
+            scores = np.hstack(
+                [(base @ query.T).T.toarray(), (changed @ query.T).T.toarray()]
+            )
+            scores[:, self._shadowed] = -1.0
+            for i, id in enumerate(ids):
+                scores[i, rows[id]] = -1.0
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for i, id in enumerate(ids):
+                order = best[i][np.argsort(-scores[i, best[i]])]
+                result[id] = [
+                    (self._id(j, saved), float(scores[i, j]))
+                    for j in order
+                    if scores[i, j] > 0
+                ]
+            return result
+
+    ###
+    ### Following the database
+    ###
+
+    def follow(self) -> None:
+        """Refresh, once built, before the logs are pruned."""
+
+        def refresh():
+            with self._lock:
+                if self._position is not None:
+                    self.refresh()
+
+        self.db.before_compaction(refresh)
+
+    def refresh(self) -> None:
+        """Recount the entries changed since the last refresh."""
+        position = self.db.log_position()
+        if (
+            self._position is None
+            or self._replaced != self.db.replaced
+            or any(h > p for h, p in zip(self.db.log_horizon(), self._position))
+            or any(now < then for now, then in zip(position, self._position))
+        ):
+            self._rebuild(position)
+            return
+        if position == self._position:
+            return
+        since = self._position
+        ids = [
+            row[0]
+            for row in self.db.cursor.execute(
+                self._changed_q,
+                (since[0], position[0], since[1], position[1], since[0], position[0]),
+            ).fetchall()
+        ]
+        counted = self._count(ids)
+        for id in ids:
+            self._changed[id] = counted.get(id)
+        self._position = position
+        self._changed_weights = None
+        if len(self._changed) >= self.merge_size:
+            self._merge()
+            self._save()
+
+    def _count(self, ids: list[uuid.UUID] | None = None) -> dict[uuid.UUID, dict]:
+        """The term counts of the entries, or of all entries."""
+        if ids is None:
+            rows = self.db.cursor.execute(self._texts_q.format("")).fetchall()
+        else:
+            rows = []
+            for chunk in self.db.chunks(ids):
+                where = "WHERE e.id IN ({})".format(", ".join("?" for _ in chunk))
+                rows.extend(self.db.cursor.execute(self._texts_q.format(where), chunk))
+        counts = {}
+        for id, *texts in rows:
+            terms = collections.Counter(tokenize(" ".join(t for t in texts if t)))
+            counts[id] = {
+                self._vocabulary.setdefault(term, len(self._vocabulary)): n
+                for term, n in terms.items()
+            }
+        return counts
+
+    def _rebuild(self, position: tuple[int, int]) -> None:
+        self._vocabulary = {}
+        counts = self._count()
+        self._base_ids = list(counts)
+        self._base = self._to_csr(counts.values())
+        self._changed = {}
+        self._position = position
+        self._replaced = self.db.replaced
+        self._base_weights = None
+        self._changed_weights = None
+        self._save()
+        logger.info(f"Built the related entries over {len(self._base_ids)} entries.")
+
+    def _to_csr(self, rows: Iterable[dict[int, int]]):
+        indptr, indices, data = [0], [], []
+        for row in rows:
+            indices.extend(row.keys())
+            data.extend(row.values())
+            indptr.append(len(indices))
+        return sp.csr_matrix(
+            (
+                np.array(data, dtype=np.float32),
+                np.array(indices, dtype=np.int32),
+                np.array(indptr, dtype=np.int64),
+            ),
+            shape=(len(indptr) - 1, len(self._vocabulary)),
+        )
+
+    def _merge(self) -> None:
+        """Fold the changed rows into the saved ones."""
+        keep = [i for i, id in enumerate(self._base_ids) if id not in self._changed]
+        added = {id: row for id, row in self._changed.items() if row is not None}
+        base = self._resized(self._base)[keep]
+        self._base = sp.vstack([base, self._to_csr(added.values())], format="csr")
+        self._base_ids = [self._base_ids[i] for i in keep] + list(added)
+        self._changed = {}
+        self._base_weights = None
+        self._changed_weights = None
+
+    def _resized(self, matrix):
+        return sp.csr_matrix(
+            (matrix.data, matrix.indices, matrix.indptr),
+            shape=(matrix.shape[0], len(self._vocabulary)),
+        )
+
+    def _row(self, id: uuid.UUID) -> int | None:
+        if id in self._changed:
+            return self._changed_rows.get(id)
+        return self._base_rows.get(id)
+
+    def _id(self, row: int, saved: int) -> uuid.UUID:
+        if row < saved:
+            return self._base_ids[row]
+        return self._changed_ids[row - saved]
+
+    def _assemble(self):
+        """The TF-IDF weights of the saved and of the changed rows, with unit
+        length rows."""
+        if self._base_weights is None:
+            counts = self._resized(self._base)
+            self._df = np.bincount(counts.indices, minlength=counts.shape[1])
+            self._base_weights = self._weigh(
+                counts, self._idf(counts.shape[0], self._df)
+            )
+            self._base_rows = {id: i for i, id in enumerate(self._base_ids)}
+        if self._changed_weights is None:
+            size = len(self._vocabulary)
+            added = {id: row for id, row in self._changed.items() if row is not None}
+            counts = self._to_csr(added.values())
+            self._shadowed = np.array(
+                [self._base_rows[id] for id in self._changed if id in self._base_rows],
+                dtype=np.int64,
+            )
+            # The frequencies of all current rows, from those of the saved
+            # rows without the shadowed ones.
+            shadowed = self._resized(self._base)[self._shadowed]
+            df = np.bincount(counts.indices, minlength=size) - np.bincount(
+                shadowed.indices, minlength=size
+            )
+            df[: len(self._df)] += self._df
+            n = self._base.shape[0] - len(self._shadowed) + counts.shape[0]
+            self._changed_weights = self._weigh(counts, self._idf(n, df))
+            self._changed_ids = list(added)
+            saved = len(self._base_ids)
+            self._changed_rows = {id: saved + i for i, id in enumerate(added)}
+        return self._resized(self._base_weights), self._changed_weights
+
+    @staticmethod
+    def _idf(n: int, df):
+        return np.log((1 + n) / (1 + df)).astype(np.float32) + 1
+
+    @staticmethod
+    def _weigh(counts, idf):
+        weights = counts.copy()
+        weights.data = (1 + np.log(weights.data)) * idf[weights.indices]
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sp.csr_matrix(sp.diags(1 / norms) @ weights)
+
+    ###
+    ### Persistence
+    ###
+
+    _arrays = ("data", "indices", "indptr")
+
+    def _save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name in self._arrays:
+            tmp = self.path / f"{name}.tmp.npy"
+            np.save(tmp, getattr(self._base, name))
+            os.replace(tmp, self.path / f"{name}.npy")
+        meta = {
+            "version": FORMAT_VERSION,
+            "db_file": str(self.db.db_file),
+            "position": self._position,
+            "shape": self._base.shape,
+            "nnz": int(self._base.nnz),
+            "ids": [id.hex for id in self._base_ids],
+            "vocabulary": sorted(self._vocabulary, key=self._vocabulary.get),
+        }
+        tmp = self.path / "meta.tmp.json"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.path / "meta.json")
+
+    def _load(self) -> None:
+        """Map the saved counts, if they match the database."""
+        try:
+            meta = json.loads((self.path / "meta.json").read_text())
+            arrays = [
+                np.load(self.path / f"{name}.npy", mmap_mode="r")
+                for name in self._arrays
+            ]
+        except (OSError, ValueError) as err:
+            logger.info(f"No saved related entries at {self.path}: {err}")
+            return
+        if (
+            meta.get("version") != FORMAT_VERSION
+            or meta["db_file"] != str(self.db.db_file)
+            or len(arrays[0]) != meta["nnz"]
+            or len(arrays[2]) != meta["shape"][0] + 1
+        ):
+            logger.info(f"The saved related entries at {self.path} are outdated.")
+            return
+        self._base = sp.csr_matrix(tuple(arrays), shape=tuple(meta["shape"]))
+        self._base_ids = [uuid.UUID(hex=id) for id in meta["ids"]]
+        self._vocabulary = {term: i for i, term in enumerate(meta["vocabulary"])}
+        self._position = tuple(meta["position"])
+        logger.info(f"Loaded the related entries from {self.path}.")
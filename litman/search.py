@@ -1,53 +1,279 @@
-import itertools
+import collections
+import logging
+import re
+import threading
 import uuid
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
 
+from litman import fuzzy
 from litman.db_connector import DB
+from litman.enums import EntryTypes
 from litman.keywords import Keyword
 
+logger = logging.getLogger(__name__)
+
+
+def substring_filter(
+    query: str, columns: tuple[str, ...] = ("key",)
+) -> tuple[str, list]:
+    """A condition on ``entry`` for ``query`` being part of any of ``columns``.
+
+    The columns are ``key`` and ``doi``, which are indexed by the trigram
+    index ``entry_key_fts``. Queries shorter than a trigram can not use it
+    and fall back to a scan with LIKE.
+    """
+    if len(query) < 3:
+        condition = " OR ".join(f"{column} LIKE ?" for column in columns)
+        return f"({condition})", [f"%{query}%"] * len(columns)
+    phrase = '"{}"'.format(query.replace('"', '""'))
+    match = "{{{}}} : {}".format(" ".join(columns), phrase)
+    condition = "rowid IN (SELECT rowid FROM entry_key_fts WHERE entry_key_fts MATCH ?)"
+    return condition, [match]
+
+
+@dataclass
+class _CachedResult:
+    position: tuple[int, int]
+    tables: tuple[str, ...]
+    value: Any
+
+
+class SearchCache:
+    """An LRU cache of search results, invalidated by the transaction logs.
+
+    Each result is stored with the log position it was computed at and the
+    tables it depends on. It stays valid while no rows for these tables are
+    logged after that position, which is checked with a range scan over the
+    new log rows only. Results older than the log horizon are recomputed, as
+    compaction may have removed their changes from the log. A change of an
+    abstract is logged as an update of its entry.
+    """
+
+    max_size: int
+    hits: int
+    misses: int
+
+    _changed_q = """SELECT EXISTS (
+            SELECT 1 FROM transaction_log WHERE seq > ? AND source IN ({0})
+        ) OR EXISTS (
+            SELECT 1 FROM transaction_log_link WHERE seq > ? AND source IN ({0})
+        )"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results: collections.OrderedDict[tuple, _CachedResult] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def fetch(
+        self,
+        db: DB,
+        key: tuple,
+        tables: tuple[str, ...],
+        compute: Callable[[], Any],
+    ) -> Any:
+        """Return the cached result for ``key``, or compute and cache it."""
+        key = (str(db.db_file), db.replaced, *key)
+        # Taken before computing, so a concurrent write can only cause an
+        # unneeded recomputation later, never a stale result.
+        position = db.log_position()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+        if cached is not None and self._is_current(db, cached, position):
+            self.hits += 1
+            return cached.value
+        self.misses += 1
+        value = compute()
+        with self._lock:
+            self._results[key] = _CachedResult(position, tables, value)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return value
+
+    def _is_current(
+        self, db: DB, cached: _CachedResult, position: tuple[int, int]
+    ) -> bool:
+        if cached.position == position:
+            return True
+        if any(now < then for now, then in zip(position, cached.position)):
+            return False
+        if any(h > then for h, then in zip(db.log_horizon(), cached.position)):
+            return False
+        placeholders = ", ".join("?" for _ in cached.tables)
+        changed = db.cursor.execute(
+            self._changed_q.format(placeholders),
+            (cached.position[0], *cached.tables, cached.position[1], *cached.tables),
+        ).fetchone()[0]
+        if changed:
+            return False
+        cached.position = position
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+cache = SearchCache()
+
+
+@dataclass
+class SearchHit:
+    id: uuid.UUID
+    key: str
+    title: str
+    # The best matching fragment, with matches between ``Search.highlight``.
+    snippet: str
+    score: float
+
 
 class Search:
+    """Ranked search over the keys, titles, abstracts and authors of entries.
+
+    All fields are searched in one pass over ``search_fts`` and ranked with
+    bm25, weighted by the column a term matched in. An exact key match is
+    always ranked first. Every word of the query has to match, as a prefix.
+
+    Without a match, entries whose key or DOI contain the query are returned,
+    and without these the entries with words close to the query words, to
+    tolerate typos. ``fuzzy`` tells if the hits are such close matches.
+    """
+
     db: DB
     query: str
-    result: list
+    limit: int
+    offset: int
+    hits: list[SearchHit]
+    result: list[uuid.UUID]
+    fuzzy: bool
 
-    _key_exact = "SELECT id FROM entry WHERE key = ?"
-    _key_like = "SELECT id FROM entry WHERE key LIKE ?"
-    _title = """SELECT id FROM entry WHERE id IN (
-            SELECT rowid FROM entry_fts WHERE title MATCH ? ORDER BY rank
-        )"""
+    # Markers around the matches in a snippet.
+    highlight = ("\x02", "\x03")
+    # The logged tables the results depend on.
+    tables = ("entry", "author", "author_link")
+    # bm25 weights of the columns key, title, abstract and authors.
+    _weights = (10.0, 4.0, 1.0, 2.0)
+    _snippet_tokens = 12
 
-    def __init__(self, db: DB, query: str):
+    _search_q = """SELECT e.id, e.key, e.title,
+            snippet(search_fts, -1, ?, ?, '…', ?), rank
+        FROM search_fts JOIN entry e ON e.rowid = search_fts.rowid
+        WHERE search_fts MATCH ? AND rank MATCH ?
+        ORDER BY e.key = ? DESC, rank
+        LIMIT ? OFFSET ?"""
+    _substring_q = """SELECT id, key, title, doi FROM entry WHERE {}
+        ORDER BY key LIMIT ? OFFSET ?"""
+
+    def __init__(self, db: DB, query: str, limit: int = 50, offset: int = 0):
         self.db = db
-        self.query = query
-        self.result = self.search()
-
-    def search(self) -> list[uuid.UUID]:
-        """Serach for entries and return the ids of matches."""
-        # Key based searches
-        key_exact = self._search_key_exact()
-        if key_exact:
-            return key_exact
-        key_like = self._search_key_like()
-        if len(key_like) > 0:
-            return key_like
-        title = self._search_title()
-        if len(title) > 0:
-            return title
-        return []
-
-    def _search_key_exact(self) -> list[uuid.UUID]:
-        results = self.db.cursor.execute(self._key_exact, (self.query,)).fetchall()
-        return [r[0] for r in results]
-
-    def _search_key_like(self) -> list[uuid.UUID]:
-        results = self.db.cursor.execute(
-            self._key_like, (f"%{self.query}%",)
+        self.query = " ".join(query.split())
+        self.limit = limit
+        self.offset = offset
+        self.fuzzy = False
+        self.hits, self.fuzzy = cache.fetch(
+            db,
+            ("search", self.query, limit, offset),
+            self.tables,
+            lambda: (self.search(), self.fuzzy),
+        )
+        self.result = [hit.id for hit in self.hits]
+
+    @staticmethod
+    def match_expression(query: str) -> str | None:
+        """Turn a user query into an FTS5 query of quoted prefix terms."""
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return None
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def search(self) -> list[SearchHit]:
+        """Search for entries and return the best matches first."""
+        match = self.match_expression(self.query)
+        if match is None:
+            return []
+        weights = "bm25({})".format(", ".join(str(w) for w in self._weights))
+        rows = self.db.cursor.execute(
+            self._search_q,
+            (
+                *self.highlight,
+                self._snippet_tokens,
+                match,
+                weights,
+                self.query,
+                self.limit,
+                self.offset,
+            ),
         ).fetchall()
-        return [result[0] for result in results]
+        if not rows:
+            return self._search_substring() or self._search_fuzzy()
+        return [SearchHit(*row) for row in rows]
+
+    def _search_substring(self) -> list[SearchHit]:
+        query = self.query
+        condition, args = substring_filter(query, ("key", "doi"))
+        rows = self.db.cursor.execute(
+            self._substring_q.format(condition), (*args, self.limit, self.offset)
+        ).fetchall()
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+        start, end = self.highlight
+        hits = []
+        for id, key, title, doi in rows:
+            field = key if pattern.search(key) else doi or ""
+            snippet = pattern.sub(lambda m: f"{start}{m.group(0)}{end}", field)
+            hits.append(SearchHit(id, key, title, snippet, 0.0))
+        return hits
+
+    def _search_fuzzy(self) -> list[SearchHit]:
+        matches = fuzzy.index.search(self.db, self.query, self.limit, self.offset)
+        self.fuzzy = bool(matches)
+        start, end = self.highlight
+        hits = []
+        for match in matches:
+            snippet = re.sub(
+                r"\w+",
+                lambda m, words=match.matched: (
+                    f"{start}{m.group(0)}{end}"
+                    if m.group(0).casefold() in words
+                    else m.group(0)
+                ),
+                match.title,
+            )
+            if start not in snippet:
+                # The match was in the key or the authors.
+                snippet = ", ".join(f"{start}{w}{end}" for w in sorted(match.matched))
+            hits.append(
+                SearchHit(match.id, match.key, match.title, snippet, match.distance)
+            )
+        return hits
+
+
+@dataclass
+class FacetCount:
+    # An ``EntryTypes``, the first year of a bucket, or the id of a keyword,
+    # collection or author.
+    value: Any
+    label: str
+    count: int
+
 
-    def _search_title(self) -> list[uuid.UUID]:
-        results = self.db.cursor.execute(self._title, (self.query,)).fetchall()
-        return [result[0] for result in results]
+@dataclass
+class _Filter:
+    # The estimated fraction of entries passing the filter.
+    selectivity: float
+    # A condition on ``entry`` that can be evaluated for each row.
+    probe: str
+    args: list
+    # An equivalent condition that finds the passing entries through an
+    # index, or None if there is no such index.
+    driver: str | None = None
 
 
 class AdvancedSearch:
@@ -56,77 +282,348 @@ class AdvancedSearch:
     Implemented filters are:
         * Title: Token search (sqlite FTS)
         * Author: Token search (sqlite FTS)
-        * Keywords: Must belong to any of the keywords
+        * Keywords: Any, all or none of the keywords (``keyword_mode``)
+        * Excluded keywords: None of these keywords
+        * Year: An inclusive range, either end may be open
+        * Entry types: Any of the types
+        * Collections: Member of any of the collections
+        * Has file / has DOI: True or False, None to not filter
+
+    The filters are combined into one query. They are ordered by their
+    estimated selectivity. The most selective filter with an index finds
+    the candidate entries, and the others are checked per candidate, with
+    ``EXISTS`` probes into the indexed link tables.
+
+    Along with the entries, a search counts the entries found per type, per
+    decade, and for the most common keywords, collections and authors. The
+    ids found are stored in a temp table, which all counts are aggregated
+    from in one statement.
     """
 
     is_valid: bool
+    facets: dict[str, list[FacetCount]]
     _title: str | None
     _author: str | None
     _keywords: list[Keyword] | None
+    _keyword_mode: str
+    _excluded_keywords: list[Keyword] | None
+    _year_from: int | None
+    _year_to: int | None
+    _entry_types: list[EntryTypes] | None
+    _collections: list[uuid.UUID] | None
+    _has_file: bool | None
+    _has_doi: bool | None
+
+    keyword_modes = ("any", "all", "none")
+    tables = (
+        "entry",
+        "author",
+        "author_link",
+        "keyword",
+        "keyword_link",
+        "collection",
+        "collection_link",
+        "file_link",
+    )
+    # The number of keywords, collections and authors counted.
+    facet_size = 10
+    year_bucket = 10
+    # Years covered by a typical library, to estimate year ranges.
+    _year_span = 50
+
+    _title_q = "rowid IN (SELECT rowid FROM entry_fts WHERE title MATCH ?)"
+    _author_q = """id IN (
+            SELECT l.entry_id FROM author_fts
+            JOIN author a ON a.rowid = author_fts.rowid
+            JOIN author_link l ON l.author_id = a.id
+            WHERE author_fts MATCH ?
+        )"""
+    _link_driver_q = "id IN (SELECT entry_id FROM {table} WHERE {column} IN ({ids}))"
+    _link_probe_q = """EXISTS (
+            SELECT 1 FROM {table}
+            WHERE entry_id = entry.id AND {column} IN ({ids})
+        )"""
+    _file_probe_q = "EXISTS (SELECT 1 FROM file_link WHERE entry_id = entry.id)"
+    _match_q = """CREATE TEMP TABLE search_match AS SELECT id FROM entry WHERE {}"""
+    _results_q = """SELECT e.id, e.key, e.title
+        FROM temp.search_match m JOIN entry e ON e.id = m.id
+        ORDER BY e.key"""
+    _facets_q = """
+        SELECT 'type', e.type, NULL, count(*)
+        FROM temp.search_match m JOIN entry e ON e.id = m.id
+        GROUP BY e.type
+        UNION ALL
+        SELECT 'year', e.year / :bucket * :bucket, NULL, count(*)
+        FROM temp.search_match m JOIN entry e ON e.id = m.id
+        GROUP BY 2
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'keyword', k.id, k.name, count(*)
+            FROM temp.search_match m
+            JOIN keyword_link l ON l.entry_id = m.id
+            JOIN keyword k ON k.id = l.keyword_id
+            GROUP BY k.id ORDER BY 4 DESC, 3 LIMIT :size
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'collection', c.id, c.name, count(*)
+            FROM temp.search_match m
+            JOIN collection_link l ON l.entry_id = m.id
+            JOIN collection c ON c.id = l.collection_id
+            GROUP BY c.id ORDER BY 4 DESC, 3 LIMIT :size
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'author', a.id,
+                coalesce(a.first_name || ' ', '') || a.last_name, count(*)
+            FROM temp.search_match m
+            JOIN author_link l ON l.entry_id = m.id
+            JOIN author a ON a.id = l.author_id
+            GROUP BY a.id ORDER BY 4 DESC, 3 LIMIT :size
+        )"""
 
     def __init__(
         self,
         title: str | None = None,
         author: str | None = None,
         keywords: list[Keyword] | None = None,
+        keyword_mode: str = "any",
+        excluded_keywords: list[Keyword] | None = None,
+        year_from: int | None = None,
+        year_to: int | None = None,
+        entry_types: list[EntryTypes] | None = None,
+        collections: list[uuid.UUID] | None = None,
+        has_file: bool | None = None,
+        has_doi: bool | None = None,
     ):
+        if keyword_mode not in self.keyword_modes:
+            raise ValueError(f"Unknown keyword mode '{keyword_mode}'.")
         self._title = title
         self._author = author
         self._keywords = keywords
+        self._keyword_mode = keyword_mode
+        self._excluded_keywords = excluded_keywords
+        self._year_from = year_from
+        self._year_to = year_to
+        self._entry_types = entry_types
+        self._collections = collections
+        self._has_file = has_file
+        self._has_doi = has_doi
         # Check that there is at least one filter.
-        self.is_valid = title or author or keywords
+        self.is_valid = bool(
+            title
+            or author
+            or keywords
+            or excluded_keywords
+            or year_from is not None
+            or year_to is not None
+            or entry_types
+            or collections
+            or has_file is not None
+            or has_doi is not None
+        )
+        self.facets = {}
+
+    def _author_match(self) -> str | None:
+        """The FTS5 query for the author filter.
 
-    def _search_authors(self, db: DB) -> list[uuid.UUID]:
-        """Search for authors matching the name provided."""
-        authors = self._author.split(",")
-        q = "SELECT id FROM author WHERE " + " OR ".join(
-            ["last_name LIKE ?"] * len(authors)
+        Authors are separated by commas and any of them may match. All words
+        of one author have to match one of their names, as a prefix.
+        """
+        names = [Search.match_expression(name) for name in self._author.split(",")]
+        names = [f"({name})" for name in names if name is not None]
+        return " OR ".join(names) if names else None
+
+    def _link_filter(
+        self, table: str, column: str, ids: list, selectivity: float, negate=False
+    ) -> _Filter:
+        placeholders = ", ".join("?" for _ in ids)
+        probe = self._link_probe_q.format(table=table, column=column, ids=placeholders)
+        if negate:
+            return _Filter(1 - selectivity, f"NOT {probe}", list(ids))
+        driver = self._link_driver_q.format(
+            table=table, column=column, ids=placeholders
+        )
+        return _Filter(selectivity, probe, list(ids), driver)
+
+    def _filters(self) -> list[_Filter] | None:
+        """The filters of the search, or None if nothing can match.
+
+        Selectivities are rough estimates: full text matches and single
+        keywords or collections are rare, years are spread over a few
+        decades, and types, files and DOIs split the library coarsely.
+        """
+        filters = []
+        if self._title:
+            title_match = Search.match_expression(self._title)
+            if title_match is None:
+                return None
+            filters.append(_Filter(0.01, self._title_q, [title_match], self._title_q))
+        if self._author:
+            author_match = self._author_match()
+            if author_match is None:
+                return None
+            filters.append(
+                _Filter(0.01, self._author_q, [author_match], self._author_q)
+            )
+        keyword_ids = [k.id for k in self._keywords or []]
+        excluded_ids = [k.id for k in self._excluded_keywords or []]
+        if keyword_ids and self._keyword_mode == "any":
+            filters.append(
+                self._link_filter(
+                    "keyword_link", "keyword_id", keyword_ids, 0.05 * len(keyword_ids)
+                )
+            )
+        elif keyword_ids and self._keyword_mode == "all":
+            filters.extend(
+                self._link_filter("keyword_link", "keyword_id", [id], 0.05)
+                for id in keyword_ids
+            )
+        elif keyword_ids:
+            excluded_ids.extend(keyword_ids)
+        if excluded_ids:
+            filters.append(
+                self._link_filter(
+                    "keyword_link",
+                    "keyword_id",
+                    excluded_ids,
+                    0.05 * len(excluded_ids),
+                    negate=True,
+                )
+            )
+        if self._collections:
+            filters.append(
+                self._link_filter(
+                    "collection_link",
+                    "collection_id",
+                    self._collections,
+                    0.05 * len(self._collections),
+                )
+            )
+        if self._year_from is not None or self._year_to is not None:
+            low = self._year_from if self._year_from is not None else -(2**31)
+            high = self._year_to if self._year_to is not None else 2**31
+            if low > high:
+                return None
+            span = (high - low + 1) / self._year_span
+            q = "year BETWEEN ? AND ?"
+            filters.append(_Filter(min(0.9, span), q, [low, high], q))
+        if self._entry_types:
+            types = [t.value for t in self._entry_types]
+            q = "type IN ({})".format(", ".join("?" for _ in types))
+            filters.append(_Filter(min(1.0, 0.33 * len(types)), q, types))
+        if self._has_file is not None:
+            q = self._file_probe_q if self._has_file else f"NOT {self._file_probe_q}"
+            filters.append(_Filter(0.5, q, []))
+        if self._has_doi is not None:
+            q = "coalesce(doi, '') != ''" if self._has_doi else "coalesce(doi, '') = ''"
+            filters.append(_Filter(0.5, q, []))
+        return filters
+
+    def build_query(self) -> tuple[str, list] | None:
+        """Combine the filters into the condition of one query on ``entry``.
+
+        The most selective filter with an index comes first, in its driver
+        form, so it finds the candidates. The others follow in order of
+        selectivity as probes, so the cheapest rejections are checked first.
+
+        Returns:
+            The condition and its arguments, or None if nothing can match.
+        """
+        filters = self._filters()
+        if filters is None:
+            return None
+        filters.sort(key=lambda f: f.selectivity)
+        drivers = [f for f in filters if f.driver is not None]
+        conditions = []
+        args = []
+        if drivers:
+            filters.remove(drivers[0])
+            conditions.append(drivers[0].driver)
+            args.extend(drivers[0].args)
+        for f in filters:
+            conditions.append(f.probe)
+            args.extend(f.args)
+        return " AND ".join(conditions), args
+
+    def explain(self, db: DB) -> list[str]:
+        """The query plan of the search, as from ``EXPLAIN QUERY PLAN``."""
+        query = self.build_query()
+        if query is None:
+            return []
+        condition, args = query
+        rows = db.cursor.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM entry WHERE {condition}", args
+        ).fetchall()
+        return [row[3] for row in rows]
+
+    def _cache_key(self) -> tuple:
+        def ids(items):
+            return tuple(sorted(str(getattr(i, "id", i)) for i in items or []))
+
+        return (
+            "advanced",
+            self._title,
+            self._author,
+            ids(self._keywords),
+            self._keyword_mode,
+            ids(self._excluded_keywords),
+            self._year_from,
+            self._year_to,
+            tuple(sorted(t.value for t in self._entry_types or [])),
+            ids(self._collections),
+            self._has_file,
+            self._has_doi,
         )
-        ids = db.cursor.execute(q, [f"%{a.strip()}%" for a in authors]).fetchall()
-        ids = list(itertools.chain.from_iterable(ids))
-        return ids
 
     def search(self, db: DB) -> list[tuple]:
-        """This function executes the search.
+        """Run the search, or return its cached result.
 
-        There are fundamentally two different kind of queries:
-        1. If I need full text search
-        2. If I filter only on keywords.
+        The facet counts of the result are stored in ``facets``.
 
         Returns:
             tuples of id, key, and title for each entry found.
         """
         if not self.is_valid:
             raise ValueError("Search is not valid")
-        # I have a number of conditions that come from link tables. These are:
-        #   title (entry_fts)
-        #   author (author_link)
-        #   keyword (keyword_link)
-        # For these I can build the subqueries and then later merge them.
-        foreign_queries = []
-        foreign_args = []
-        if self._title:
-            q = "rowid IN (SELECT rowid FROM entry_fts WHERE title MATCH ?)"
-            foreign_queries.append(q)
-            foreign_args.append(self._title)
-        if self._author:
-            author_ids = self._search_authors(db)
-            q = "id IN (SELECT DISTINCT entry_id FROM author_link WHERE author_id IN ({}))".format(
-                ", ".join("?" for _ in author_ids)
-            )
-            foreign_queries.append(q)
-            foreign_args.extend(author_ids)
-        if self._keywords:
-            q = "id IN (SELECT DISTINCT entry_id FROM keyword_link WHERE keyword_id IN ({}))".format(
-                ", ".join("?" for _ in self._keywords)
-            )
-            foreign_queries.append(q)
-            foreign_args.extend([k.id for k in self._keywords])
-
-        query = "SELECT id, key, title FROM entry WHERE " + " AND ".join(
-            foreign_queries
+        results, self.facets = cache.fetch(
+            db, self._cache_key(), self.tables, lambda: self._search(db)
         )
-        args = foreign_args
-        print(query, args)
-        results = db.cursor.execute(query, args).fetchall()
         return results
+
+    def _search(self, db: DB) -> tuple[list[tuple], dict[str, list[FacetCount]]]:
+        query = self.build_query()
+        if query is None:
+            return [], {}
+        condition, args = query
+        logger.debug(f"Advanced search on '{condition}' with {args}")
+        db.cursor.execute("DROP TABLE IF EXISTS temp.search_match")
+        db.cursor.execute(self._match_q.format(condition), args)
+        results = db.cursor.execute(self._results_q).fetchall()
+        facets = self._count_facets(db)
+        db.cursor.execute("DROP TABLE temp.search_match")
+        return results, facets
+
+    def _count_facets(self, db: DB) -> dict[str, list[FacetCount]]:
+        rows = db.cursor.execute(
+            self._facets_q, {"bucket": self.year_bucket, "size": self.facet_size}
+        ).fetchall()
+        facets = {
+            name: [] for name in ("type", "year", "keyword", "collection", "author")
+        }
+        for facet, value, label, count in rows:
+            if facet == "type":
+                value = EntryTypes(value)
+                label = value.name
+            elif facet == "year":
+                label = (
+                    "Unknown"
+                    if value is None
+                    else f"{value}-{value + self.year_bucket - 1}"
+                )
+            else:
+                value = uuid.UUID(bytes=value)
+            facets[facet].append(FacetCount(value, label, count))
+        facets["type"].sort(key=lambda f: -f.count)
+        facets["year"].sort(key=lambda f: (f.value is None, f.value or 0))
+        return facets
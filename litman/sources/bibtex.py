@@ -32,32 +32,31 @@ def parse_entry(
         if Entry.key_exists(db, parsed.key) is not None:
             logger.info(f"Entry '{parsed.key}' already exists. Skipping")
             return None
-        else:
+        with db.transaction() as transaction:
             parsed.save(db)
-        # Parse the authors
-        if "author" in bib_entry:
-            authors = Author.parse_authors(bib_entry["author"])
-            for author in authors:
-                author.save(db)
-                parsed.attach_author(db, author)
-        if "file" in bib_entry:
-            if import_root is None:
-                raise Exception("Cannot import file without a library root.")
-            # The first files is assumed to be the main file.
-            # This block might be jabref specific.
-            for i, file_str in enumerate(bib_entry["file"].split(";")):
-                desc, path, type = file_str.split(":", 2)
-                file = File(
-                    None,
-                    path=import_root / path,
-                    filetype=type.lower(),
-                    default_open=i == 0,
-                )
-                file.save(config, db)
-                parsed.attach_file(db, file)
-        if "abstract" in bib_entry:
-            parsed.add_abstract(db, bib_entry["abstract"])
-        db.connection.commit()
+            # Parse the authors
+            if "author" in bib_entry:
+                authors = Author.parse_authors(bib_entry["author"])
+                for author in authors:
+                    author.save(db)
+                    transaction.defer(Entry._attach_author, (author.id, parsed.id))
+            if "file" in bib_entry:
+                if import_root is None:
+                    raise Exception("Cannot import file without a library root.")
+                # The first files is assumed to be the main file.
+                # This block might be jabref specific.
+                for i, file_str in enumerate(bib_entry["file"].split(";")):
+                    desc, path, type = file_str.split(":", 2)
+                    file = File(
+                        None,
+                        path=import_root / path,
+                        filetype=type.lower(),
+                        default_open=i == 0,
+                    )
+                    file.save(config, db)
+                    transaction.defer(Entry._attach_file, (file.id, parsed.id))
+            if "abstract" in bib_entry:
+                parsed.add_abstract(db, bib_entry["abstract"])
         logger.debug(f"Saved paper '{parsed.key}'.")
         return parsed
     except Exception as err:
@@ -81,10 +80,12 @@ def import_library(
     else:
         library = bibtexparser.parse_string(bib_string)
     entries = []
-    for entry in library.entries:
-        parsed = parse_entry(config, db, entry, library_root)
-        if parsed is not None:
-            entries.append(parsed)
+    # One transaction for the library, every entry is a savepoint in it.
+    with db.transaction():
+        for entry in library.entries:
+            parsed = parse_entry(config, db, entry, library_root)
+            if parsed is not None:
+                entries.append(parsed)
     return entries
 
 
@@ -0,0 +1,288 @@
+"""Binary wire format for exchanging transactions during a sync.
+
+A message starts with an uncompressed header of six bytes:
+
+    magic    4 bytes   b"LTMS"
+    version  u8        format version, see ``SUPPORTED_VERSIONS``
+    codec    u8        0: none, 1: gzip, 2: zstd
+
+Everything after the header is compressed with the codec as one stream and
+consists of frames. Every frame starts with a u8 kind:
+
+    1  meta     u32 length, UTF-8 JSON object (e.g. ``{"last_sync": 0}``)
+    2  chunk    u8 table name length, table name, u8 action,
+                u32 row count, u32 payload length, payload
+    0  end      no body, last frame of the message
+
+A chunk payload holds the rows of one ``(table, action, rows)`` chunk as
+produced by ``DB.stream_transactions``. Every row is a u16 column count
+followed by the values, each one a u8 tag and its data:
+
+    0  NULL
+    1  integer  i64
+    2  real     f64
+    3  text     u32 length, UTF-8
+    4  blob     u32 length, bytes
+    5  uuid     16 raw bytes
+
+All integers are big endian. A receiver answers in the version and codec
+of the request, or rejects versions it does not support.
+"""
+
+import json
+import struct
+import uuid
+import zlib
+from typing import Any, BinaryIO, Iterable, Iterator
+
+from litman.db_connector import DB
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"LTMS"
+VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+MIME_TYPE = "application/x-litman-sync"
+
+CODEC_NONE = 0
+CODEC_GZIP = 1
+CODEC_ZSTD = 2
+CODECS = {"none": CODEC_NONE, "gzip": CODEC_GZIP, "zstd": CODEC_ZSTD}
+
+_FRAME_END = 0
+_FRAME_META = 1
+_FRAME_CHUNK = 2
+
+_header = struct.Struct(">4sBB")
+_u8 = struct.Struct(">B")
+_u16 = struct.Struct(">H")
+_u32 = struct.Struct(">I")
+_i64 = struct.Struct(">q")
+_f64 = struct.Struct(">d")
+_chunk_head = struct.Struct(">BII")
+
+# Size of the reads from the underlying stream while decoding.
+_read_size = 2**16
+
+
+class UnsupportedVersion(ValueError):
+    """The message uses a format version this side cannot read."""
+
+
+def codec(name: str) -> int:
+    """The codec configured by ``name``, checked to be usable here.
+
+    Raises:
+        ValueError: If the codec is unknown or its package is not installed.
+    """
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression '{name}', use one of {list(CODECS)}.")
+    if CODECS[name] == CODEC_ZSTD and zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package.")
+    return CODECS[name]
+
+
+def _compressor(codec: int):
+    if codec == CODEC_NONE:
+        return None
+    if codec == CODEC_GZIP:
+        return zlib.compressobj(wbits=31)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package.")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unknown codec '{codec}'.")
+
+
+def _decompressor(codec: int):
+    if codec == CODEC_NONE:
+        return None
+    if codec == CODEC_GZIP:
+        return zlib.decompressobj(wbits=31)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unknown codec '{codec}'.")
+
+
+###
+### Encoding
+###
+
+
+def _encode_value(value: Any, out: bytearray) -> None:
+    if value is None:
+        out += b"\x00"
+    elif isinstance(value, int):
+        out += b"\x01" + _i64.pack(value)
+    elif isinstance(value, float):
+        out += b"\x02" + _f64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf8")
+        out += b"\x03" + _u32.pack(len(data)) + data
+    elif isinstance(value, uuid.UUID):
+        out += b"\x05" + value.bytes
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out += b"\x04" + _u32.pack(len(value)) + bytes(value)
+    else:
+        raise TypeError(f"Cannot encode value of type '{type(value)}'.")
+
+
+def _encode_chunk(table: str, action: int, rows: list[tuple]) -> bytes:
+    payload = bytearray()
+    for row in rows:
+        payload += _u16.pack(len(row))
+        for value in row:
+            _encode_value(value, payload)
+    name = table.encode("utf8")
+    return (
+        _u8.pack(_FRAME_CHUNK)
+        + _u8.pack(len(name))
+        + name
+        + _chunk_head.pack(action, len(rows), len(payload))
+        + payload
+    )
+
+
+def encode(
+    meta: dict,
+    changes: Iterable[tuple[str, int, list[tuple]]],
+    codec: int = CODEC_GZIP,
+    version: int = VERSION,
+) -> Iterator[bytes]:
+    """Encode a message lazily, one compressed piece per chunk."""
+    if version not in SUPPORTED_VERSIONS:
+        raise UnsupportedVersion(f"Cannot write sync format version {version}.")
+    compressor = _compressor(codec)
+
+    def compress(data: bytes) -> bytes:
+        return data if compressor is None else compressor.compress(data)
+
+    yield _header.pack(MAGIC, version, codec)
+    meta_data = json.dumps(meta).encode("utf8")
+    yield compress(_u8.pack(_FRAME_META) + _u32.pack(len(meta_data)) + meta_data)
+    for table, action, rows in changes:
+        data = compress(_encode_chunk(table, action, rows))
+        if data:
+            yield data
+    data = compress(_u8.pack(_FRAME_END))
+    if compressor is not None:
+        data += compressor.flush()
+    yield data
+
+
+###
+### Decoding
+###
+
+
+class _Reader:
+    """Read exact amounts of decompressed bytes from a stream."""
+
+    def __init__(self, raw: BinaryIO, decompressor):
+        self._raw = raw
+        self._decompressor = decompressor
+        self._buffer = bytearray()
+
+    def read(self, n: int) -> bytes:
+        while len(self._buffer) < n:
+            data = self._raw.read(_read_size)
+            if not data:
+                raise ValueError("Unexpected end of the sync message.")
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            self._buffer += data
+        out = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return out
+
+
+def _decode_rows(payload: bytes, count: int) -> list[tuple]:
+    rows = []
+    view = memoryview(payload)
+    pos = 0
+    for _ in range(count):
+        (width,) = _u16.unpack_from(view, pos)
+        pos += 2
+        row = []
+        for _ in range(width):
+            tag = view[pos]
+            pos += 1
+            if tag == 0:
+                row.append(None)
+            elif tag == 1:
+                row.append(_i64.unpack_from(view, pos)[0])
+                pos += 8
+            elif tag == 2:
+                row.append(_f64.unpack_from(view, pos)[0])
+                pos += 8
+            elif tag == 3 or tag == 4:
+                (length,) = _u32.unpack_from(view, pos)
+                pos += 4
+                data = bytes(view[pos : pos + length])
+                pos += length
+                row.append(data.decode("utf8") if tag == 3 else data)
+            elif tag == 5:
+                row.append(uuid.UUID(bytes=bytes(view[pos : pos + 16])))
+                pos += 16
+            else:
+                raise ValueError(f"Unknown value tag '{tag}'.")
+        rows.append(tuple(row))
+    return rows
+
+
+class Message:
+    """A decoded message.
+
+    The header and the meta frame are read on creation. The changes are
+    read lazily while iterating over ``changes``, so they can be applied
+    while the rest of the message is still arriving.
+    """
+
+    version: int
+    codec: int
+    meta: dict
+
+    def __init__(self, stream: BinaryIO):
+        header = stream.read(_header.size)
+        if len(header) != _header.size:
+            raise ValueError("Sync message too short.")
+        magic, self.version, self.codec = _header.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not a litman sync message.")
+        if self.version not in SUPPORTED_VERSIONS:
+            raise UnsupportedVersion(
+                f"Sync format version {self.version} is not supported, "
+                f"supported are {SUPPORTED_VERSIONS}."
+            )
+        self._reader = _Reader(stream, _decompressor(self.codec))
+        kind = _u8.unpack(self._reader.read(1))[0]
+        if kind != _FRAME_META:
+            raise ValueError("Sync message does not start with a meta frame.")
+        (length,) = _u32.unpack(self._reader.read(4))
+        self.meta = json.loads(self._reader.read(length))
+
+    @property
+    def changes(self) -> Iterator[tuple[str, int, list[tuple]]]:
+        while True:
+            kind = _u8.unpack(self._reader.read(1))[0]
+            if kind == _FRAME_END:
+                return
+            if kind != _FRAME_CHUNK:
+                raise ValueError(f"Unknown frame kind '{kind}'.")
+            name_length = _u8.unpack(self._reader.read(1))[0]
+            table = self._reader.read(name_length).decode("utf8")
+            action, count, length = _chunk_head.unpack(
+                self._reader.read(_chunk_head.size)
+            )
+            DB.check_change(table, action)
+            yield table, action, _decode_rows(self._reader.read(length), count)
+
+
+def decode(stream: BinaryIO) -> Message:
+    """Start decoding a message from a readable binary stream."""
+    return Message(stream)
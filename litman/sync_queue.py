@@ -0,0 +1,141 @@
+"""Serialized processing of the syncs posted to the server.
+
+Syncs write to the database and are run one after another by a single
+worker thread. A posted sync is spooled to a file and becomes a job, which
+the client polls (or long-polls) for its result. Other requests keep
+reading during a merge, as the database runs in WAL mode. After each sync
+the worker compacts the logs up to what all clients acknowledged.
+"""
+
+import logging
+import os
+import pathlib
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterable
+
+from box import Box
+
+from litman.db_connector import DB
+from litman.synchronization import sync_server
+
+logger = logging.getLogger(__name__)
+
+# Seconds a finished job is kept for its client to fetch the result.
+_job_ttl = 600
+
+
+class QueueFull(Exception):
+    """Too many syncs are waiting already."""
+
+
+@dataclass
+class SyncJob:
+    id: uuid.UUID
+    request_file: pathlib.Path
+    status: str = "queued"
+    result_file: pathlib.Path | None = None
+    error: Exception | None = None
+    finished: float | None = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class SyncQueue:
+    """A bounded queue of syncs with a single worker."""
+
+    def __init__(self, config: Box, db: DB, max_pending: int = 16):
+        self.config = config
+        self.db = db
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs: dict[uuid.UUID, SyncJob] = {}
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+
+    def _spool(self, chunks: Iterable[bytes]) -> pathlib.Path:
+        fd, name = tempfile.mkstemp(dir=self.config.files.tmp_storage, suffix=".sync")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return pathlib.Path(name)
+
+    def submit(self, stream: BinaryIO) -> SyncJob:
+        """Spool a posted sync and queue it.
+
+        Raises:
+            QueueFull: If the queue is at its limit.
+        """
+        self._expire()
+        job = SyncJob(uuid.uuid4(), self._spool(iter(lambda: stream.read(2**16), b"")))
+        with self._lock:
+            self._jobs[job.id] = job
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full as err:
+                del self._jobs[job.id]
+                job.request_file.unlink()
+                raise QueueFull("Too many syncs are queued.") from err
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="litman-sync", daemon=True
+                )
+                self._worker.start()
+        return job
+
+    def wait(self, job_id: uuid.UUID, timeout: float) -> SyncJob | None:
+        """Wait up to ``timeout`` seconds for a job to finish."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def discard(self, job: SyncJob) -> None:
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        if job.result_file is not None:
+            job.result_file.unlink(missing_ok=True)
+
+    def _expire(self) -> None:
+        now = time.time()
+        with self._lock:
+            expired = [
+                job
+                for job in self._jobs.values()
+                if job.finished is not None and now - job.finished > _job_ttl
+            ]
+        for job in expired:
+            logger.info(f"Discarding unfetched sync job {job.id}.")
+            self.discard(job)
+
+    def _compact(self) -> None:
+        """Prune the logs up to the oldest position acknowledged by a client."""
+        try:
+            self.db.compact_transaction_logs()
+        except Exception as err:
+            logger.error("Compacting the transaction logs failed.")
+            logger.exception(err)
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            try:
+                with job.request_file.open("rb") as f:
+                    body = sync_server(self.config, self.db, f)
+                    # Encoding reads the database, so it is done here too.
+                    job.result_file = self._spool(body)
+                job.status = "done"
+                self._compact()
+            except Exception as err:
+                logger.exception(err)
+                job.error = err
+                job.status = "failed"
+            finally:
+                self.db.release()
+                job.request_file.unlink(missing_ok=True)
+                job.finished = time.time()
+                job.done.set()
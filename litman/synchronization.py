@@ -6,29 +6,56 @@ There are two ways to synchronize:
 
 The transactions based approach is a bit more complicated.
 
-1. The client collects local transactions and posts them to the server
-    (`server/push_transactions`).
-2. The server collects local transactions and decides what to write
-    (curently not implemented, so all).
-    It responds with the transactions since the clients last sync
-    and a list of the requested files.
-3. The client loads these transactions and posts the files to the server.
-4. The client posts a list of the files that it requires from the server.
-
-The bootstrapping simply clones the remote db to the local db.
+1. The client posts its local changes to the server (``/admin/sync``),
+    together with its identity and the server position it has seen.
+2. The server merges the changes, see ``DB.import_master``. Changes that
+    conflict with newer server changes are dropped and reported.
+    It responds with the changes after the position of the client, except
+    the ones that came from the client itself.
+3. The client loads these transactions.
+4. The client exchanges the stored files with the server, see
+    ``litman.file_sync``.
+
+Every change imported from a peer is logged with the peer as its origin,
+and each side keeps a cursor of what the other acknowledged, so no change
+is sent twice or echoed back to where it came from.
+
+The bootstrapping clones the remote db to the local db, from a snapshot
+and the log tail where possible.
+
+Transactions are exchanged in the streaming binary format described in
+``litman.sync_format``.
 """
 
 import pathlib
 import logging
-import pickle
+import threading
+import time
+import uuid
+from typing import BinaryIO, Iterator
 
 import urllib3
 from box import Box
 
+from litman import file_sync, sync_format
 from litman.db_connector import DB
 
 logger = logging.getLogger(__name__)
 
+POSITION_HEADER = "X-Litman-Position"
+ORIGIN_HEADER = "X-Litman-Origin"
+# Number of snapshots kept on the server.
+_kept_snapshots = 2
+_snapshot_lock = threading.Lock()
+# Held by a client while it syncs or bootstraps, so a sync of the follow
+# thread never runs along one started by the user.
+_client_lock = threading.Lock()
+# Seconds to long-poll for the result of a sync.
+_sync_wait = 30
+# Seconds to long-poll the change feed, and to wait after it failed.
+_feed_wait = 30
+_feed_retry = 30
+
 
 def _find_missing_files(config, db):
     """Scan all local files and flag missing files."""
@@ -40,61 +67,371 @@ def _find_missing_files(config, db):
     return missing
 
 
+def format_position(position: tuple[int, int]) -> str:
+    return "{},{}".format(*position)
+
+
+def parse_position(value: str) -> tuple[int, int]:
+    log_position, link_position = value.split(",")
+    return int(log_position), int(link_position)
+
+
+def _fetch_file(url: str, headers: dict, target: pathlib.Path) -> dict:
+    """Stream a download into ``target`` and return the response headers."""
+    response = urllib3.request("GET", url, headers=headers, preload_content=False)
+    try:
+        if response.status != 200:
+            raise ValueError(f"Fetching '{url}' failed with status {response.status}.")
+        with target.open("wb") as ofile:
+            for chunk in response.stream(2**16):
+                ofile.write(chunk)
+    finally:
+        response.release_conn()
+    return response.headers
+
+
+def _replay_tail(config: Box, db: DB, position: tuple[int, int]) -> bool:
+    """Apply the server log after ``position``.
+
+    Returns:
+        False if the server cannot replay from the position anymore.
+    """
+    headers = urllib3.make_headers(
+        basic_auth="{}:{}".format(config.client.user, config.client.password),
+    )
+    response = urllib3.request(
+        "GET",
+        f"{config.client.main}/admin/log_tail?position={format_position(position)}",
+        headers=headers,
+        preload_content=False,
+    )
+    try:
+        if response.status == 410:
+            return False
+        if response.status != 200:
+            raise ValueError(f"Fetching the log tail failed: {response.status}.")
+        message = sync_format.decode(response)
+        db.import_transactions(
+            {
+                "changes": message.changes,
+                "position": message.meta["position"],
+                "origin": uuid.UUID(message.meta["origin"]),
+            }
+        )
+    finally:
+        response.release_conn()
+    return True
+
+
 def bootstrap_db(config: Box, db: DB):
-    """This function pulls an existing database and replaces the current one."""
+    """This function pulls an existing database and replaces the current one.
+
+    A client that synced before only replays the server log since then. A
+    new or stale client loads the latest server snapshot and replays the
+    log after it. Only if that fails, the full database is copied.
+    """
     if config.general.mode != "client":
         raise ValueError("Only allowed in client mode.")
+    with _client_lock:
+        _bootstrap_db(config, db)
+
+
+def _bootstrap_db(config: Box, db: DB):
     auth_headers = urllib3.make_headers(
         basic_auth="{}:{}".format(config.client.user, config.client.password),
     )
     main = config.client.main
-    response = urllib3.request("GET", f"{main}/admin/get_dump", headers=auth_headers)
-    tempfile = pathlib.Path(config.files.tmp_storage) / "bootstrap_import.sql"
-    with tempfile.open("wb") as ofile:
-        ofile.write(response.data)
-    db.bootstrap(tempfile)
-    # Load all files that are not present on the client.
-    files = db.cursor.execute("SELECT id, path FROM file").fetchall()
-    for id, file_name in files:
-        file_path = config.files.file_storage_path / file_name
-        if file_path.exists():
-            continue
-        logger.info(f"Fetching file {file_name}.")
-        response = urllib3.request("GET", f"{main}/entry/file/{str(id)}")
-        with file_path.open("wb") as ofile:
-            ofile.write(response.data)
+    tempfile = pathlib.Path(config.files.tmp_storage) / "bootstrap_import.db"
+    position = db.sync_position()
+    if position is not None and _replay_tail(config, db, position):
+        logger.info("Bootstrapped from the log tail.")
+    else:
+        headers = _fetch_file(f"{main}/admin/snapshot", auth_headers, tempfile)
+        position = parse_position(headers[POSITION_HEADER])
+        db.bootstrap(tempfile, position, uuid.UUID(headers[ORIGIN_HEADER]))
+        tempfile.unlink()
+        if _replay_tail(config, db, position):
+            logger.info("Bootstrapped from a snapshot.")
+        else:
+            # The snapshot was outdated by a compaction in the meantime.
+            headers = _fetch_file(f"{main}/admin/get_dump", auth_headers, tempfile)
+            db.bootstrap(
+                tempfile,
+                parse_position(headers[POSITION_HEADER]),
+                uuid.UUID(headers[ORIGIN_HEADER]),
+            )
+            tempfile.unlink()
+            logger.info("Bootstrapped from a full dump.")
+    file_sync.sync_files(config, db)
 
 
 def sync_client(config: Box, db: DB):
-    """Push updates to a remote server."""
+    """Push updates to a remote server.
+
+    The client identifies itself and reports the server position it has,
+    and only sends the changes that did not come from the server.
+    """
+    with _client_lock:
+        _sync_client(config, db)
+
+
+def _sync_client(config: Box, db: DB):
     main = config.client.main
-    export = db.export_transactions()
-    payload = pickle.dumps(export)
-    auth_headers = urllib3.make_headers(
+    last_sync = db.last_sync()
+    server_id = db.sync_peer()
+    codec = sync_format.codec(config.client.get("compression", "gzip"))
+    # Local changes after the position the server acknowledged. Without
+    # one, e.g. right after a bootstrap, everything since the last sync.
+    since = None if server_id is None else db.sync_cursor(server_id)
+    until = db.log_position()
+    body = sync_format.encode(
+        {
+            "client_id": str(db.sync_identity()),
+            "last_sync": last_sync,
+            "position": db.sync_position(),
+        },
+        db.stream_transactions(
+            last_sync if since is None else 0,
+            since=(0, 0) if since is None else since,
+            until=until,
+            exclude_origin=server_id,
+        ),
+        codec=codec,
+    )
+    headers = urllib3.make_headers(
         basic_auth="{}:{}".format(config.client.user, config.client.password),
     )
-    response = urllib3.request(
-        "POST",
-        f"{main}/admin/sync",
-        body=payload,
-        headers=auth_headers,
+    headers["Content-Type"] = sync_format.MIME_TYPE
+    response = urllib3.request("POST", f"{main}/admin/sync", body=body, headers=headers)
+    if response.status != 202:
+        raise ValueError(f"Submitting the sync failed: {response.status}.")
+    job = response.json()["job"]
+    # The server runs the syncs one by one, wait for this one.
+    while True:
+        response = urllib3.request(
+            "GET",
+            f"{main}/admin/sync/{job}?wait={_sync_wait}",
+            headers=headers,
+            preload_content=False,
+        )
+        if response.status != 202:
+            break
+        response.release_conn()
+    try:
+        if response.status == 400:
+            raise ValueError(f"Sync rejected: {response.data.decode()}")
+        if response.status != 200:
+            raise ValueError("Server error.")
+        message = sync_format.decode(response)
+        for conflict in message.meta.get("conflicts", []):
+            logger.warning(
+                f"Sync conflict in {conflict['table']} '{conflict['id']}': "
+                f"{conflict['resolution']}."
+            )
+        server_id = uuid.UUID(message.meta["origin"])
+        db.import_transactions(
+            {
+                "changes": message.changes,
+                "position": message.meta["position"],
+                "origin": server_id,
+            }
+        )
+        db.acknowledge(server_id, until)
+    finally:
+        response.release_conn()
+    # Everything up to here is acknowledged by the server.
+    db.compact_transaction_logs()
+    file_sync.sync_files(config, db)
+    return
+
+
+def sync_server(config: Box, db: DB, stream: BinaryIO) -> Iterator[bytes]:
+    """Import the changes of a client and return the changes it has not seen.
+
+    The client changes are applied while they are read from ``stream``.
+    The response holds the changes after the cursor of the client, except
+    the ones imported from the client itself, and is encoded lazily in the
+    format of the request.
+    """
+    message = sync_format.decode(stream)
+    client_id = uuid.UUID(message.meta["client_id"])
+    since = _client_cursor(db, client_id, message.meta.get("position"))
+    # A client without a known position gets everything since its last sync.
+    last_sync = message.meta["last_sync"] if since is None else 0
+    conflicts = db.import_master(
+        {
+            "changes": message.changes,
+            "origin": client_id,
+            "since": since,
+            "last_sync": last_sync,
+        }
+    )
+    position = db.log_position()
+    if since is None:
+        since = (0, 0)
+    else:
+        db.acknowledge(client_id, since)
+    return sync_format.encode(
+        {
+            "last_sync": message.meta["last_sync"],
+            "position": position,
+            "origin": str(db.sync_identity()),
+            "conflicts": conflicts,
+        },
+        db.stream_transactions(
+            last_sync, since=since, until=position, exclude_origin=client_id
+        ),
+        codec=message.codec,
+        version=message.version,
+    )
+
+
+def _client_cursor(
+    db: DB, client_id: uuid.UUID, reported: list[int] | None
+) -> tuple[int, int] | None:
+    """The position to send the changes after.
+
+    The position the client reports is the one it acknowledged by applying
+    the last response. Otherwise the stored cursor is used. Positions from
+    before a compaction of the logs cannot be used.
+    """
+    horizon = db.log_horizon()
+    current = db.log_position()
+    for cursor in (reported, db.sync_cursor(client_id)):
+        if cursor is None:
+            continue
+        cursor = tuple(cursor)
+        if _usable(cursor, horizon) and _usable(current, cursor):
+            return cursor
+    return None
+
+
+###
+### Change Feed
+###
+
+
+def change_feed(
+    db: DB, position: tuple[int, int], client_id: uuid.UUID | None, timeout: float
+) -> dict:
+    """Wait for changes after ``position`` that did not come from the client.
+
+    Returns:
+        The current position and the number of changed rows per table,
+        which is empty if nothing changed within ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    current = tuple(position)
+    while True:
+        current = db.wait_for_changes(current, max(0, deadline - time.monotonic()))
+        changes = db.change_summary(position, current, exclude_origin=client_id)
+        if changes or time.monotonic() >= deadline:
+            return {"position": current, "changes": changes}
+
+
+def follow_changes(config: Box, db: DB, stop: threading.Event) -> None:
+    """Sync whenever the change feed of the server reports changes.
+
+    Runs until ``stop`` is set, meant for a background thread of a client.
+    A client without credentials does not follow, and one that was not
+    bootstrapped yet waits for the bootstrap.
+    """
+    if config.client.get("user") is None or config.client.get("password") is None:
+        logger.warning("Not following the server, the client has no credentials.")
+        return
+    headers = urllib3.make_headers(
+        basic_auth="{}:{}".format(config.client.user, config.client.password),
     )
-    if response.status == 500:
-        raise ValueError("Server error.")
-    body = response.data
-    data = pickle.loads(body)
-    db.import_transactions(data)
-    db.cursor.execute("INSERT INTO sync_log (date) VALUES (unixepoch())")
-    db.connection.commit()
+    while not stop.is_set():
+        try:
+            position = db.sync_position()
+            if position is None:
+                logger.debug("No server position yet, waiting for a bootstrap.")
+                stop.wait(_feed_retry)
+                continue
+            response = urllib3.request(
+                "GET",
+                f"{config.client.main}/admin/changes"
+                f"?position={format_position(position)}"
+                f"&client={db.sync_identity()}&wait={_feed_wait}",
+                headers=headers,
+                timeout=_feed_wait + 10,
+            )
+            if response.status != 200:
+                raise ValueError(f"Change feed failed: {response.status}.")
+            changes = response.json()["changes"]
+            if changes:
+                logger.info(f"Server changes {changes}, syncing.")
+                sync_client(config, db)
+        except Exception as err:
+            logger.warning(f"Following the server failed: {err}")
+            stop.wait(_feed_retry)
+        finally:
+            db.release()
     return
 
 
-def sync_server(config: Box, db: DB, payload):
-    export = pickle.loads(payload)
-    # Get the local changes before inserting remote changes.
-    last_sync = export["last_sync"]
-    local_export = db.export_transactions(last_sync)
-    # Import remote changes.
-    db.import_transactions(export)
-    response_body = pickle.dumps(local_export)
-    return response_body
+###
+### Snapshots
+###
+
+
+def _snapshot_storage(config: Box) -> pathlib.Path:
+    storage = config.files.get("snapshot_storage")
+    if storage is None:
+        storage = pathlib.Path(config.files.tmp_storage) / "litman_snapshots"
+    storage.mkdir(parents=True, exist_ok=True)
+    return storage
+
+
+def _usable(position: tuple[int, int], horizon: tuple[int, int]) -> bool:
+    return position[0] >= horizon[0] and position[1] >= horizon[1]
+
+
+def latest_snapshot(config: Box, db: DB) -> tuple[pathlib.Path, tuple[int, int]]:
+    """The newest snapshot the logs can be replayed after.
+
+    Snapshots are named by their position. A new one is taken once the
+    newest is older than ``server.snapshot_interval`` seconds or was
+    outdated by a compaction of the logs.
+    """
+    interval = config.get("server", {}).get("snapshot_interval", 86400)
+    storage = _snapshot_storage(config)
+    with _snapshot_lock:
+        horizon = db.log_horizon()
+        snapshots = sorted(
+            storage.glob("snapshot_*.db"),
+            key=lambda f: f.stat().st_mtime,
+            reverse=True,
+        )
+        if snapshots:
+            newest = snapshots[0]
+            position = parse_position(newest.stem.removeprefix("snapshot_"))
+            age = time.time() - newest.stat().st_mtime
+            if age < interval and _usable(position, horizon):
+                return newest, position
+        tmp_file = storage / "snapshot.tmp"
+        position = db.snapshot(tmp_file)
+        snapshot = storage / f"snapshot_{format_position(position)}.db"
+        tmp_file.replace(snapshot)
+        logger.info(f"Created snapshot '{snapshot.name}'.")
+        for old in snapshots[_kept_snapshots - 1 :]:
+            if old != snapshot:
+                old.unlink(missing_ok=True)
+    return snapshot, position
+
+
+def log_tail(db: DB, position: tuple[int, int]) -> Iterator[bytes] | None:
+    """Encode the changes after ``position``.
+
+    Returns:
+        None if the logs were compacted after the position, or the position
+        is unknown.
+    """
+    current = db.log_position()
+    if not _usable(position, db.log_horizon()) or not _usable(current, position):
+        return None
+    return sync_format.encode(
+        {"position": current, "origin": str(db.sync_identity())},
+        db.stream_transactions(0, since=position, until=current),
+    )
@@ -10,12 +10,14 @@ def select_paper(db: DB, query: str) -> Optional[Entry]:
     if len(search.result) == 0:
         print("No results found.")
         return
-    if len(search.result) > 1:
-        for i, result in enumerate(search.result):
-            print(f"{str(i + 1).ljust(2)}: {result.key.ljust(20)} - {result.title}")
-        print(f"1-{len(search.result)} to select a paper")
+    if search.fuzzy:
+        print("No exact matches, did you mean:")
+    if len(search.hits) > 1 or search.fuzzy:
+        for i, hit in enumerate(search.hits):
+            print(f"{str(i + 1).ljust(2)}: {hit.key.ljust(20)} - {hit.title}")
+        print(f"1-{len(search.hits)} to select a paper")
         selection = int(input())
-        paper = search.result[selection - 1]
+        hit = search.hits[selection - 1]
     else:
-        paper = search.result[0]
-    return paper
+        hit = search.hits[0]
+    return Entry.load_id(db, hit.id)
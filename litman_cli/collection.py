@@ -14,8 +14,8 @@ def new(name: str, description: Optional[str] = None):
     config, db = get_globals()
     collection = Collection(None, name, description)
     try:
-        collection.save(db)
-        db.connection.commit()
+        with db.transaction():
+            collection.save(db)
     except Exception as err:
         print(f"Failed to create collection '{name}'")
         print(err)
@@ -35,8 +35,8 @@ def attach_entry(collection: str, key: str):
         print(f"Entry '{key}' not found")
         raise typer.Abort()
     try:
-        collection.attach_paper(db, entry)
-        db.connection.commit()
+        with db.transaction():
+            collection.attach_paper(db, entry)
     except Exception as err:
         print(f"Failed to attach '{key}' to '{collection}'")
         raise err
@@ -71,9 +71,9 @@ def new(file: Optional[pathlib.Path] = None):
     if file is not None:
         try:
             f = File(None, file, "Main", True)
-            f.save(config, db)
-            entry.attach_file(db, f)
-            db.connection.commit()
+            with db.transaction():
+                f.save(config, db)
+                entry.attach_file(db, f)
         except Exception as err:
             print(f"Failed to attach file '{file}' to entry '{entry.key}'.")
             print(err)
@@ -97,9 +97,9 @@ def attach(
         return 1
     try:
         file = File(None, file_path, type, default_open)
-        file.save(config, db)
-        entry.attach_file(db, file)
-        db.connection.commit()
+        with db.transaction():
+            file.save(config, db)
+            entry.attach_file(db, file)
     except Exception as err:
         print(f"Failed to attach file '{file_path}' to entry '{key}'.")
         print(err)
@@ -136,8 +136,8 @@ def edit(key: str):
         print("Entry type cannot changed.")
         return 1
     try:
-        parsed.save(db)
-        db.connection.commit()
+        with db.transaction():
+            parsed.save(db)
     except Exception as err:
         print("Failed to update entry.")
         raise err
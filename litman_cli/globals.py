@@ -1,9 +1,25 @@
 from box import Box
 
+from litman.autocomplete import Autocomplete
 from litman.db_connector import DB
+from litman.related import RelatedEntries
+from litman.sync_queue import SyncQueue
 
 STATE = {}
 
 
 def get_globals() -> tuple[Box, DB]:
     return STATE["config"], STATE["db"]
+
+
+def get_sync_queue() -> SyncQueue:
+    return STATE["sync_queue"]
+
+
+def get_autocomplete() -> Autocomplete:
+    return STATE["autocomplete"]
+
+
+def get_related() -> RelatedEntries | None:
+    """The related entries, or None if their dependencies are missing."""
+    return STATE.get("related")
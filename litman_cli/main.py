@@ -34,7 +34,11 @@ def setup(
     db_file = config.files.database_file
     if clean:
         db_file.unlink(missing_ok=True)
-    db = DB(db_file=db_file)
+    db = DB(
+        db_file=db_file,
+        slow_query_ms=config.get("database", {}).get("slow_query_ms", None),
+        slow_query_log=config.files.get("slow_query_log", None),
+    )
     globals.STATE["db"] = db
     # Set the base path
     if base_path is not None:
@@ -1,10 +1,15 @@
 from os import environ
 import pathlib
+import threading
 from typing import Optional
 
 from box import Box
 
+from litman.autocomplete import Autocomplete
 from litman.db_connector import DB
+from litman import fuzzy, related, sync_format
+from litman.sync_queue import SyncQueue
+from litman.synchronization import follow_changes
 from litman_cli import globals
 from litman_web.app import app as app
 from litman_web import routes, _logging  # noqa: F401
@@ -22,6 +27,10 @@ print(config.files.database_file, config.files.file_storage_path)
 if "LITMAN_MODE" in environ:
     print("Overwriting litman mode")
     config.general.mode = environ["LITMAN_MODE"]
+if config.general.get("mode") == "client":
+    # Reject a compression that can not be used at startup, not at the
+    # first sync.
+    sync_format.codec(config.client.get("compression", "gzip"))
 for key, value in config.files.items():
     config.files[key] = pathlib.Path(value).expanduser().absolute()
 # Set up the file path.
@@ -35,8 +44,36 @@ config.files.file_storage_path.mkdir(exist_ok=True)
 db_file = config.files.database_file
 if clean:
     db_file.unlink(missing_ok=True)
-db = DB(db_file=db_file)
+db = DB(
+    db_file=db_file,
+    slow_query_ms=config.get("database", {}).get("slow_query_ms", None),
+    slow_query_log=config.files.get("slow_query_log", None),
+)
 globals.STATE["db"] = db
+globals.STATE["sync_queue"] = SyncQueue(
+    config, db, max_pending=config.get("server", {}).get("sync_queue_size", 16)
+)
+globals.STATE["autocomplete"] = Autocomplete(db)
+globals.STATE["autocomplete"].start()
+fuzzy.index.follow(db)
+if related.available():
+    related_path = config.files.get(
+        "related_index", db_file.with_name(f"{db_file.stem}_related")
+    )
+    globals.STATE["related"] = related.RelatedEntries(db, related_path)
+    globals.STATE["related"].follow()
+else:
+    _logging.logger.warning(
+        "Related entries are disabled, as 'numpy' or 'scipy' is not installed."
+    )
+# Clients can follow the changes of the server in the background.
+if config.general.get("mode") == "client" and config.client.get("follow", False):
+    threading.Thread(
+        target=follow_changes,
+        args=(config, db, threading.Event()),
+        name="litman-follow",
+        daemon=True,
+    ).start()
 # Set the base path
 if base_path is not None:
     globals.STATE["base_path"] = base_path.expanduser().absolute()
@@ -2,6 +2,8 @@ from cachelib import SimpleCache
 from flask import Flask, render_template
 from flask_session import Session
 
+from litman_cli.globals import get_globals
+
 app = Flask(__name__)
 
 SESSION_TYPE = "cachelib"
@@ -11,6 +13,36 @@ app.config.from_object(__name__)
 Session(app)
 
 
+@app.before_request
+def start_query_stats():
+    config, db = get_globals()
+    db.stats.start_request()
+
+
+@app.after_request
+def add_query_stats(response):
+    """Report the statements of the request in the Server-Timing header."""
+    config, db = get_globals()
+    db.flush_stats()
+    request_stats = db.stats.finish_request()
+    if request_stats is not None:
+        response.headers["Server-Timing"] = (
+            f"db;dur={request_stats.total * 1000:.1f};"
+            f'desc="{request_stats.count} queries"'
+        )
+    return response
+
+
+@app.teardown_request
+def release_connection(exc):
+    """Return the request's connection to the pool.
+
+    Changes a route did not commit are rolled back here.
+    """
+    config, db = get_globals()
+    db.release()
+
+
 @app.route("/")
 def index():
     return render_template("base.html")
@@ -0,0 +1,113 @@
+"""Keyset pagination for the listing routes.
+
+A page starts after the sort key of the last row of the previous page
+instead of at an offset. The query seeks past that key in an index and
+reads a single page of rows, however deep into the list the page is.
+Sort keys end with the rowid, which makes them unique and is part of
+every index.
+
+The sort key of the last row is handed to the client as an opaque
+``after`` cursor. Requests with a cursor render only the rows, which the
+"load more" element of the previous page swaps in for itself.
+"""
+
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from flask import abort, render_template, request, url_for
+
+from litman.db_connector import DB
+
+PAGE_SIZE = 50
+
+
+@dataclass
+class Page:
+    rows: list[tuple]
+    # The cursor of the next page, if there is one.
+    after: str | None
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as err:
+        raise ValueError(f"Malformed page cursor '{cursor}'.") from err
+    if not isinstance(values, list):
+        raise ValueError(f"Malformed page cursor '{cursor}'.")
+    return values
+
+
+def paginate(
+    db: DB,
+    columns: Sequence[str],
+    source: str,
+    sort: Sequence[str],
+    where: Sequence[str] = (),
+    args: Sequence[Any] = (),
+    after: str | None = None,
+    size: int = PAGE_SIZE,
+) -> Page:
+    """Read one page of ``SELECT columns FROM source WHERE where ORDER BY sort``.
+
+    ``sort`` are the expressions of the sort key and have to end with a
+    unique one. The seek is an index probe if they match an index.
+
+    Raises:
+        ValueError: If ``after`` is not a cursor of this sort key.
+    """
+    conditions = list(where)
+    params = list(args)
+    if after is not None:
+        values = decode_cursor(after)
+        if len(values) != len(sort):
+            raise ValueError(f"Page cursor '{after}' does not match the sort key.")
+        conditions.append(
+            "({}) > ({})".format(", ".join(sort), ", ".join("?" for _ in sort))
+        )
+        params.extend(values)
+    q = "SELECT {}, {} FROM {}".format(", ".join(columns), ", ".join(sort), source)
+    if conditions:
+        q += " WHERE " + " AND ".join(conditions)
+    q += " ORDER BY {} LIMIT ?".format(", ".join(sort))
+    rows = db.cursor.execute(q, (*params, size + 1)).fetchall()
+    next_after = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_after = encode_cursor(rows[-1][len(columns) :])
+    return Page([tuple(row[: len(columns)]) for row in rows], next_after)
+
+
+def paginate_request(db: DB, *args, **kwargs) -> Page:
+    """``paginate`` with the cursor of the current request."""
+    try:
+        return paginate(db, *args, after=request.args.get("after"), **kwargs)
+    except ValueError as err:
+        abort(400, str(err))
+
+
+def next_url(page: Page) -> str | None:
+    """The URL of the page after ``page`` for the current request."""
+    if page.after is None:
+        return None
+    args = request.args.to_dict(flat=False)
+    args["after"] = page.after
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+def render_page(template: str, page: Page, **kwargs) -> str:
+    """Render a page of a list, or only its rows if it is not the first."""
+    return render_template(
+        template,
+        next_page=next_url(page),
+        fragment="after" in request.args,
+        **kwargs,
+    )
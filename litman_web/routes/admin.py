@@ -1,14 +1,33 @@
+import json
+import os
 import pathlib
 import logging
+import tempfile
+import uuid
 
-from flask import render_template, send_file, request, Response
+from flask import render_template, send_file, request, Response, stream_with_context
 
-from litman.synchronization import bootstrap_db, sync_client, sync_server
-from litman_cli.globals import get_globals
+from litman import file_sync, sync_format
+from litman.sync_queue import QueueFull
+from litman.synchronization import (
+    ORIGIN_HEADER,
+    POSITION_HEADER,
+    bootstrap_db,
+    change_feed,
+    format_position,
+    latest_snapshot,
+    log_tail,
+    parse_position,
+    sync_client,
+)
+from litman_cli.globals import get_globals, get_sync_queue
 from litman_web.app import app
 
 logger = logging.getLogger(__name__)
 
+# Longest wait of a long-poll for a sync, in seconds.
+_max_wait = 60
+
 
 @app.route("/admin")
 def admin():
@@ -18,12 +37,70 @@ def admin():
         return render_template("base.html", template="admin/admin.html")
 
 
+@app.route("/admin/queries")
+def query_stats():
+    config, db = get_globals()
+    return render_template("admin/queries.html", statements=db.stats.statements())
+
+
+@app.route("/admin/queries/reset", methods=["POST"])
+def reset_query_stats():
+    config, db = get_globals()
+    db.stats.reset()
+    return render_template("admin/queries.html", statements=[])
+
+
 @app.route("/admin/get_dump")
 def get_dump():
     config, db = get_globals()
-    out_file = pathlib.Path(config.files.tmp_storage / "litman_dump.sql")
+    fd, out_file = tempfile.mkstemp(dir=config.files.tmp_storage, suffix=".db")
+    os.close(fd)
+    out_file = pathlib.Path(out_file)
+    # Taken before the dump, so replaying the tail after it misses nothing.
+    position = db.log_position()
     db.dump(out_file)
-    return send_file(out_file)
+    # Every dump has its own file, and unlinking the open file cleans up
+    # once the response has been streamed.
+    dump = out_file.open("rb")
+    out_file.unlink()
+    response = send_file(
+        dump,
+        mimetype="application/vnd.sqlite3",
+        download_name="litman_dump.db",
+    )
+    response.headers[POSITION_HEADER] = format_position(position)
+    response.headers[ORIGIN_HEADER] = str(db.sync_identity())
+    return response
+
+
+@app.route("/admin/snapshot")
+def get_snapshot():
+    config, db = get_globals()
+    snapshot, position = latest_snapshot(config, db)
+    # Open before sending, a newer snapshot may replace this one.
+    response = send_file(
+        snapshot.open("rb"),
+        mimetype="application/vnd.sqlite3",
+        download_name="litman_snapshot.db",
+    )
+    response.headers[POSITION_HEADER] = format_position(position)
+    response.headers[ORIGIN_HEADER] = str(db.sync_identity())
+    return response
+
+
+@app.route("/admin/log_tail")
+def get_log_tail():
+    config, db = get_globals()
+    try:
+        position = parse_position(request.args["position"])
+    except (KeyError, ValueError):
+        return Response("Expected a position 'log,link'.", status=400)
+    tail = log_tail(db, position)
+    if tail is None:
+        return Response("The log was compacted after this position.", status=410)
+    return Response(
+        stream_with_context(tail), status=200, mimetype=sync_format.MIME_TYPE
+    )
 
 
 @app.route("/admin/bootstrap")
@@ -41,12 +118,90 @@ def push_changes():
 
 
 @app.route("/admin/sync", methods=["POST"])
+def post_sync():
+    try:
+        job = get_sync_queue().submit(request.stream)
+    except QueueFull as err:
+        return Response(str(err), status=503, headers={"Retry-After": "10"})
+    return Response(
+        json.dumps({"job": str(job.id), "status": job.status}),
+        status=202,
+        mimetype="application/json",
+        headers={"Location": f"/admin/sync/{job.id}"},
+    )
+
+
+@app.route("/admin/sync/<uuid:job_id>")
+def get_sync(job_id: uuid.UUID):
+    """Poll for the result of a sync, waiting up to ``wait`` seconds."""
+    sync_queue = get_sync_queue()
+    wait = min(request.args.get("wait", 0, type=float), _max_wait)
+    job = sync_queue.wait(job_id, wait)
+    if job is None:
+        return Response(f"No sync job '{job_id}'.", status=404)
+    if not job.done.is_set():
+        return Response(
+            json.dumps({"job": str(job.id), "status": job.status}),
+            status=202,
+            mimetype="application/json",
+        )
+    if job.error is not None:
+        sync_queue.discard(job)
+        if isinstance(job.error, sync_format.UnsupportedVersion):
+            versions = ", ".join(str(v) for v in sync_format.SUPPORTED_VERSIONS)
+            return Response(
+                str(job.error), status=400, headers={"X-Litman-Sync-Versions": versions}
+            )
+        return Response(status=500)
+    # Discarding the job unlinks the result, the open file remains readable.
+    result = job.result_file.open("rb")
+    sync_queue.discard(job)
+    return send_file(result, mimetype=sync_format.MIME_TYPE)
+
+
+@app.route("/admin/changes")
 def get_changes():
+    """Long-poll for changes after ``position``, for up to ``wait`` seconds.
+
+    Changes imported from the ``client`` are not reported to it.
+    """
     config, db = get_globals()
-    body = request.get_data()
     try:
-        response_body = sync_server(config, db, body)
-    except Exception as err:
-        logger.exception(err)
-        return Response(status=500)
-    return Response(response_body, status=200)
+        position = parse_position(request.args["position"])
+        client_id = request.args.get("client", None, type=uuid.UUID)
+    except (KeyError, ValueError):
+        return Response("Expected a position 'log,link'.", status=400)
+    wait = min(request.args.get("wait", 0, type=float), _max_wait)
+    feed = change_feed(db, position, client_id, wait)
+    return Response(json.dumps(feed), status=200, mimetype="application/json")
+
+
+@app.route("/admin/files/manifest")
+def file_manifest():
+    config, db = get_globals()
+    manifest = file_sync.file_manifest(config, db)
+    return Response(
+        file_sync.encode_manifest(manifest), mimetype="application/octet-stream"
+    )
+
+
+@app.route("/admin/files/<uuid:file_id>", methods=["GET"])
+def get_stored_file(file_id: uuid.UUID):
+    config, db = get_globals()
+    row = db.cursor.execute("SELECT path FROM file WHERE id = ?", (file_id,))
+    row = row.fetchone()
+    if row is None:
+        return Response(f"No file with id '{file_id}'.", status=404)
+    # Conditional responses answer Range requests, which resume downloads.
+    return send_file(config.files.file_storage_path / row[0], conditional=True)
+
+
+@app.route("/admin/files/<uuid:file_id>", methods=["PUT"])
+def put_stored_file(file_id: uuid.UUID):
+    config, db = get_globals()
+    try:
+        sha256 = bytes.fromhex(request.headers["X-Litman-Sha256"])
+        file_sync.store_upload(config, db, file_id, request.stream, sha256)
+    except (KeyError, ValueError) as err:
+        return Response(str(err), status=400)
+    return Response(status=200)
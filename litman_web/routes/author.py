@@ -3,38 +3,49 @@ from flask import render_template, request
 
 from litman_cli.globals import get_globals
 from litman_web.app import app
+from litman_web.pagination import next_url, paginate_request, render_page
 
 from litman.author import Author
+from litman.search import cache as search_cache
 
 
 @app.route("/author")
 def list_authors():
     config, db = get_globals()
     query = request.args.get("query", "")
-    if query != "":
-        authors = db.cursor.execute(
-            f"SELECT {", ".join(Author.names)} FROM author WHERE last_name LIKE ?",
-            (f"%{query}%",),
-        ).fetchall()
-    else:
-        authors = db.cursor.execute(
-            f"SELECT {", ".join(Author.names)} FROM author"
-        ).fetchall()
-    authors = [Author(*a) for a in authors]
-    authors = sorted(authors, key=lambda a: a.last_name)
-    return render_template("author/list.html", authors=authors)
+    where, args = (["last_name LIKE ?"], [f"%{query}%"]) if query else ([], [])
+    page = search_cache.fetch(
+        db,
+        ("author_page", query, request.args.get("after")),
+        ("author",),
+        lambda: paginate_request(
+            db,
+            Author.names,
+            "author",
+            ("last_name", "ifnull(first_name, '')", "rowid"),
+            where,
+            args,
+        ),
+    )
+    authors = [Author(*a) for a in page.rows]
+    return render_page("author/list.html", page, authors=authors)
 
 
 @app.route("/author/<uuid:author_id>")
 def show_author(author_id: uuid.UUID):
     config, db = get_globals()
     author = Author.load_id(db, author_id)
-    entries = db.cursor.execute(
-        "SELECT id, key, title FROM entry WHERE id IN "
-        "(SELECT entry_id FROM author_link WHERE author_id = ?)",
-        (author_id,),
+    page = paginate_request(
+        db,
+        ("id", "key", "title"),
+        "entry",
+        ("key", "rowid"),
+        ["id IN (SELECT entry_id FROM author_link WHERE author_id = ?)"],
+        [author_id],
     )
-    kwargs = {"author": author, "entries": entries}
+    if "after" in request.args:
+        return render_page("entry/title_list.html", page, entries=page.rows)
+    kwargs = {"author": author, "entries": page.rows, "next_page": next_url(page)}
     if request.headers.get("HX-Request"):
         return render_template("author/author.html", **kwargs)
     else:
@@ -9,6 +9,7 @@ from litman.collection import Collection
 from litman.entries.entry import Entry
 from litman_cli.globals import get_globals
 from litman_web.app import app
+from litman_web.pagination import paginate_request, render_page
 
 
 @app.route("/collection")
@@ -19,15 +20,13 @@ def list_collections():
     """
     config, db = get_globals()
     query = request.args.get("query", "")
+    where, args = [], []
     if query != "":
-        collections = db.cursor.execute(
-            "SELECT id, name FROM collection WHERE name LIKE ?", (f"%{query}%",)
-        )
-    else:
-        collections = db.cursor.execute(
-            "SELECT id, name FROM collection ORDER BY id"
-        ).fetchall()
-    return render_template("collection/name_list.html", collections=collections)
+        where, args = ["name LIKE ?"], [f"%{query}%"]
+    page = paginate_request(
+        db, ("id", "name"), "collection", ("name", "rowid"), where, args
+    )
+    return render_page("collection/name_list.html", page, collections=page.rows)
 
 
 @app.route("/collection/<uuid:id>")
@@ -48,14 +47,15 @@ def show_collection(id: uuid.UUID):
 @app.route("/collection/entries/<uuid:id>")
 def list_attached_entries(id: uuid.UUID):
     config, db = get_globals()
-    entries = db.cursor.execute(
-        """
-        SELECT id, key, title FROM entry WHERE id IN (
-            SELECT entry_id FROM collection_link WHERE collection_id = ?
-        )""",
-        (id,),
-    ).fetchall()
-    return render_template("entry/title_list.html", entries=entries)
+    page = paginate_request(
+        db,
+        ("id", "key", "title"),
+        "entry",
+        ("key", "rowid"),
+        ["id IN (SELECT entry_id FROM collection_link WHERE collection_id = ?)"],
+        [id],
+    )
+    return render_page("entry/title_list.html", page, entries=page.rows)
 
 
 @app.route("/collection/create", methods=["GET", "POST"])
@@ -66,8 +66,8 @@ def create_collection():
     config, db = get_globals()
     form = request.form
     collection = Collection(None, form["name"], form["description"])
-    collection.save(db)
-    db.connection.commit()
+    with db.transaction():
+        collection.save(db)
     return Response(
         headers={
             "HX-Redirect": f"/collection/{collection.id}",
@@ -80,8 +80,8 @@ def create_collection():
 def delete_collection(id: uuid.UUID):
     config, db = get_globals()
     collection = Collection.load_id(db, id)
-    collection.delete(db)
-    db.connection.commit()
+    with db.transaction():
+        collection.delete(db)
     msg = {
         "toastMessage": {
             "header": "Collection Deleted",
@@ -111,7 +111,8 @@ def attach_paper(id: uuid.UUID):
             }
         }
         return Response(status=204, headers={"HX-Trigger": json.dumps(msg)})
-    status = collection.attach_paper(db, entry)
+    with db.transaction():
+        status = collection.attach_paper(db, entry)
     if status == -1:
         msg = {
             "toastMessage": {
@@ -121,7 +122,6 @@ def attach_paper(id: uuid.UUID):
             }
         }
         return Response(status=204, headers={"HX-Trigger": json.dumps(msg)})
-    db.connection.commit()
     msg = {
         "toastMessage": {
             "header": "Attached Entry",
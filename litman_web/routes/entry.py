@@ -8,8 +8,10 @@ from litman.entries.entry import Entry
 from litman.entries import bibtex_mapping
 from litman.author import Author
 from litman.enums import FileType, EntryTypes
-from litman_cli.globals import get_globals
+from litman.search import substring_filter
+from litman_cli.globals import get_globals, get_related
 from litman_web.app import app
+from litman_web.pagination import paginate_request, render_page
 
 TYPE_INCLUDES = {
     EntryTypes.Article: "/entry/type/article.html",
@@ -34,14 +36,13 @@ def list_entries():
         q.append(f"type IN ({', '.join('?' for _ in types)})")
         args.extend(types)
     if len(query):
-        q.append("key LIKE ?")
-        args.append(f"%{query}%")
-    if len(q) > 0:
-        q = "SELECT id, key, title FROM entry WHERE " + " AND ".join(q)
-        entries = db.cursor.execute(q, args).fetchall()
-    else:
-        entries = db.cursor.execute("SELECT id, key, title FROM entry").fetchall()
-    return render_template("entry/key_list.html", entries=entries)
+        condition, condition_args = substring_filter(query)
+        q.append(condition)
+        args.extend(condition_args)
+    page = paginate_request(
+        db, ("id", "key", "title"), "entry", ("key", "rowid"), q, args
+    )
+    return render_page("entry/key_list.html", page, entries=page.rows)
 
 
 @app.route("/entry/<uuid:id>")
@@ -64,6 +65,7 @@ def view_entry(id: uuid.UUID):
         "file_types": file_types,
         "keywords": entry.keywords(db),
         "show_keywords": True,
+        "show_related": get_related() is not None,
     }
     if request.headers.get("HX-Request"):
         return render_template("entry/entry.html", **entry_kwargs)
@@ -71,6 +73,25 @@ def view_entry(id: uuid.UUID):
         return render_template("base.html", template="entry/entry.html", **entry_kwargs)
 
 
+@app.route("/entry/<uuid:id>/related")
+def view_entry_related(id: uuid.UUID):
+    related = get_related()
+    if related is None:
+        return ""
+    config, db = get_globals()
+    scores = dict(related.related([id], k=10).get(id, []))
+    if not scores:
+        return ""
+    rows = db.cursor.execute(
+        "SELECT id, key, title FROM entry WHERE id IN ({})".format(
+            ", ".join("?" for _ in scores)
+        ),
+        list(scores),
+    ).fetchall()
+    entries = sorted(rows, key=lambda row: -scores[row[0]])
+    return render_template("entry/related.html", entries=entries)
+
+
 @app.route("/entry/<uuid:id>/short")
 def view_entry_short(id: uuid.UUID):
     config, db = get_globals()
@@ -117,19 +138,19 @@ def edit_entry(id: uuid.UUID):
     try:
         new_entry = Entry.parse_bibtex(bib_entry)
         entry.update_entry(new_entry)
-        # Check if the authors changed.
-        old_authors = entry.authors(db)
-        new_authors = Author.parse_authors(bib_entry["author"], db)
-        removed_authors = [a for a in old_authors if a not in new_authors]
-        added_authors = [a for a in new_authors if a not in old_authors]
-        for author in removed_authors:
-            entry.detach_author(db, author)
-            author.delete(db)
-        for author in added_authors:
-            author.save(db)
-            entry.attach_author(db, author)
-        entry.save(db)
-        db.connection.commit()
+        with db.transaction():
+            # Check if the authors changed.
+            old_authors = entry.authors(db)
+            new_authors = Author.parse_authors(bib_entry["author"], db)
+            removed_authors = [a for a in old_authors if a not in new_authors]
+            added_authors = [a for a in new_authors if a not in old_authors]
+            for author in removed_authors:
+                entry.detach_author(db, author)
+                author.delete(db)
+            for author in added_authors:
+                author.save(db)
+                entry.attach_author(db, author)
+            entry.save(db)
     except Exception as err:
         msg = {
             "toastMessage": {
@@ -230,13 +251,11 @@ def create_entry_crossref():
         )
     # Try the import.
     try:
-        entry = sources.load_doi(db, key, doi)
+        with db.transaction():
+            entry = sources.load_doi(db, key, doi)
         if entry is None:
             msg = "Unspecified error."
-        else:
-            db.connection.commit()
     except Exception as err:
-        db.connection.rollback()
         msg = str(err)
         trigger_data = {
             "toastMessage": {
@@ -256,8 +275,8 @@ def load_doi():
     if doi == "":
         return "DOI Empty"
     try:
-        entry = sources.load_doi(config, db, doi)
-        db.connection.commit()
+        with db.transaction():
+            entry = sources.load_doi(config, db, doi)
     except Exception as err:
         msg = {
             "HX-Trigger": {
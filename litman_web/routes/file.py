@@ -37,13 +37,12 @@ def attach_file(entry_id: uuid.UUID):
         default_file = len(entry.files(db)) == 0
         file_path = config.files.file_storage_path / file_obj.filename
         file = File(None, file_path, int(request.form["type"]), default_file)
-        file.save(config, db)
-        entry.attach_file(db, file)
-        file_obj.save(file_path)
-        db.connection.commit()
+        with db.transaction():
+            file.save(config, db)
+            entry.attach_file(db, file)
+            file_obj.save(file_path)
         return Response(headers={"HX-Refresh": "true"})
     except Exception as err:
-        db.connection.rollback()
         message = {
             "toastMessage": {
                 "header": "File Upload Failed",
@@ -70,7 +69,8 @@ def delete_file(entry_id: uuid.UUID, file_id: uuid.UUID):
     config, db = get_globals()
     try:
         file = File.load(db, file_id)
-        file.delete(config, db)
+        with db.transaction():
+            file.delete(config, db)
     except Exception:
         return "Deleting File did not work."
     try:
@@ -86,10 +86,11 @@ def make_default(entry_id: uuid.UUID, file_id: uuid.UUID):
     config, db = get_globals()
     entry = Entry.load_id(db, entry_id)
     old_default = entry.default_file(db)
-    db.cursor.execute(
-        "UPDATE file SET default_open = 0 WHERE id = ?", (old_default.id,)
-    )
-    db.cursor.execute("UPDATE file SET default_open = 1 WHERE id = ?", (file_id,))
+    with db.transaction() as transaction:
+        transaction.execute(
+            "UPDATE file SET default_open = 0 WHERE id = ?", (old_default.id,)
+        )
+        transaction.execute("UPDATE file SET default_open = 1 WHERE id = ?", (file_id,))
     try:
         entry = Entry.load_id(db, entry_id)
         files = entry.files(db)
@@ -5,8 +5,10 @@ from flask import render_template, request, Response
 
 from litman.entries.entry import Entry
 from litman.keywords import Keyword
+from litman.search import cache as search_cache
 from litman_cli.globals import get_globals
 from litman_web.app import app
+from litman_web.pagination import next_url, paginate_request, render_page
 
 
 @app.route("/keyword", methods=["GET"])
@@ -17,20 +19,34 @@ def list_keywords():
     """
     config, db = get_globals()
     query = request.args.get("query", "")
-    keywords = Keyword.search_keywords(db, query)
-    return render_template("keyword/list.html", keywords=keywords)
+    where, args = (["name LIKE ?"], [f"%{query}%"]) if query else ([], [])
+    page = search_cache.fetch(
+        db,
+        ("keyword_page", query, request.args.get("after")),
+        ("keyword",),
+        lambda: paginate_request(
+            db, ("id", "name"), "keyword", ("name", "rowid"), where, args
+        ),
+    )
+    keywords = [Keyword(*row) for row in page.rows]
+    return render_page("keyword/list.html", page, keywords=keywords)
 
 
 @app.route("/keyword/<uuid:keyword_id>", methods=["GET"])
 def show_keyword(keyword_id: uuid.UUID):
     config, db = get_globals()
     keyword = Keyword.load_id(db, keyword_id)
-    q = (
-        "SELECT id, key, title FROM entry WHERE id IN "
-        + "(SELECT entry_id FROM keyword_link WHERE keyword_id = ?)"
+    page = paginate_request(
+        db,
+        ("id", "key", "title"),
+        "entry",
+        ("key", "rowid"),
+        ["id IN (SELECT entry_id FROM keyword_link WHERE keyword_id = ?)"],
+        [keyword_id],
     )
-    entries = db.cursor.execute(q, (keyword_id,)).fetchall()
-    kwargs = {"keyword": keyword, "entries": entries}
+    if "after" in request.args:
+        return render_page("entry/title_list.html", page, entries=page.rows)
+    kwargs = {"keyword": keyword, "entries": page.rows, "next_page": next_url(page)}
     if request.headers.get("HX-Request"):
         return render_template("keyword/keyword.html", **kwargs)
     else:
@@ -43,16 +59,18 @@ def add_keyword(entry_id: uuid.UUID):
     config, db = get_globals()
     # Load the entry
     entry = Entry.load_id(db, entry_id, barebones=True)
-    keyword = Keyword.from_name(db, keyword)
-    if keyword in entry.keywords(db):
+    with db.transaction():
+        keyword = Keyword.from_name(db, keyword)
+        assigned = keyword in entry.keywords(db)
+        if not assigned:
+            entry.add_keyword(db, keyword)
+    if assigned:
         msg = {
             "header": "Adding Keyword Failed",
             "body": "Keyword already assigned to entry.",
             "style": "bg-danger",
         }
     else:
-        entry.add_keyword(db, keyword)
-        db.connection.commit()
         msg = {
             "header": "Success",
             "body": f"Assigned '{keyword.name}' to entry.",
@@ -76,7 +94,8 @@ def delete_keyword(entry_id: uuid.UUID, keyword_id: uuid.UUID):
     entry = Entry.load_id(db, entry_id, barebones=True)
     if keyword_id not in entry.keywords(db):
         return f"Keyword id '{keyword_id}' not found for '{entry.key}'."
-    entry.remove_keyword(db, keyword_id)
+    with db.transaction():
+        entry.remove_keyword(db, keyword_id)
     return render_template(
         "keyword/keyword_elem.html",
         entry=entry,
@@ -5,52 +5,94 @@ from flask import (
     render_template,
     request,
     session,
+    url_for,
 )
 
+from litman.enums import EntryTypes
 from litman.keywords import Keyword
 from litman.search import AdvancedSearch, Search
-from litman_cli.globals import get_globals
+from litman_cli.globals import get_autocomplete, get_globals
+from litman_web._utils import err_msg, parse_int
 from litman_web.app import app
 from litman_web.template_renderers import entry_renderers
 
 
-@app.route("/entry/search", methods=["POST"])
+@app.route("/entry/search", methods=["GET", "POST"])
 def search():
-    query = request.form.get("search", "")
+    """Search from the search bar. Further pages are loaded with a GET."""
+    query = request.values.get("search", "")
     if len(query) == 0:
         return "No Query provided"
     config, db = get_globals()
-    search = Search(db, query)
-    return entry_renderers.title_list(db, search.result)
+    offset = request.values.get("offset", 0, type=int)
+    search = Search(db, query, offset=offset)
+    next_page = None
+    if len(search.hits) == search.limit:
+        next_page = url_for("search", search=query, offset=offset + search.limit)
+    return entry_renderers.search_results(
+        search.hits,
+        allow_redirect=offset == 0,
+        next_page=next_page,
+        fragment=offset > 0,
+    )
+
+
+_choices = {"": None, "yes": True, "no": False}
 
 
 @app.route("/search/advanced", methods=["GET"])
 def search_advanced_get():
     session["search_keywords"] = []
-    return render_template("search/advanced_search.html", selected_keywords=[])
+    config, db = get_globals()
+    collections = db.cursor.execute(
+        "SELECT id, name FROM collection ORDER BY name"
+    ).fetchall()
+    return render_template(
+        "search/advanced_search.html",
+        selected_keywords=[],
+        entry_types=list(EntryTypes),
+        collections=collections,
+        keyword_modes=AdvancedSearch.keyword_modes,
+    )
+
+
+def _optional_int(name: str) -> int | None:
+    value = request.form.get(name, "").strip()
+    return None if value == "" else parse_int(value, name)
 
 
 @app.route("/search/advanced", methods=["POST"])
 def search_advanced_post():
-    print(request.form)
-    search = AdvancedSearch(
-        title=request.form.get("title", None),
-        author=request.form.get("author", None),
-        keywords=session.get("search_keywords", []),
-    )
+    form = request.form
+    try:
+        search = AdvancedSearch(
+            title=form.get("title", None),
+            author=form.get("author", None),
+            keywords=session.get("search_keywords", []),
+            keyword_mode=form.get("keyword_mode", "any"),
+            year_from=_optional_int("year_from"),
+            year_to=_optional_int("year_to"),
+            entry_types=[EntryTypes(int(t)) for t in form.getlist("entry_type")],
+            collections=[uuid.UUID(c) for c in form.getlist("collection")],
+            has_file=_choices[form.get("has_file", "")],
+            has_doi=_choices[form.get("has_doi", "")],
+        )
+    except (KeyError, ValueError) as err:
+        return err_msg(f"Invalid search: {err}")
     if not search.is_valid:
         return Response(status=204)
     config, db = get_globals()
     results = search.search(db)
-    print(len(results))
-    return render_template("entry/title_list.html", entries=results)
+    facets = render_template("search/facets.html", facets=search.facets)
+    return facets + render_template("entry/title_list.html", entries=results)
 
 
 @app.route("/search/advanced/keywords", methods=["POST"])
 def search_add_keyword_post():
     config, db = get_globals()
     keyword = request.form["keywords"]
-    keyword = Keyword.from_name(db, keyword)
+    with db.transaction():
+        keyword = Keyword.from_name(db, keyword)
     session["search_keywords"] = session.get("search_keywords", []) + [keyword]
     return render_template(
         "search/keyword_group.html",
@@ -76,6 +118,5 @@ def search_list_keywords():
     search = request.args.get("keywords", "")
     if search == "":
         return ""
-    config, db = get_globals()
-    keywords = Keyword.search_keywords(db, search)
+    keywords = get_autocomplete().complete("keyword", search)
     return render_template("search/search_keyword_list.html", keywords=keywords)
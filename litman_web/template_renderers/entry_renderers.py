@@ -1,8 +1,10 @@
 import uuid
 
 from flask import render_template, redirect
+from markupsafe import Markup, escape
 
 from litman.db_connector import DB
+from litman.search import Search, SearchHit
 
 
 def title_list(db: DB, entry_ids: list[uuid.UUID], allow_redirect: bool = True) -> str:
@@ -21,3 +23,31 @@ def title_list(db: DB, entry_ids: list[uuid.UUID], allow_redirect: bool = True)
     ]
     print(data)
     return render_template("entry/title_list.html", entries=data)
+
+
+def _highlight(snippet: str | None) -> Markup:
+    start, end = Search.highlight
+    return (
+        escape(snippet or "")
+        .replace(start, Markup("<mark>"))
+        .replace(end, Markup("</mark>"))
+    )
+
+
+def search_results(
+    hits: list[SearchHit],
+    allow_redirect: bool = True,
+    next_page: str | None = None,
+    fragment: bool = False,
+) -> str:
+    """Render the hits of a search as a title list with their snippets.
+
+    ``next_page`` is the URL of the next hits, loaded by a "load more"
+    element. ``fragment`` renders only the hits, for such a next page.
+    """
+    if allow_redirect and len(hits) == 1:
+        return redirect(f"/entry/{hits[0].id}")
+    data = [(hit.id, hit.key, hit.title, _highlight(hit.snippet)) for hit in hits]
+    return render_template(
+        "entry/title_list.html", entries=data, next_page=next_page, fragment=fragment
+    )
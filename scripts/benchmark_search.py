@@ -0,0 +1,85 @@
+"""Benchmark of substring key lookups: LIKE scan against the trigram index.
+
+For every library size, a database of synthetic entries is built and the
+median latency of a few substring queries is measured both with
+``key LIKE '%query%'`` and with ``substring_filter``, which probes the
+trigram index ``entry_key_fts``.
+
+    python scripts/benchmark_search.py                 # 10k, 100k and 1M entries
+    python scripts/benchmark_search.py 10000 50000
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = pathlib.Path(__file__).absolute().parent.parent
+
+QUERIES = ["ani20", "smith", "2017b", "zzz"]
+REPEATS = 20
+_names = ["vaswani", "smith", "garcia", "mueller", "tanaka", "okafor", "rossi"]
+
+
+def build(db, entries: int) -> None:
+    with db.transaction() as transaction:
+        transaction.executemany(
+            "INSERT INTO entry (id, type, key, doi, title) VALUES (?, 1, ?, ?, 'Title')",
+            (
+                (
+                    uuid.uuid4(),
+                    f"{_names[i % len(_names)]}{1950 + i % 75}{i:07x}",
+                    f"10.{1000 + i % 9000}/{i}",
+                )
+                for i in range(entries)
+            ),
+        )
+    return
+
+
+def median_ms(db, sql: str, args: list) -> float:
+    durations = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        db.cursor.execute(sql, args).fetchall()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000]
+    )
+    args = parser.parse_args()
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    logging.disable(logging.WARNING)
+    from litman.db_connector import DB
+    from litman.search import substring_filter
+
+    print(f"{'entries':>9} {'query':<8} {'LIKE ms':>9} {'trigram ms':>11} {'rows':>7}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix="litman_benchmark_") as workdir:
+            db = DB(pathlib.Path(workdir) / "search.db")
+            build(db, size)
+            for query in QUERIES:
+                like = median_ms(
+                    db, "SELECT id FROM entry WHERE key LIKE ?", [f"%{query}%"]
+                )
+                condition, condition_args = substring_filter(query)
+                sql = f"SELECT id FROM entry WHERE {condition}"
+                trigram = median_ms(db, sql, condition_args)
+                rows = len(db.cursor.execute(sql, condition_args).fetchall())
+                print(f"{size:>9} {query:<8} {like:>9.2f} {trigram:>11.2f} {rows:>7}")
+            db.close()
+    return
+
+
+if __name__ == "__main__":
+    main()
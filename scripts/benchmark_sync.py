@@ -0,0 +1,340 @@
+"""Benchmarks for the synchronization between a client and the server.
+
+Every scenario runs in its own process. It builds a synthetic library on a
+fresh server, serves the web app on localhost as the ``main`` of a fresh
+client, and measures the sync stages of the client against it.
+
+Reported per stage are the wall time, the bytes sent to and received from
+the server, the peak RSS of the process and the number of SQL statements
+run on the client and the server.
+
+    python scripts/benchmark_sync.py                  # the default scenarios
+    python scripts/benchmark_sync.py edits_100k files
+    python scripts/benchmark_sync.py --json
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = pathlib.Path(__file__).absolute().parent.parent
+
+SCENARIOS = {
+    "bootstrap": {"entries": 10_000},
+    "edits_1k": {"entries": 10_000, "edits": 1_000},
+    "edits_10k": {"entries": 10_000, "edits": 10_000},
+    "edits_100k": {"entries": 100_000, "edits": 100_000},
+    "links": {"entries": 10_000, "links": 20_000},
+    "files": {"entries": 500, "files": 500, "file_size": 256 * 1024},
+    "export_import": {"entries": 10_000},
+}
+# The 100k scenario takes minutes, so it only runs when asked for.
+DEFAULT_SCENARIOS = [s for s in SCENARIOS if s != "edits_100k"]
+
+_result_marker = "BENCHMARK_RESULT "
+
+
+###
+### Setup
+###
+
+
+class _CountingInput:
+    def __init__(self, stream, counter):
+        self._stream = stream
+        self._counter = counter
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._counter.received += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._stream.readline(*args)
+        self._counter.received += len(data)
+        return data
+
+
+class WireCounter:
+    """WSGI middleware counting the bytes of requests and responses."""
+
+    def __init__(self, app):
+        self.app = app
+        self.received = 0
+        self.sent = 0
+
+    def __call__(self, environ, start_response):
+        environ["wsgi.input"] = _CountingInput(environ["wsgi.input"], self)
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                self.sent += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+def start_server(workdir: pathlib.Path):
+    """Serve the web app on localhost with a server config in ``workdir``."""
+    config_file = workdir / "server.toml"
+    config_file.write_text(
+        "[general]\n"
+        'editor = "true"\n'
+        'mode = "server"\n'
+        "[files]\n"
+        f'database_file = "{workdir / "server.db"}"\n'
+        f'file_storage_path = "{workdir / "server_files"}"\n'
+        f'tmp_storage = "{workdir}"\n'
+    )
+    os.environ["LITMAN_CONFIG"] = str(config_file)
+    from werkzeug.serving import make_server
+
+    import litman_web
+    from litman_cli.globals import get_globals
+
+    logging.getLogger("litman_web").setLevel(logging.WARNING)
+    counter = WireCounter(litman_web.app)
+    server = make_server("127.0.0.1", 0, counter, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config, db = get_globals()
+    return config, db, f"http://127.0.0.1:{server.server_port}", counter
+
+
+def new_client(workdir: pathlib.Path, main: str):
+    from box import Box
+
+    from litman.db_connector import DB
+
+    storage = workdir / "client_files"
+    storage.mkdir(exist_ok=True)
+    config = Box(
+        {
+            "general": {"mode": "client"},
+            "files": {"tmp_storage": workdir, "file_storage_path": storage},
+            "client": {"main": main, "user": "benchmark", "password": "benchmark"},
+        }
+    )
+    return config, DB(workdir / "client.db")
+
+
+def generate_library(config, db, entries: int, files: int = 0, file_size: int = 0):
+    """Fill a database with a synthetic library."""
+    rng = random.Random(entries)
+    words = ["graph", "neural", "sparse", "learning", "attention", "bayesian"]
+    entry_ids = [uuid.uuid4() for _ in range(entries)]
+    author_ids = [uuid.uuid4() for _ in range(max(1, entries // 4))]
+    keyword_ids = [uuid.uuid4() for _ in range(50)]
+    with db.transaction() as transaction:
+        transaction.executemany(
+            "INSERT INTO entry (id, type, key, title, year) VALUES (?, 1, ?, ?, ?)",
+            [
+                (id, f"key{i}", " ".join(rng.choices(words, k=6)), 1990 + i % 35)
+                for i, id in enumerate(entry_ids)
+            ],
+        )
+        transaction.executemany(
+            "INSERT INTO article (id, journal, volume) VALUES (?, 'Journal', ?)",
+            [(id, str(i % 40)) for i, id in enumerate(entry_ids)],
+        )
+        transaction.executemany(
+            "INSERT INTO author (id, first_name, last_name) VALUES (?, ?, ?)",
+            [(id, f"First{i}", f"Last{i}") for i, id in enumerate(author_ids)],
+        )
+        transaction.executemany(
+            "INSERT INTO author_link (author_id, entry_id) VALUES (?, ?)",
+            {(rng.choice(author_ids), id) for id in entry_ids for _ in range(2)},
+        )
+        transaction.executemany(
+            "INSERT INTO keyword (id, name) VALUES (?, ?)",
+            [(id, f"keyword{i}") for i, id in enumerate(keyword_ids)],
+        )
+        transaction.executemany(
+            "INSERT INTO keyword_link (keyword_id, entry_id) VALUES (?, ?)",
+            [(rng.choice(keyword_ids), id) for id in entry_ids],
+        )
+        file_rows = []
+        for i in range(files):
+            file_id = uuid.uuid4()
+            path = f"{file_id}.pdf"
+            (config.files.file_storage_path / path).write_bytes(os.urandom(file_size))
+            file_rows.append((file_id, path, entry_ids[i % entries]))
+        transaction.executemany(
+            "INSERT INTO file (id, path, type, default_open) VALUES (?, ?, 1, 1)",
+            [(id, path) for id, path, _ in file_rows],
+        )
+        transaction.executemany(
+            "INSERT INTO file_link (file_id, entry_id) VALUES (?, ?)",
+            [(id, entry_id) for id, _, entry_id in file_rows],
+        )
+    return entry_ids
+
+
+###
+### Scenarios
+###
+
+
+class Stage:
+    """Measure one stage of a scenario."""
+
+    def __init__(self, name: str, counter: WireCounter, dbs: list):
+        self.name = name
+        self.counter = counter
+        self.dbs = dbs
+
+    def __enter__(self):
+        for db in self.dbs:
+            db.flush_stats()
+            db.stats.reset()
+        self.received, self.sent = self.counter.received, self.counter.sent
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.start
+        for db in self.dbs:
+            db.flush_stats()
+        self.result = {
+            "stage": self.name,
+            "wall_s": round(self.wall, 3),
+            "sent_kb": round((self.counter.received - self.received) / 1024, 1),
+            "received_kb": round((self.counter.sent - self.sent) / 1024, 1),
+            "peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            "statements": [
+                sum(s.count for s in db.stats.statements()) for db in self.dbs
+            ],
+        }
+        return False
+
+
+def run_scenario(name: str, workdir: pathlib.Path) -> list[dict]:
+    from litman.synchronization import bootstrap_db, sync_client
+
+    params = SCENARIOS[name]
+    server_config, server_db, main, counter = start_server(workdir)
+    entry_ids = generate_library(
+        server_config,
+        server_db,
+        params["entries"],
+        params.get("files", 0),
+        params.get("file_size", 0),
+    )
+    client_config, client_db = new_client(workdir, main)
+    dbs = [client_db, server_db]
+    results = []
+    if name == "export_import":
+        with Stage("export", counter, dbs) as stage:
+            export = server_db.export_transactions(0)
+        results.append(stage.result)
+        with Stage("import", counter, dbs) as stage:
+            client_db.import_transactions(export)
+        results.append(stage.result)
+        return results
+    with Stage("bootstrap", counter, dbs) as stage:
+        bootstrap_db(client_config, client_db)
+    results.append(stage.result)
+    if "edits" in params:
+        with client_db.transaction() as transaction:
+            transaction.executemany(
+                "UPDATE entry SET title = title || ' (edited)' WHERE id = ?",
+                [(entry_ids[i % len(entry_ids)],) for i in range(params["edits"])],
+            )
+    if "links" in params:
+        keywords = [uuid.uuid4() for _ in range(20)]
+        with client_db.transaction() as transaction:
+            transaction.executemany(
+                "INSERT INTO keyword (id, name) VALUES (?, ?)",
+                [(id, f"benchmark{i}") for i, id in enumerate(keywords)],
+            )
+            transaction.executemany(
+                "INSERT OR IGNORE INTO keyword_link (keyword_id, entry_id) VALUES (?, ?)",
+                [
+                    (keywords[i % len(keywords)], entry_ids[i % len(entry_ids)])
+                    for i in range(params["links"])
+                ],
+            )
+            transaction.execute(
+                "DELETE FROM author_link WHERE rowid IN "
+                "(SELECT rowid FROM author_link LIMIT ?)",
+                (params["links"] // 4,),
+            )
+    if "edits" in params or "links" in params:
+        with Stage("sync", counter, dbs) as stage:
+            sync_client(client_config, client_db)
+        results.append(stage.result)
+    return results
+
+
+###
+### Runner
+###
+
+
+def _run_child(name: str) -> None:
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix="litman_benchmark_") as workdir:
+        results = run_scenario(name, pathlib.Path(workdir))
+    print(_result_marker + json.dumps(results), flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scenarios", nargs="*", help=", ".join(SCENARIOS))
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        _run_child(args.run)
+        return
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if not args.json:
+        print(
+            f"{'scenario':<14} {'stage':<10} {'wall s':>8} {'sent KB':>10} "
+            f"{'recv KB':>10} {'RSS MB':>8} {'statements (client/server)':>28}"
+        )
+    for name in args.scenarios or DEFAULT_SCENARIOS:
+        child = subprocess.run(
+            [sys.executable, __file__, "--run", name],
+            capture_output=True,
+            text=True,
+        )
+        lines = [
+            line
+            for line in child.stdout.splitlines()
+            if line.startswith(_result_marker)
+        ]
+        if child.returncode != 0 or not lines:
+            print(f"{name} failed:\n{child.stderr}", file=sys.stderr)
+            continue
+        for result in json.loads(lines[-1].removeprefix(_result_marker)):
+            if args.json:
+                print(json.dumps({"scenario": name, **result}))
+                continue
+            statements = "/".join(str(n) for n in result["statements"])
+            print(
+                f"{name:<14} {result['stage']:<10} {result['wall_s']:>8.2f} "
+                f"{result['sent_kb']:>10.1f} {result['received_kb']:>10.1f} "
+                f"{result['peak_rss_mb']:>8.1f} {statements:>28}"
+            )
+    return
+
+
+if __name__ == "__main__":
+    main()
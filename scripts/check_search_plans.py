@@ -0,0 +1,111 @@
+"""Check that the most selective filter drives the advanced search plans.
+
+A database of synthetic entries is built and ``EXPLAIN QUERY PLAN`` is run
+for a few combinations of filters. The outer loop of each plan has to look
+up ``entry`` by the driving filter, never scan it, and the table of the
+expected filter has to be searched first. Exits with status 1 on a bad plan.
+
+    python scripts/check_search_plans.py
+    python scripts/check_search_plans.py 50000
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import uuid
+
+ROOT = pathlib.Path(__file__).absolute().parent.parent
+
+_words = ["attention", "graph", "sparse", "kernel", "quantum", "protein", "robust"]
+
+
+def build(db, entries: int) -> tuple[list, list]:
+    keywords = [uuid.uuid4() for _ in range(20)]
+    collections = [uuid.uuid4() for _ in range(20)]
+    ids = [uuid.uuid4() for _ in range(entries)]
+    with db.transaction() as transaction:
+        transaction.executemany(
+            "INSERT INTO entry (id, type, key, doi, title, year) "
+            "VALUES (?, 1, ?, ?, ?, ?)",
+            (
+                (
+                    id,
+                    f"entry{i:07x}",
+                    f"10.1000/{i}" if i % 2 else None,
+                    f"{_words[i % len(_words)]} {_words[i // 7 % len(_words)]}",
+                    1950 + i % 75,
+                )
+                for i, id in enumerate(ids)
+            ),
+        )
+        transaction.executemany(
+            "INSERT INTO keyword (id, name) VALUES (?, ?)",
+            ((id, f"keyword{i}") for i, id in enumerate(keywords)),
+        )
+        transaction.executemany(
+            "INSERT INTO keyword_link (keyword_id, entry_id) VALUES (?, ?)",
+            ((keywords[i % len(keywords)], id) for i, id in enumerate(ids)),
+        )
+        transaction.executemany(
+            "INSERT INTO collection (id, name) VALUES (?, ?)",
+            ((id, f"collection{i}") for i, id in enumerate(collections)),
+        )
+        transaction.executemany(
+            "INSERT INTO collection_link (collection_id, entry_id) VALUES (?, ?)",
+            ((collections[i % len(collections)], id) for i, id in enumerate(ids)),
+        )
+    return keywords, collections
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("entries", nargs="?", type=int, default=10_000)
+    args = parser.parse_args()
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    logging.disable(logging.WARNING)
+    from litman.db_connector import DB
+    from litman.enums import EntryTypes
+    from litman.keywords import Keyword
+    from litman.search import AdvancedSearch
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="litman_plans_") as workdir:
+        db = DB(pathlib.Path(workdir) / "plans.db")
+        keywords, collections = build(db, args.entries)
+        keyword = Keyword(keywords[0], "keyword0")
+        # Each search, and the table its plan has to search first.
+        cases = [
+            (AdvancedSearch(title="attention"), "entry_fts"),
+            (AdvancedSearch(title='"unbalanced title:'), "entry_fts"),
+            (AdvancedSearch(title="graph", year_from=1960, has_doi=True), "entry_fts"),
+            (AdvancedSearch(author="smith", year_from=1960), "author_fts"),
+            (AdvancedSearch(keywords=[keyword], year_from=1960), "keyword_link"),
+            (
+                AdvancedSearch(
+                    collections=collections[:1], entry_types=[EntryTypes(1)]
+                ),
+                "collection_link",
+            ),
+            (AdvancedSearch(year_from=2000, year_to=2001, has_doi=False), "entry_year"),
+        ]
+        for search, expected in cases:
+            plan = search.explain(db)
+            scans = [line for line in plan if line.startswith("SCAN entry ")]
+            if not plan or scans or expected not in " ".join(plan[:3]):
+                failed = True
+                print(f"BAD  {expected:<16} {search.build_query()}")
+                for line in plan:
+                    print(f"     {line}")
+            else:
+                print(f"ok   {expected:<16} {plan[0]}")
+            search.search(db)
+        db.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+-- Indexes for the lookups done by the models and the sync.
+--
+-- The link tables never had any constraint, so duplicate links may exist.
+-- They are removed before the unique indexes are built. The link triggers
+-- log these deletes, which would remove the remaining link on the other
+-- side of a sync, so the log rows written here are dropped again.
+CREATE TEMP TABLE migration_mark AS
+    SELECT coalesce(max(rowid), 0) AS mark FROM transaction_log_link;
+
+DELETE FROM author_link WHERE rowid NOT IN (
+    SELECT min(rowid) FROM author_link GROUP BY author_id, entry_id
+);
+DELETE FROM keyword_link WHERE rowid NOT IN (
+    SELECT min(rowid) FROM keyword_link GROUP BY keyword_id, entry_id
+);
+DELETE FROM collection_link WHERE rowid NOT IN (
+    SELECT min(rowid) FROM collection_link GROUP BY entry_id, collection_id
+);
+DELETE FROM file_link WHERE rowid NOT IN (
+    SELECT min(rowid) FROM file_link GROUP BY file_id, entry_id
+);
+
+DELETE FROM transaction_log_link WHERE rowid > (SELECT mark FROM migration_mark);
+DROP TABLE migration_mark;
+
+-- Link tables: one unique index per direction of the lookup.
+CREATE UNIQUE INDEX author_link_entry ON author_link(entry_id, author_id);
+CREATE INDEX author_link_author ON author_link(author_id);
+CREATE UNIQUE INDEX keyword_link_entry ON keyword_link(entry_id, keyword_id);
+CREATE INDEX keyword_link_keyword ON keyword_link(keyword_id);
+CREATE UNIQUE INDEX collection_link_collection ON collection_link(collection_id, entry_id);
+CREATE INDEX collection_link_entry ON collection_link(entry_id);
+CREATE UNIQUE INDEX file_link_entry ON file_link(entry_id, file_id);
+CREATE INDEX file_link_file ON file_link(file_id);
+
+-- Entities
+--
+-- Keys were never unique either. All but the oldest entry of a key are
+-- renamed the way a sync renames an entry with a taken key, by appending
+-- the start of its id. The renames are logged, so peers get them too.
+UPDATE entry SET key = key || '-' || lower(substr(hex(id), 1, 6))
+WHERE rowid NOT IN (SELECT min(rowid) FROM entry GROUP BY key);
+CREATE UNIQUE INDEX entry_key ON entry(key);
+CREATE INDEX abstract_entry ON abstract(entry_id);
+CREATE INDEX author_name ON author(last_name, first_name);
+CREATE INDEX keyword_name ON keyword(name);
+
+-- Transaction logs
+CREATE INDEX transaction_log_source_date ON transaction_log(source, date);
+CREATE INDEX transaction_log_link_type_date ON transaction_log_link(type, date);
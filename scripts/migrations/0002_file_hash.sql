@@ -0,0 +1,9 @@
+-- Cache of the content hashes of the stored files, used for the file
+-- manifest during a sync. A hash is valid as long as size and mtime match.
+-- This table is local to each database and not synchronized.
+CREATE TABLE file_hash (
+    file_id uuid PRIMARY KEY,
+    size integer NOT NULL,
+    mtime_ns integer NOT NULL,
+    sha256 blob NOT NULL
+);
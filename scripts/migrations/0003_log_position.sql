@@ -0,0 +1,50 @@
+-- Positions in the transaction logs, used to bootstrap a client from a
+-- snapshot and the tail of the logs.
+--
+-- The logs are rebuilt with an AUTOINCREMENT key, so a position is never
+-- reused after compaction deleted the newest rows. The triggers writing the
+-- logs refer to them by name, so the renames must not check the triggers.
+PRAGMA legacy_alter_table = ON;
+CREATE TABLE transaction_log_new (
+    seq integer PRIMARY KEY AUTOINCREMENT,
+    id uuid,
+    source text,
+    date integer,
+    type integer
+);
+INSERT INTO transaction_log_new (seq, id, source, date, type)
+    SELECT rowid, id, source, date, type FROM transaction_log ORDER BY rowid;
+DROP TABLE transaction_log;
+ALTER TABLE transaction_log_new RENAME TO transaction_log;
+CREATE INDEX transaction_log_source_date ON transaction_log (source, date);
+
+CREATE TABLE transaction_log_link_new (
+    seq integer PRIMARY KEY AUTOINCREMENT,
+    id_left uuid,
+    id_right uuid,
+    source text,
+    date integer,
+    type integer
+);
+INSERT INTO transaction_log_link_new (seq, id_left, id_right, source, date, type)
+    SELECT rowid, id_left, id_right, source, date, type
+    FROM transaction_log_link ORDER BY rowid;
+DROP TABLE transaction_log_link;
+ALTER TABLE transaction_log_link_new RENAME TO transaction_log_link;
+CREATE INDEX transaction_log_link_type_date ON transaction_log_link (type, date);
+PRAGMA legacy_alter_table = OFF;
+
+-- The server position a client synchronized to.
+ALTER TABLE sync_log ADD COLUMN log_position integer;
+ALTER TABLE sync_log ADD COLUMN link_position integer;
+
+-- The oldest position the logs can be replayed from. Compaction rewrites
+-- the history before it, so every compaction moves the horizon forward.
+CREATE TABLE log_horizon (
+    log_position integer NOT NULL,
+    link_position integer NOT NULL
+);
+INSERT INTO log_horizon VALUES (
+    (SELECT coalesce(max(seq), 0) FROM transaction_log),
+    (SELECT coalesce(max(seq), 0) FROM transaction_log_link)
+);
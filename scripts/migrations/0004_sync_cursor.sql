@@ -0,0 +1,21 @@
+-- Per client sync state.
+--
+-- Changes imported from a peer are logged with the identity of that peer
+-- as origin, so they are never sent back to it.
+ALTER TABLE transaction_log ADD COLUMN origin uuid;
+ALTER TABLE transaction_log_link ADD COLUMN origin uuid;
+ALTER TABLE sync_log ADD COLUMN origin uuid;
+
+-- The identity of this database in a sync.
+CREATE TABLE sync_identity (
+    id uuid NOT NULL
+);
+INSERT INTO sync_identity VALUES (randomblob(16));
+
+-- On the server, the log position each client acknowledged.
+CREATE TABLE sync_cursor (
+    client_id uuid PRIMARY KEY,
+    log_position integer NOT NULL,
+    link_position integer NOT NULL,
+    date integer NOT NULL
+);
@@ -0,0 +1,85 @@
+-- One full text index for the ranked search over all fields of an entry.
+--
+-- The rowid of an indexed row is the rowid of its entry. The index stores
+-- its own content, as abstracts and authors live in other tables, and is
+-- kept up to date by the triggers below.
+CREATE VIRTUAL TABLE search_fts USING fts5(key, title, abstract, authors);
+
+-- The author names of each entry, as they are indexed.
+CREATE VIEW entry_authors (entry_id, authors) AS
+    SELECT l.entry_id, group_concat(
+        coalesce(a.first_name || ' ', '') || coalesce(a.suffix || ' ', '') || a.last_name, ' '
+    )
+    FROM author_link l JOIN author a ON a.id = l.author_id
+    GROUP BY l.entry_id;
+
+CREATE VIEW entry_abstracts (entry_id, abstract) AS
+    SELECT entry_id, group_concat(abstract, ' ') FROM abstract GROUP BY entry_id;
+
+-- Entries
+CREATE TRIGGER search_entry_ai AFTER INSERT ON entry BEGIN
+    INSERT INTO search_fts (rowid, key, title, abstract, authors) VALUES (
+        new.rowid,
+        new.key,
+        new.title,
+        (SELECT abstract FROM entry_abstracts WHERE entry_id = new.id),
+        (SELECT authors FROM entry_authors WHERE entry_id = new.id)
+    );
+END;
+CREATE TRIGGER search_entry_au AFTER UPDATE OF key, title ON entry BEGIN
+    UPDATE search_fts SET key = new.key, title = new.title WHERE rowid = new.rowid;
+END;
+CREATE TRIGGER search_entry_ad AFTER DELETE ON entry BEGIN
+    DELETE FROM search_fts WHERE rowid = old.rowid;
+END;
+
+-- Abstracts
+CREATE TRIGGER search_abstract_ai AFTER INSERT ON abstract BEGIN
+    UPDATE search_fts SET abstract = (
+        SELECT abstract FROM entry_abstracts WHERE entry_id = new.entry_id
+    ) WHERE rowid = (SELECT rowid FROM entry WHERE id = new.entry_id);
+END;
+CREATE TRIGGER search_abstract_au AFTER UPDATE ON abstract BEGIN
+    UPDATE search_fts SET abstract = (
+        SELECT abstract FROM entry_abstracts WHERE entry_id = new.entry_id
+    ) WHERE rowid = (SELECT rowid FROM entry WHERE id = new.entry_id);
+END;
+CREATE TRIGGER search_abstract_ad AFTER DELETE ON abstract BEGIN
+    UPDATE search_fts SET abstract = (
+        SELECT abstract FROM entry_abstracts WHERE entry_id = old.entry_id
+    ) WHERE rowid = (SELECT rowid FROM entry WHERE id = old.entry_id);
+END;
+
+-- Authors, through their links and their names.
+CREATE TRIGGER search_author_link_ai AFTER INSERT ON author_link BEGIN
+    UPDATE search_fts SET authors = (
+        SELECT authors FROM entry_authors WHERE entry_id = new.entry_id
+    ) WHERE rowid = (SELECT rowid FROM entry WHERE id = new.entry_id);
+END;
+CREATE TRIGGER search_author_link_ad AFTER DELETE ON author_link BEGIN
+    UPDATE search_fts SET authors = (
+        SELECT authors FROM entry_authors WHERE entry_id = old.entry_id
+    ) WHERE rowid = (SELECT rowid FROM entry WHERE id = old.entry_id);
+END;
+CREATE TRIGGER search_author_au AFTER UPDATE ON author BEGIN
+    UPDATE search_fts SET authors = (
+        SELECT authors FROM entry_authors WHERE entry_id = e.id
+    )
+    FROM entry e
+    WHERE e.rowid = search_fts.rowid
+        AND e.id IN (SELECT entry_id FROM author_link WHERE author_id = new.id);
+END;
+CREATE TRIGGER search_author_ad AFTER DELETE ON author BEGIN
+    UPDATE search_fts SET authors = (
+        SELECT authors FROM entry_authors WHERE entry_id = e.id
+    )
+    FROM entry e
+    WHERE e.rowid = search_fts.rowid
+        AND e.id IN (SELECT entry_id FROM author_link WHERE author_id = old.id);
+END;
+
+INSERT INTO search_fts (rowid, key, title, abstract, authors)
+    SELECT e.rowid, e.key, e.title, ab.abstract, au.authors
+    FROM entry e
+    LEFT JOIN entry_abstracts ab ON ab.entry_id = e.id
+    LEFT JOIN entry_authors au ON au.entry_id = e.id;
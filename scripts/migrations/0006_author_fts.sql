@@ -0,0 +1,23 @@
+-- Full text index over the names of authors, for the author filter of the
+-- advanced search.
+CREATE VIRTUAL TABLE author_fts USING fts5(
+    first_name, suffix, last_name, content='author'
+);
+
+-- Triggers to keep the FTS index up to date.
+CREATE TRIGGER author_fts_ai AFTER INSERT ON author BEGIN
+    INSERT INTO author_fts (rowid, first_name, suffix, last_name)
+        VALUES (new.rowid, new.first_name, new.suffix, new.last_name);
+END;
+CREATE TRIGGER author_fts_ad AFTER DELETE ON author BEGIN
+    INSERT INTO author_fts (author_fts, rowid, first_name, suffix, last_name)
+        VALUES ('delete', old.rowid, old.first_name, old.suffix, old.last_name);
+END;
+CREATE TRIGGER author_fts_au AFTER UPDATE ON author BEGIN
+    INSERT INTO author_fts (author_fts, rowid, first_name, suffix, last_name)
+        VALUES ('delete', old.rowid, old.first_name, old.suffix, old.last_name);
+    INSERT INTO author_fts (rowid, first_name, suffix, last_name)
+        VALUES (new.rowid, new.first_name, new.suffix, new.last_name);
+END;
+
+INSERT INTO author_fts (author_fts) VALUES ('rebuild');
@@ -0,0 +1,21 @@
+-- Trigram index over citation keys and DOIs, so substring lookups are
+-- index probes instead of a scan of the entries.
+CREATE VIRTUAL TABLE entry_key_fts USING fts5(
+    key, doi, content='entry', tokenize='trigram'
+);
+
+-- Triggers to keep the FTS index up to date.
+CREATE TRIGGER entry_key_fts_ai AFTER INSERT ON entry BEGIN
+    INSERT INTO entry_key_fts (rowid, key, doi) VALUES (new.rowid, new.key, new.doi);
+END;
+CREATE TRIGGER entry_key_fts_ad AFTER DELETE ON entry BEGIN
+    INSERT INTO entry_key_fts (entry_key_fts, rowid, key, doi)
+        VALUES ('delete', old.rowid, old.key, old.doi);
+END;
+CREATE TRIGGER entry_key_fts_au AFTER UPDATE OF key, doi ON entry BEGIN
+    INSERT INTO entry_key_fts (entry_key_fts, rowid, key, doi)
+        VALUES ('delete', old.rowid, old.key, old.doi);
+    INSERT INTO entry_key_fts (rowid, key, doi) VALUES (new.rowid, new.key, new.doi);
+END;
+
+INSERT INTO entry_key_fts (entry_key_fts) VALUES ('rebuild');
@@ -0,0 +1,7 @@
+-- Indexes matching the sort keys of the paginated lists, so every page is
+-- read with a seek into the index.
+--
+-- Authors are sorted by last and first name, with missing first names
+-- sorted as empty ones.
+CREATE INDEX author_sort ON author(last_name, ifnull(first_name, ''));
+CREATE INDEX collection_name ON collection(name);
@@ -0,0 +1,2 @@
+-- Index for the year range filter of the advanced search.
+CREATE INDEX entry_year ON entry(year);
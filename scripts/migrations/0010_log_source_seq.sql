@@ -0,0 +1,3 @@
+-- Exports read the log of one table after a position. This index lets
+-- them seek that rowid range instead of scanning the table's history.
+CREATE INDEX transaction_log_source_seq ON transaction_log(source, seq);
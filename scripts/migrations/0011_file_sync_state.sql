@@ -0,0 +1,7 @@
+-- The hash of each file the client and the server agreed on in the last
+-- file sync. A side whose hash still matches it did not change the file,
+-- which decides the direction of a transfer. Local to each database.
+CREATE TABLE file_sync_state (
+    file_id uuid PRIMARY KEY,
+    sha256 blob NOT NULL
+);
@@ -0,0 +1,18 @@
+-- Log a change of an abstract as an update of its entry, so the search
+-- cache and the related entries that follow the log see it. Abstracts of
+-- entries that no longer exist are not logged.
+CREATE TRIGGER abstract_log_ai AFTER INSERT ON abstract BEGIN
+    INSERT INTO transaction_log (id, source, date, type)
+        SELECT new.entry_id, 'entry', unixepoch(), 2
+        WHERE EXISTS (SELECT 1 FROM entry WHERE id = new.entry_id);
+END;
+CREATE TRIGGER abstract_log_au AFTER UPDATE ON abstract BEGIN
+    INSERT INTO transaction_log (id, source, date, type)
+        SELECT new.entry_id, 'entry', unixepoch(), 2
+        WHERE EXISTS (SELECT 1 FROM entry WHERE id = new.entry_id);
+END;
+CREATE TRIGGER abstract_log_ad AFTER DELETE ON abstract BEGIN
+    INSERT INTO transaction_log (id, source, date, type)
+        SELECT old.entry_id, 'entry', unixepoch(), 2
+        WHERE EXISTS (SELECT 1 FROM entry WHERE id = old.entry_id);
+END;